@@ -4,11 +4,11 @@ PricingFunction
 
 
 import json
-import math
 from typing import List
 import os
 from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
 from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
+from ecom import pricing as delivery_pricing # pylint: disable=import-error
 from ecom.apigateway import iam_user_id, response # pylint: disable=import-error
 
 
@@ -19,30 +19,11 @@ logger = Logger() # pylint: disable=invalid-name
 tracer = Tracer() # pylint: disable=invalid-name
 
 
-# 50*50*50 cm cube
-BOX_VOLUME = 500*500*500
-# 12kg per box
-BOX_WEIGHT = 12000
-
-
-COUNTRY_SHIPPING_FEES = {
-    # Nordics countries
-    "DK":    0, "FI":    0, "NO":    0, "SE":    0,
-
-    # Other EU countries
-    "AT": 1000, "BE": 1000, "BG": 1000, "CY": 1000,
-    "CZ": 1000, "DE": 1000, "EE": 1000, "ES": 1000,
-    "FR": 1000, "GR": 1000, "HR": 1000, "HU": 1000,
-    "IE": 1000, "IT": 1000, "LT": 1000, "LU": 1000,
-    "LV": 1000, "MT": 1000, "NL": 1000, "PO": 1000,
-    "PT": 1000, "RO": 1000, "SI": 1000, "SK": 1000,
-
-    # North America
-    "CA": 1500, "US": 1500,
-
-    # Rest of the world
-    "*": 2500
-}
+# Rate table, shared with other services through ecom.pricing
+RATE_TABLE_VERSION = delivery_pricing.RATE_TABLE_VERSION
+BOX_VOLUME = delivery_pricing.BOX_VOLUME
+BOX_WEIGHT = delivery_pricing.BOX_WEIGHT
+COUNTRY_SHIPPING_FEES = delivery_pricing.COUNTRY_SHIPPING_FEES
 
 
 @tracer.capture_method
@@ -51,10 +32,7 @@ def count_boxes(packages: List[dict]) -> int:
     Count number of boxes based on the product packaging
     """
 
-    volume = sum([p["width"]*p["length"]*p["height"] for p in packages])
-    weight = sum([p["weight"] for p in packages])
-
-    return max(math.ceil(volume/BOX_VOLUME), math.ceil(weight/BOX_WEIGHT))
+    return delivery_pricing.count_boxes(packages, BOX_VOLUME, BOX_WEIGHT)
 
 
 @tracer.capture_method
@@ -63,7 +41,7 @@ def get_shipping_cost(address: dict) -> int:
     Get the shipping cost per box
     """
 
-    return COUNTRY_SHIPPING_FEES.get(address["country"], COUNTRY_SHIPPING_FEES["*"])
+    return delivery_pricing.get_shipping_cost(address, COUNTRY_SHIPPING_FEES)
 
 
 @tracer.capture_method
@@ -111,5 +89,6 @@ def handler(event, _):
 
     # Send the response back
     return response({
-        "pricing": pricing
+        "pricing": pricing,
+        "version": RATE_TABLE_VERSION
     })
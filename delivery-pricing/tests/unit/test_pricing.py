@@ -108,6 +108,7 @@ def test_handler(monkeypatch, lambda_module, context, apigateway_event, order):
     body = json.loads(retval["body"])
     assert "pricing" in body
     assert body["pricing"] == 1000
+    assert body["version"] == lambda_module.RATE_TABLE_VERSION
 
 
 def test_handler_no_iam(lambda_module, context, apigateway_event, order):
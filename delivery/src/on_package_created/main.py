@@ -5,19 +5,22 @@ OnPackageCreatedFunction
 
 import os
 from typing import Optional
-from urllib.parse import urlparse
 import boto3
-import requests # pylint: disable=import-error
-from aws_requests_auth.boto_utils import BotoAWSRequestsAuth # pylint: disable=import-error
 from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
 from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
 from aws_lambda_powertools import Metrics
 from aws_lambda_powertools.metrics import MetricUnit
+from ecom import backend # pylint: disable=import-error
+from ecom.circuitbreaker import CircuitBreaker # pylint: disable=import-error
 
 
 ENVIRONMENT = os.environ["ENVIRONMENT"]
 ORDERS_API_URL = os.environ["ORDERS_API_URL"]
+# Only the orderId and address are needed to create a shipping request
+ORDER_FIELDS = ["address"]
 TABLE_NAME = os.environ["TABLE_NAME"]
+# Optional table to share the circuit breaker state across execution environments
+CIRCUIT_BREAKER_TABLE_NAME = os.environ.get("CIRCUIT_BREAKER_TABLE_NAME")
 
 
 dynamodb = boto3.resource("dynamodb") # pylint: disable=invalid-name
@@ -25,10 +28,14 @@ table = dynamodb.Table(TABLE_NAME) # pylint: disable=invalid-name,no-member
 logger = Logger() # pylint: disable=invalid-name
 tracer = Tracer() # pylint: disable=invalid-name
 metrics = Metrics(namespace="ecommerce.delivery", service="delivery")
+breaker = CircuitBreaker( # pylint: disable=invalid-name
+    "orders",
+    table=dynamodb.Table(CIRCUIT_BREAKER_TABLE_NAME) if CIRCUIT_BREAKER_TABLE_NAME else None # pylint: disable=no-member
+)
 
 
 @tracer.capture_method
-def get_order(order_id: str) -> Optional[dict]:
+def get_order(order_id: str, context=None) -> Optional[dict]:
     """
     Retrieve the order from ther Orders service
     """
@@ -38,16 +45,29 @@ def get_order(order_id: str) -> Optional[dict]:
         "orderId": order_id
     })
 
-    # Create IAM signature helper
-    request_url = ORDERS_API_URL + order_id
-    url = urlparse(request_url)
-    region = boto3.session.Session().region_name
-    auth = BotoAWSRequestsAuth(aws_host=url.netloc,
-                               aws_region=region,
-                               aws_service='execute-api')
+    if not breaker.allow_request():
+        logger.warning({
+            "message": "Circuit open for the Orders service, skipping order {}".format(order_id),
+            "orderId": order_id
+        })
+        metrics.add_metric(name="ordersCircuitOpen", unit=MetricUnit.Count, value=1)
+        return None
 
     # Send request to order service
-    response = requests.get(request_url, auth=auth)
+    try:
+        response = backend.get(
+            "{}{}?fields={}".format(ORDERS_API_URL, order_id, ",".join(ORDER_FIELDS)),
+            context=context
+        )
+    except Exception:
+        breaker.record_failure()
+        raise
+
+    # Client errors mean that the service is available
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
 
     if response.status_code != 200:
         logger.error({
@@ -127,7 +147,7 @@ def handler(event, context):
     })
 
     # Retrieve order from order service
-    order = get_order(order_id)
+    order = get_order(order_id, context)
 
     if order is None:
         logger.warning({
@@ -4,7 +4,6 @@ TableUpdateFunction
 
 
 import datetime
-import json
 import os
 import warnings
 from typing import List, Optional
@@ -14,7 +13,8 @@ from aws_lambda_powertools.tracing import Tracer
 from aws_lambda_powertools.logging.logger import Logger
 from aws_lambda_powertools import Metrics
 from aws_lambda_powertools.metrics import MetricUnit
-from ecom.helpers import Encoder
+from ecom.eventbridge import publish_events
+from ecom.helpers import dumps
 
 
 ENVIRONMENT = os.environ["ENVIRONMENT"]
@@ -35,12 +35,10 @@ def send_events(events: List[dict]):
     """
 
     logger.info("Sending %d events to EventBridge", len(events))
-    # EventBridge only supports batches of up to 10 events
-    for i in range(0, len(events), 10):
-        eventbridge.put_events(Entries=events[i:i+10])
+    publish_events(eventbridge, events, logger=logger, raise_on_failure=True)
 
 
-def process_record(record: dict) -> Optional[dict]:
+def process_record(record: dict, now: Optional[datetime.datetime] = None) -> Optional[dict]:
     """
     Process record from DynamoDB
 
@@ -52,8 +50,17 @@ def process_record(record: dict) -> Optional[dict]:
     """
     # pylint: disable=no-else-return
 
+    # INSERT records
+    # These events are just discarded
+    if record["eventName"].upper() == "INSERT":
+        logger.debug({
+            "message": "Ignoring INSERT record",
+            "record": record
+        })
+        return None
+
     event = {
-        "Time": datetime.datetime.now(),
+        "Time": now or datetime.datetime.now(),
         "Source": "ecommerce.delivery",
         "Resources": [
             deserialize(record["dynamodb"]["Keys"]["orderId"])
@@ -61,27 +68,18 @@ def process_record(record: dict) -> Optional[dict]:
         "EventBusName": EVENT_BUS_NAME
     }
     if record["dynamodb"].get("OldImage", None) is not None:
-        event["Detail"] = json.dumps({
+        event["Detail"] = dumps({
             "orderId": deserialize(record["dynamodb"]["OldImage"]["orderId"]),
             "address": deserialize(record["dynamodb"]["OldImage"]["address"])
-        }, cls=Encoder)
+        })
     else:
-        event["Detail"] = json.dumps({
+        event["Detail"] = dumps({
             "orderId": deserialize(record["dynamodb"]["NewImage"]["orderId"]),
             "address": deserialize(record["dynamodb"]["NewImage"]["address"])
-        }, cls=Encoder)
-
-    # INSERT records
-    # These events are just discarded
-    if record["eventName"].upper() == "INSERT":
-        logger.debug({
-            "message": "Ignoring INSERT record",
-            "record": record
         })
-        return None
 
     # REMOVE records
-    elif record["eventName"].upper() == "REMOVE":
+    if record["eventName"].upper() == "REMOVE":
         if deserialize(record["dynamodb"]["OldImage"]["status"]) in ["COMPLETED", "FAILED"]:
             logger.debug({
                 "message": "Ignoring REMOVE of completed record",
@@ -147,8 +145,10 @@ def handler(event, _):
         "records": event.get("Records", [])
     })
 
+    # All events in the batch share the same timestamp
+    now = datetime.datetime.now()
     events = [
-        process_record(record)
+        process_record(record, now)
         for record in event.get("Records", [])
     ]
     events = [event for event in events if event is not None]
@@ -71,7 +71,7 @@ def test_get_order(lambda_module, order, url):
     assert m.called
     assert m.call_count == 1
     assert m.request_history[0].method == "GET"
-    assert m.request_history[0].url == url
+    assert m.request_history[0].url == url + "?fields=address"
     assert response == order
 
 
@@ -87,10 +87,29 @@ def test_get_order_empty(lambda_module, order, url):
     assert m.called
     assert m.call_count == 1
     assert m.request_history[0].method == "GET"
-    assert m.request_history[0].url == url
+    assert m.request_history[0].url == url + "?fields=address"
     assert response is None
 
 
+def test_get_order_circuit_open(monkeypatch, lambda_module, order, url):
+    """
+    Test get_order() when the Orders service keeps failing
+    """
+
+    breaker = lambda_module.CircuitBreaker("orders", failure_threshold=2)
+    monkeypatch.setattr(lambda_module, "breaker", breaker)
+
+    with requests_mock.Mocker() as m:
+        m.get(url, status_code=503, text=json.dumps({"message": "Service unavailable"}))
+        for _ in range(3):
+            response = lambda_module.get_order(order["orderId"])
+            assert response is None
+
+    # The third call failed fast
+    assert m.call_count == 2
+    assert breaker.state == "OPEN"
+
+
 def test_save_shipping_request(lambda_module, order, ddb_item):
     """
     Test save_shipping_request()
@@ -162,7 +181,7 @@ def test_handler(lambda_module, event, context, order, url, ddb_item):
     assert m.called
     assert m.call_count == 1
     assert m.request_history[0].method == "GET"
-    assert m.request_history[0].url == url
+    assert m.request_history[0].url == url + "?fields=address"
 
     table.assert_no_pending_responses()
     table.deactivate()
@@ -217,4 +236,4 @@ def test_handler_wrong_order(lambda_module, event, context, order, url):
     assert m.called
     assert m.call_count == 1
     assert m.request_history[0].method == "GET"
-    assert m.request_history[0].url == url
\ No newline at end of file
+    assert m.request_history[0].url == url + "?fields=address"
\ No newline at end of file
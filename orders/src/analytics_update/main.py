@@ -0,0 +1,259 @@
+"""
+AnalyticsUpdateFunction
+"""
+
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import boto3
+from botocore.exceptions import ClientError
+from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
+from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
+from ecom.dynamodb import deserialize # pylint: disable=import-error
+
+
+ENVIRONMENT = os.environ["ENVIRONMENT"]
+ANALYTICS_TABLE_NAME = os.environ["ANALYTICS_TABLE_NAME"]
+# Maximum number of counters updated concurrently
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", "10"))
+UPDATE_ATTEMPTS = 3
+UPDATE_BACKOFF = 0.1
+# How long batch markers are kept, in seconds. This must be longer than the
+# stream retention period (24 hours).
+MARKER_TTL = 2*24*60*60
+
+
+dynamodb = boto3.resource("dynamodb") # pylint: disable=invalid-name
+table = dynamodb.Table(ANALYTICS_TABLE_NAME) # pylint: disable=invalid-name,no-member
+logger = Logger() # pylint: disable=invalid-name
+tracer = Tracer() # pylint: disable=invalid-name
+
+
+# Counter deltas, as {(view, bucket): {attribute: delta}}
+Deltas = Dict[Tuple[str, str], Dict[str, int]]
+
+
+def get_bucket(date: str) -> str:
+    """
+    Returns the hourly time bucket for an ISO 8601 date
+    """
+
+    # e.g. "2020-01-23T10:53:49.131052" -> "2020-01-23T10"
+    return date[:13]
+
+
+def _get(image: dict, key: str) -> Optional[object]:
+    """
+    Returns a single attribute from a stream record image
+    """
+
+    if key not in image:
+        return None
+    return deserialize(image[key], use_int=True)
+
+
+def _country(image: dict) -> Optional[str]:
+    """
+    Returns the delivery country from a stream record image
+    """
+
+    try:
+        return image["address"]["M"]["country"]["S"]
+    except KeyError:
+        return None
+
+
+def add_order(deltas: Deltas, image: dict, sign: int) -> None:
+    """
+    Add or remove an order from the counters
+    """
+
+    bucket = get_bucket(_get(image, "createdDate"))
+    total = _get(image, "total") or 0
+    status = _get(image, "status")
+
+    for view in ["total", "country#{}".format(_country(image))]:
+        deltas[(view, bucket)]["orders"] += sign
+        deltas[(view, bucket)]["revenue"] += sign * total
+    if status is not None:
+        deltas[("current", status)]["orders"] += sign
+
+
+def modify_order(deltas: Deltas, old_image: dict, new_image: dict) -> None:
+    """
+    Update the counters for a modified order
+    """
+
+    # Revenue changes are attributed to the creation time of the order
+    old_total = _get(old_image, "total") or 0
+    new_total = _get(new_image, "total") or 0
+    if old_total != new_total:
+        bucket = get_bucket(_get(new_image, "createdDate"))
+        for view in ["total", "country#{}".format(_country(new_image))]:
+            deltas[(view, bucket)]["revenue"] += new_total - old_total
+
+    old_status = _get(old_image, "status")
+    new_status = _get(new_image, "status")
+    if old_status != new_status:
+        if old_status is not None:
+            deltas[("current", old_status)]["orders"] -= 1
+        if new_status is not None:
+            deltas[("current", new_status)]["orders"] += 1
+            # Transitions are attributed to the time of the change
+            bucket = get_bucket(_get(new_image, "modifiedDate") or _get(new_image, "createdDate"))
+            deltas[("status#{}".format(new_status), bucket)]["orders"] += 1
+
+
+def aggregate(ddb_records: Iterable[dict]) -> Deltas:
+    """
+    Aggregate the counter deltas for a batch of stream records
+
+    Only the attributes used by the counters are deserialized.
+    """
+
+    deltas: Deltas = defaultdict(lambda: defaultdict(int))
+
+    for ddb_record in ddb_records:
+        event_name = ddb_record["eventName"].upper()
+        if event_name == "INSERT":
+            add_order(deltas, ddb_record["dynamodb"]["NewImage"], 1)
+        elif event_name == "REMOVE":
+            add_order(deltas, ddb_record["dynamodb"]["OldImage"], -1)
+        elif event_name == "MODIFY":
+            modify_order(deltas, ddb_record["dynamodb"]["OldImage"], ddb_record["dynamodb"]["NewImage"])
+
+    # Drop counters that cancel out within the batch
+    return {
+        key: {k: v for k, v in values.items() if v != 0}
+        for key, values in deltas.items()
+        if any(v != 0 for v in values.values())
+    }
+
+
+def get_batch_id(ddb_records: List[dict]) -> str:
+    """
+    Returns an identifier for a batch of stream records
+
+    Lambda retries a failed batch with the same records, so the retries share
+    the same identifier.
+    """
+
+    return "{}-{}".format(
+        ddb_records[0]["dynamodb"]["SequenceNumber"],
+        ddb_records[-1]["dynamodb"]["SequenceNumber"]
+    )
+
+
+def update_counter(view: str, bucket: str, values: Dict[str, int], batch_id: str) -> bool:
+    """
+    Apply deltas to a counter with an atomic ADD update
+
+    The update is written in a transaction with a marker item for the batch
+    and the counter, so that a retried batch does not apply the same deltas
+    twice. This returns False if the deltas were already applied.
+    """
+
+    names = list(values.keys())
+    try:
+        table.meta.client.transact_write_items(TransactItems=[
+            {"Put": {
+                "TableName": ANALYTICS_TABLE_NAME,
+                "Item": {
+                    "view": "batch#{}".format(batch_id),
+                    "bucket": "{}#{}".format(view, bucket),
+                    "expiresAt": int(time.time()) + MARKER_TTL
+                },
+                "ConditionExpression": "attribute_not_exists(#v)",
+                "ExpressionAttributeNames": {"#v": "view"}
+            }},
+            {"Update": {
+                "TableName": ANALYTICS_TABLE_NAME,
+                "Key": {"view": view, "bucket": bucket},
+                "UpdateExpression": "ADD {}".format(", ".join(
+                    "#a{0} :a{0}".format(i) for i in range(len(names))
+                )),
+                "ExpressionAttributeNames": {"#a{}".format(i): name for i, name in enumerate(names)},
+                "ExpressionAttributeValues": {":a{}".format(i): values[name] for i, name in enumerate(names)}
+            }}
+        ])
+    except ClientError as exc:
+        reasons = exc.response.get("CancellationReasons", [])
+        if reasons and reasons[0].get("Code") == "ConditionalCheckFailed":
+            return False
+        raise
+
+    return True
+
+
+@tracer.capture_method
+def update_counters(deltas: Deltas, batch_id: str) -> List[Tuple[str, str]]:
+    """
+    Apply counter deltas concurrently
+
+    Counters that failed to update are retried with a jittered exponential
+    backoff, for up to UPDATE_ATTEMPTS rounds. This returns the keys of the
+    counters that could not be updated.
+    """
+
+    def _update(key: Tuple[str, str]) -> Optional[Tuple[str, str]]:
+        try:
+            if not update_counter(key[0], key[1], deltas[key], batch_id):
+                logger.info({
+                    "message": "Counter {} {} already updated for batch {}".format(*key, batch_id),
+                    "view": key[0],
+                    "bucket": key[1],
+                    "batchId": batch_id
+                })
+        except Exception as exc: # pylint: disable=broad-except
+            logger.warning({
+                "message": "Failed to update counter {} {}".format(*key),
+                "view": key[0],
+                "bucket": key[1],
+                "exception": str(exc)
+            })
+            return key
+        return None
+
+    pending = list(deltas.keys())
+    with ThreadPoolExecutor(max_workers=UPDATE_WORKERS) as executor:
+        for attempt in range(UPDATE_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(random.uniform(0, UPDATE_BACKOFF * 2**(attempt-1)))
+            pending = [key for key in executor.map(_update, pending) if key is not None]
+            if not pending:
+                break
+
+    return pending
+
+
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def handler(event, _):
+    """
+    Lambda function handler for Orders Table stream
+    """
+
+    records = event.get("Records", [])
+    if not records:
+        return
+    deltas = aggregate(records)
+
+    logger.info({
+        "message": "Updating {} counters from {} records".format(len(deltas), len(records)),
+        "counters": len(deltas),
+        "records": len(records)
+    })
+
+    failed = update_counters(deltas, get_batch_id(records))
+    if failed:
+        # Counters that were already updated skip the deltas when the batch is
+        # retried.
+        logger.error({
+            "message": "Failed to update {} counters".format(len(failed)),
+            "failed": failed
+        })
+        raise Exception("Failed to update {} counters".format(len(failed)))
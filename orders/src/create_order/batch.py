@@ -0,0 +1,320 @@
+"""
+BatchCreateOrdersFunction
+"""
+
+
+import asyncio
+import os
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+import boto3
+from botocore.exceptions import ClientError
+from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
+from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
+from aws_lambda_powertools import Metrics # pylint: disable=import-error
+from aws_lambda_powertools.metrics import MetricUnit # pylint: disable=import-error
+from ecom import aiobackend # pylint: disable=import-error
+from ecom.helpers import dumps # pylint: disable=import-error
+from validation import (
+    PRODUCTS_API_URL, call_backend, check_delivery_pricing, check_event, error_response,
+    get_delivery_pricing, local_pricing_available, prepare_order, product_cache,
+    product_fingerprint, validate_payment
+)
+
+
+ENVIRONMENT = os.environ["ENVIRONMENT"]
+TABLE_NAME = os.environ["TABLE_NAME"]
+# Maximum number of products sent in one request to the products service
+PRODUCTS_BATCH_SIZE = 100
+# Maximum number of items in a batch_write_item request
+BATCH_WRITE_SIZE = 25
+# Maximum number of batch_write_item calls for a set of items
+BATCH_WRITE_ATTEMPTS = 5
+
+
+dynamodb = boto3.resource("dynamodb") # pylint: disable=invalid-name
+logger = Logger() # pylint: disable=invalid-name
+tracer = Tracer() # pylint: disable=invalid-name
+metrics = Metrics(namespace="ecommerce.orders") # pylint: disable=invalid-name
+
+
+def product_key(product: dict) -> str:
+    """
+    Returns a key identifying a specific version of a product
+    """
+
+    return "{}#{}".format(product["productId"], dumps(product_fingerprint(product)))
+
+
+async def validate_deliveries(orders: List[dict], context=None) -> List[Tuple[bool, str]]:
+    """
+    Validate the delivery price of multiple orders
+
+    Orders with the same packages and destination country share the same
+    price, so this only computes it once per combination.
+    """
+
+    def pricing_key(order: dict) -> tuple:
+        return (
+            order["address"]["country"],
+            tuple(sorted(tuple(sorted(p["package"].items())) for p in order["products"]))
+        )
+
+    unique_orders = {}
+    for order in orders:
+        unique_orders.setdefault(pricing_key(order), order)
+    keys = list(unique_orders.keys())
+
+    prices = {}
+    # Price one order first to refresh the rate table version, so that the
+    # other orders can be priced locally.
+    if keys and not local_pricing_available():
+        order = unique_orders[keys[0]]
+        prices[keys[0]] = await get_delivery_pricing(order["products"], order["address"], context)
+        keys = keys[1:]
+
+    results = await aiobackend.gather([
+        get_delivery_pricing(unique_orders[key]["products"], unique_orders[key]["address"], context)
+        for key in keys
+    ])
+    prices.update(zip(keys, results))
+
+    return [check_delivery_pricing(order, prices[pricing_key(order)]) for order in orders]
+
+
+async def validate_payments(orders: List[dict], context=None) -> List[Tuple[bool, str]]:
+    """
+    Validate the payment token of multiple orders
+    """
+
+    return await aiobackend.gather([validate_payment(order, context) for order in orders])
+
+
+def product_messages(body: dict) -> Dict[str, str]:
+    """
+    Returns the reason for each invalid product in a response from the
+    products service
+
+    The message of the products service joins the reasons with ". ", in the
+    same order as the invalid products. If they cannot be matched, each
+    product gets the whole message.
+    """
+
+    products = body.get("products", [])
+    message = body.get("message", "")
+    reasons = message.split(". ")
+    if len(reasons) != len(products):
+        reasons = [message for _ in products]
+
+    return {product["productId"]: reason for product, reason in zip(products, reasons)}
+
+
+def group_products(orders: List[dict]) -> List[Dict[str, dict]]:
+    """
+    Group the products of multiple orders that are not in the cache
+
+    Each batch contains at most one version of each product, keyed by
+    productId, so that the response of the products service can be matched
+    with the products sent.
+    """
+
+    batches: List[Dict[str, dict]] = []
+    seen = set()
+    for order in orders:
+        for product in order["products"]:
+            key = product_key(product)
+            if key in seen:
+                continue
+            seen.add(key)
+            if product_cache.get(product["productId"]) == product_fingerprint(product):
+                continue
+            for batch in batches:
+                if product["productId"] not in batch and len(batch) < PRODUCTS_BATCH_SIZE:
+                    batch[product["productId"]] = product
+                    break
+            else:
+                batches.append({product["productId"]: product})
+
+    return batches
+
+
+async def validate_products_batch(orders: List[dict], context=None) -> Dict[str, str]:
+    """
+    Validate the products of multiple orders
+
+    Returns the error messages for invalid products, keyed by product_key().
+    Each distinct product is only sent once to the products service.
+    """
+
+    errors = {}
+    batches = group_products(orders)
+
+    responses = await aiobackend.gather([
+        call_backend(
+            "products",
+            PRODUCTS_API_URL+"/backend/validate",
+            context=context,
+            payload={"products": list(batch.values())}
+        )
+        for batch in batches
+    ])
+
+    for batch, (status_code, body) in zip(batches, responses):
+        if status_code != 200 or body is None:
+            logger.warning({
+                "message": "Failure to contact the products service",
+                "statusCode": status_code,
+                "body": body
+            })
+            for product in batch.values():
+                errors[product_key(product)] = "Failure to contact the products service"
+            continue
+
+        messages = product_messages(body)
+        for product_id, product in batch.items():
+            if product_id in messages:
+                errors[product_key(product)] = messages[product_id]
+            else:
+                product_cache.set(product_id, product_fingerprint(product))
+
+    return errors
+
+
+@tracer.capture_method
+async def validate_batch(orders: List[dict], context=None) -> List[List[str]]:
+    """
+    Returns a list of error messages for each order
+    """
+
+    deliveries, payments, product_errors = await asyncio.gather(
+        validate_deliveries(orders, context),
+        validate_payments(orders, context),
+        validate_products_batch(orders, context)
+    )
+
+    error_msgs = []
+    for order, delivery, payment in zip(orders, deliveries, payments):
+        order_errors = [msg for valid, msg in [delivery, payment] if not valid]
+        for product in order["products"]:
+            error_msg = product_errors.get(product_key(product))
+            if error_msg is not None and error_msg not in order_errors:
+                order_errors.append(error_msg)
+        error_msgs.append(order_errors)
+
+    return error_msgs
+
+
+@tracer.capture_method
+def store_orders(orders: List[dict]) -> List[str]:
+    """
+    Store multiple orders in DynamoDB
+
+    Returns the IDs of the orders that could not be stored. If a request
+    fails, only the orders of that request that were not stored yet are
+    reported, so that the caller does not store the other ones twice.
+    """
+
+    failed = []
+
+    for i in range(0, len(orders), BATCH_WRITE_SIZE):
+        request_items = {TABLE_NAME: [
+            {"PutRequest": {"Item": order}}
+            for order in orders[i:i+BATCH_WRITE_SIZE]
+        ]}
+
+        for attempt in range(BATCH_WRITE_ATTEMPTS):
+            if attempt > 0:
+                # Unprocessed items are caused by throttling, so back off
+                # before retrying.
+                time.sleep(random.uniform(0, 0.05 * 2**attempt))
+            try:
+                response = dynamodb.batch_write_item(RequestItems=request_items)
+            except ClientError as exc:
+                logger.error({
+                    "message": "Failed to store {} orders".format(len(request_items[TABLE_NAME])),
+                    "exception": str(exc)
+                })
+                break
+            request_items = response.get("UnprocessedItems", {})
+            if not request_items:
+                break
+
+        failed.extend([
+            request["PutRequest"]["Item"]["orderId"]
+            for request in request_items.get(TABLE_NAME, [])
+        ])
+
+    return failed
+
+
+@metrics.log_metrics(raise_on_empty_metrics=False)
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def batch_handler(event, context):
+    """
+    Lambda function handler for bulk order creation
+
+    Returns a result for each order, in the same format as for a single
+    order.
+    """
+
+    metrics.add_dimension(name="environment", value=ENVIRONMENT)
+
+    response = check_event(event, ["orders", "userId"])
+    if response is not None:
+        return response
+
+    results: List[Optional[dict]] = [None for _ in event["orders"]]
+    orders = []
+    indices = []
+
+    for i, order in enumerate(event["orders"]):
+        order, response = prepare_order(order, event["userId"])
+        if response is not None:
+            results[i] = response
+            continue
+
+        orders.append(order)
+        indices.append(i)
+
+    # Validate the orders against other services
+    error_msgs = aiobackend.run(validate_batch(orders, context))
+
+    valid_orders = []
+    for i, order, order_errors in zip(indices, orders, error_msgs):
+        if order_errors:
+            results[i] = error_response("Validation errors", order_errors)
+        else:
+            valid_orders.append((i, order))
+
+    failed = set(store_orders([order for _, order in valid_orders]))
+
+    created = 0
+    created_total = 0
+    for i, order in valid_orders:
+        if order["orderId"] in failed:
+            results[i] = error_response("Failed to store order", ["Failed to store order"])
+            continue
+
+        created += 1
+        created_total += order["total"]
+        results[i] = {
+            "success": True,
+            "order": order,
+            "message": "Order created"
+        }
+
+    logger.info({
+        "message": "Created {} orders out of {}".format(created, len(results)),
+        "orderIds": [r["order"]["orderId"] for r in results if r["success"]]
+    })
+
+    metrics.add_metric(name="orderCreated", unit=MetricUnit.Count, value=created)
+    metrics.add_metric(name="orderCreatedTotal", unit=MetricUnit.Count, value=created_total)
+
+    return {
+        "success": created == len(results),
+        "message": "Created {} orders out of {}".format(created, len(results)),
+        "results": results
+    }
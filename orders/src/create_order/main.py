@@ -3,286 +3,259 @@ CreateOrderFunction
 """
 
 
-import asyncio
-import concurrent
 import datetime
 import json
 import os
-from typing import List, Tuple
-from urllib.parse import urlparse
-import uuid
+import time
+from typing import Optional, Tuple
 import boto3
-import jsonschema
-import requests
-from aws_requests_auth.boto_utils import BotoAWSRequestsAuth
+from botocore.exceptions import ClientError
 from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
 from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
 from aws_lambda_powertools import Metrics # pylint: disable=import-error
 from aws_lambda_powertools.metrics import MetricUnit # pylint: disable=import-error
+from ecom.helpers import dumps # pylint: disable=import-error
+from quote import verify_quote
+from validation import check_event, error_response, prepare_order, validate_order
 
 
 ENVIRONMENT = os.environ["ENVIRONMENT"]
-SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "schema.json")
 TABLE_NAME = os.environ["TABLE_NAME"]
-DELIVERY_API_URL = os.environ["DELIVERY_API_URL"]
-PAYMENT_API_URL = os.environ["PAYMENT_API_URL"]
-PRODUCTS_API_URL = os.environ["PRODUCTS_API_URL"]
+IDEMPOTENCY_TABLE_NAME = os.environ["IDEMPOTENCY_TABLE_NAME"]
+# Duration in seconds during which an idempotency key returns the same response
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", str(24*60*60)))
 
 
 dynamodb = boto3.resource("dynamodb") # pylint: disable=invalid-name
 table = dynamodb.Table(TABLE_NAME) # pylint: disable=invalid-name,no-member
+idempotency_table = dynamodb.Table(IDEMPOTENCY_TABLE_NAME) # pylint: disable=invalid-name,no-member
 logger = Logger() # pylint: disable=invalid-name
 tracer = Tracer() # pylint: disable=invalid-name
 metrics = Metrics(namespace="ecommerce.orders") # pylint: disable=invalid-name
 
 
-with open(SCHEMA_FILE) as fp:
-    schema = json.load(fp) # pylint: disable=invalid-name
-
-
 @tracer.capture_method
-def validate_delivery(order: dict) -> Tuple[bool, str]:
+def get_idempotency_record(key: str) -> Optional[dict]:
     """
-    Validate the delivery price
+    Retrieve the record for an idempotency key
     """
 
-    # Gather the domain name and AWS region
-    url = urlparse(DELIVERY_API_URL)
-    region = boto3.session.Session().region_name
-    # Create the signature helper
-    iam_auth = BotoAWSRequestsAuth(aws_host=url.netloc,
-                                   aws_region=region,
-                                   aws_service='execute-api')
-
-    # Send a POST request
-    response = requests.post(
-        DELIVERY_API_URL+"/backend/pricing",
-        json={"products": order["products"], "address": order["address"]},
-        auth=iam_auth
-    )
+    return idempotency_table.get_item(
+        Key={"idempotencyKey": key},
+        ConsistentRead=True
+    ).get("Item", None)
 
-    logger.debug({
-        "message": "Response received from delivery",
-        "body": response.json()
-    })
 
-    body = response.json()
-    if response.status_code != 200 or "pricing" not in body:
-        logger.warning({
-            "message": "Failure to contact the delivery service",
-            "statusCode": response.status_code,
-            "body": body
-        })
-        return (False, "Failure to contact the delivery service")
+@tracer.capture_method
+def claim_idempotency_key(key: str, order_id: str, context=None) -> Tuple[bool, Optional[dict]]:
+    """
+    Claim an idempotency key for an order
+
+    Returns True and the previous record if the key was claimed, or False and
+    the current record if the key is used by another request.
+    """
 
-    if body["pricing"] != order["deliveryPrice"]:
-        logger.info({
-            "message": "Wrong delivery price: got {}, expected {}".format(order["deliveryPrice"], body["pricing"]),
-            "orderPrice": order["deliveryPrice"],
-            "deliveryPrice": body["pricing"]
-        })
-        return (False, "Wrong delivery price: got {}, expected {}".format(order["deliveryPrice"], body["pricing"]))
+    now = int(time.time())
+    # Other requests can take over the key if this invocation stops before
+    # completing the order.
+    in_progress_ttl = context.get_remaining_time_in_millis() // 1000 + 1 if context is not None else 60
 
-    return (True, "The delivery price is valid")
+    try:
+        response = idempotency_table.put_item(
+            Item={
+                "idempotencyKey": key,
+                "status": "IN_PROGRESS",
+                "orderId": order_id,
+                "expiration": now + IDEMPOTENCY_TTL,
+                "inProgressExpiration": now + in_progress_ttl
+            },
+            ConditionExpression=(
+                "attribute_not_exists(#idempotencyKey) OR #expiration < :now "
+                "OR (#status = :inProgress AND #inProgressExpiration < :now)"
+            ),
+            ExpressionAttributeNames={
+                "#idempotencyKey": "idempotencyKey",
+                "#expiration": "expiration",
+                "#status": "status",
+                "#inProgressExpiration": "inProgressExpiration"
+            },
+            ExpressionAttributeValues={
+                ":now": now,
+                ":inProgress": "IN_PROGRESS"
+            },
+            ReturnValues="ALL_OLD"
+        )
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return (False, get_idempotency_record(key))
+
+    return (True, response.get("Attributes", None))
 
 
 @tracer.capture_method
-def validate_payment(order: dict) -> Tuple[bool, str]:
+def complete_idempotency_key(key: str, order_id: str, response: dict) -> None:
     """
-    Validate the payment token
+    Store the response for an idempotency key
     """
 
-    # Gather the domain name and AWS region
-    url = urlparse(PAYMENT_API_URL)
-    region = boto3.session.Session().region_name
-    # Create the signature helper
-    iam_auth = BotoAWSRequestsAuth(aws_host=url.netloc,
-                                   aws_region=region,
-                                   aws_service='execute-api')
-
-    # Send a POST request
-    response = requests.post(
-        PAYMENT_API_URL+"/backend/validate",
-        json={"paymentToken": order["paymentToken"], "total": order["total"]},
-        auth=iam_auth
-    )
-
-    logger.debug({
-        "message": "Response received from payment",
-        "body": response.json()
+    idempotency_table.put_item(Item={
+        "idempotencyKey": key,
+        "status": "COMPLETED",
+        "orderId": order_id,
+        "expiration": int(time.time()) + IDEMPOTENCY_TTL,
+        "response": dumps(response)
     })
 
-    body = response.json()
-    if response.status_code != 200 or "ok" not in body:
-        logger.warning({
-            "message": "Failure to contact the payment service",
-            "statusCode": response.status_code,
-            "body": body
-        })
-        return (False, "Failure to contact the payment service")
-
-    if not body["ok"]:
-        logger.info({
-            "message": "Wrong payment token",
-            "paymentToken": order["paymentToken"],
-            "total": order["total"]
-        })
-        return (False, "Wrong payment token")
-
-    return (True, "The payment token is valid")
-
 
 @tracer.capture_method
-def validate_products(order: dict) -> Tuple[bool, str]:
+def release_idempotency_key(key: str) -> None:
     """
-    Validate the products in the order
+    Release an idempotency key, so that the request can be retried
     """
 
-    # Gather the domain name and AWS region
-    url = urlparse(PRODUCTS_API_URL)
-    region = boto3.session.Session().region_name
-    # Create the signature helper
-    iam_auth = BotoAWSRequestsAuth(aws_host=url.netloc,
-                                   aws_region=region,
-                                   aws_service='execute-api')
-    # Send a POST request
-    response = requests.post(
-        PRODUCTS_API_URL+"/backend/validate",
-        json={"products": order["products"]},
-        auth=iam_auth
-    )
-
-    logger.debug({
-        "message": "Response received from products",
-        "body": response.json()
-    })
-
-    body = response.json()
-    return (len(body.get("products", [])) == 0, body.get("message", ""))
+    idempotency_table.delete_item(Key={"idempotencyKey": key})
 
 
-@tracer.capture_method
-async def validate(order: dict) -> List[str]:
+def get_stored_order(order_id: str) -> Optional[dict]:
     """
-    Returns a list of error messages
+    Retrieve an order from DynamoDB
     """
 
-    error_msgs = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-        futures = [
-            executor.submit(validate_delivery, order),
-            executor.submit(validate_payment, order),
-            executor.submit(validate_products, order)
-        ]
-        for future in concurrent.futures.as_completed(futures):
-            valid, error_msg = future.result()
-            if not valid:
-                error_msgs.append(error_msg)
-
-    if error_msgs:
-        logger.info({
-            "message": "Validation errors for order",
-            "order": order,
-            "errors": error_msgs
-        })
+    item = table.get_item(Key={"orderId": order_id}, ConsistentRead=True).get("Item")
+    if item is None:
+        return None
 
-    return error_msgs
+    return json.loads(dumps(item))
 
 
-@tracer.capture_method
-def cleanup_products(products: List[dict]) -> List[dict]:
+def claim_order(key: str, order: dict, context=None) -> Optional[dict]:
     """
-    Cleanup products
+    Claim the idempotency key for an order
+
+    Returns the response to send back if the order should not be created by
+    this request.
     """
 
-    return [{
-        "productId": product["productId"],
-        "name": product["name"],
-        "package": product["package"],
-        "price": product["price"],
-        "quantity": product.get("quantity", 1)
-    } for product in products]
+    claimed, record = claim_idempotency_key(key, order["orderId"], context)
+    if not claimed:
+        if record is not None and record["status"] == "COMPLETED":
+            return json.loads(record["response"])
+        return error_response(
+            "Order in progress",
+            ["An order with this idempotency key is already in progress"]
+        )
+
+    if record is None or record["status"] != "IN_PROGRESS":
+        return None
+
+    # A previous request stopped before completing, reuse its order ID so
+    # that the order is not stored twice.
+    order["orderId"] = record["orderId"]
+
+    # If that request already stored the order, there is nothing left to
+    # validate.
+    existing_order = get_stored_order(order["orderId"])
+    if existing_order is None:
+        return None
+
+    response = {
+        "success": True,
+        "order": existing_order,
+        "message": "Order created"
+    }
+    complete_idempotency_key(key, order["orderId"], response)
+    return response
 
 
 @tracer.capture_method
-def inject_order_fields(order: dict) -> dict:
+def store_order(order: dict) -> Optional[dict]:
     """
-    Inject fields into the order and return the order
+    Store the order in DynamoDB
+
+    If an order with the same ID already exists, this returns the existing
+    order instead.
     """
 
-    now = datetime.datetime.now()
+    logger.debug({
+        "message": "Store order",
+        "order": order
+    })
 
-    order["orderId"] = str(uuid.uuid4())
-    order["status"] = "NEW"
-    order["createdDate"] = now.isoformat()
-    order["modifiedDate"] = now.isoformat()
-    order["total"] = sum([p["price"]*p.get("quantity", 1) for p in order["products"]]) + order["deliveryPrice"]
+    try:
+        table.put_item(
+            Item=order,
+            ConditionExpression="attribute_not_exists(orderId)"
+        )
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return get_stored_order(order["orderId"])
 
-    return order
+    return None
 
 
-@tracer.capture_method
-def store_order(order: dict) -> None:
+def get_idempotent_response(key: Optional[str]) -> Optional[dict]:
     """
-    Store the order in DynamoDB
+    Returns the original response for a retried request, if any
     """
 
-    logger.debug({
-        "message": "Store order",
-        "order": order
+    if key is None:
+        return None
+
+    record = get_idempotency_record(key)
+    if record is None or record["status"] != "COMPLETED" or record["expiration"] <= time.time():
+        return None
+
+    logger.info({
+        "message": "Returning response for order {} from idempotency key".format(record["orderId"]),
+        "orderId": record["orderId"]
     })
+    metrics.add_metric(name="orderIdempotentRetry", unit=MetricUnit.Count, value=1)
 
-    table.put_item(Item=order)
+    return json.loads(record["response"])
 
 
-@metrics.log_metrics(raise_on_empty_metrics=False)
-@logger.inject_lambda_context
-@tracer.capture_lambda_handler
-def handler(event, _):
+def get_event_order(event: dict) -> Tuple[Optional[dict], Optional[dict]]:
     """
-    Lambda function handler
+    Returns the order to create from a quote or from the order in the event
+
+    Returns None and the response to send back if the event or the order is
+    not valid.
     """
 
-    # Basic checks on the event
-    for key in ["order", "userId"]:
-        if key not in event:
-            return {
-                "success": False,
-                "message": "Invalid event",
-                "errors": ["Missing {} in event".format(key)]
-            }
+    response = check_event(event, ["quoteId" if event.get("quoteId") else "order", "userId"])
+    if response is not None:
+        return (None, response)
 
-    # Inject userId into the order
-    order = event["order"]
-    order["userId"] = event["userId"]
+    if not event.get("quoteId"):
+        return prepare_order(event["order"], event["userId"])
 
-    # Validate the schema of the order
-    try:
-        jsonschema.validate(order, schema)
-    except jsonschema.ValidationError as exc:
-        return {
-            "success": False,
-            "message": "JSON Schema validation error",
-            "errors": [str(exc)]
-        }
+    # Quoted orders were already validated
+    order, error_msg = verify_quote(event["quoteId"], event["userId"])
+    if order is None:
+        return (None, error_response("Invalid quote", [error_msg]))
 
-    # Cleanup products
-    order["products"] = cleanup_products(order["products"])
+    now = datetime.datetime.now()
+    order["createdDate"] = now.isoformat()
+    order["modifiedDate"] = now.isoformat()
 
-    # Inject fields in the order
-    order = inject_order_fields(order)
+    return (order, None)
 
-    # Validate the order against other services
-    error_msgs = asyncio.run(validate(order))
-    if len(error_msgs) > 0:
+
+def create_order(order: dict) -> dict:
+    """
+    Store a validated order and returns the response to send back
+    """
+
+    existing_order = store_order(order)
+    if existing_order is not None:
         return {
-            "success": False,
-            "message": "Validation errors",
-            "errors": error_msgs
+            "success": True,
+            "order": existing_order,
+            "message": "Order created"
         }
 
-    store_order(order)
-
     # Log
     tracer.put_annotation("orderId", order["orderId"])
     logger.info({
@@ -296,7 +269,6 @@ def handler(event, _):
     })
 
     # Add custom metrics
-    metrics.add_dimension(name="environment", value=ENVIRONMENT)
     metrics.add_metric(name="orderCreated", unit=MetricUnit.Count, value=1)
     metrics.add_metric(name="orderCreatedTotal", unit=MetricUnit.Count, value=order["total"])
 
@@ -305,3 +277,44 @@ def handler(event, _):
         "order": order,
         "message": "Order created"
     }
+
+
+@metrics.log_metrics(raise_on_empty_metrics=False)
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def handler(event, context):
+    """
+    Lambda function handler
+    """
+
+    metrics.add_dimension(name="environment", value=ENVIRONMENT)
+
+    # Return the original response for retried requests
+    idempotency_key = None
+    if event.get("idempotencyKey") and event.get("userId"):
+        idempotency_key = "{}#{}".format(event["userId"], event["idempotencyKey"])
+    response = get_idempotent_response(idempotency_key)
+    if response is not None:
+        return response
+
+    order, response = get_event_order(event)
+    if response is not None:
+        return response
+
+    if idempotency_key is not None:
+        response = claim_order(idempotency_key, order, context)
+        if response is not None:
+            return response
+
+    # Validate the order against other services, unless it was quoted
+    response = None if event.get("quoteId") else validate_order(order, context)
+    if response is not None:
+        if idempotency_key is not None:
+            release_idempotency_key(idempotency_key)
+        return response
+
+    response = create_order(order)
+    if idempotency_key is not None:
+        complete_idempotency_key(idempotency_key, order["orderId"], response)
+
+    return response
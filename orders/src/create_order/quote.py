@@ -0,0 +1,123 @@
+"""
+QuoteOrderFunction
+"""
+
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Optional, Tuple
+import boto3
+from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
+from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
+from aws_lambda_powertools import Metrics # pylint: disable=import-error
+from aws_lambda_powertools.metrics import MetricUnit # pylint: disable=import-error
+from ecom.helpers import dumps # pylint: disable=import-error
+from validation import check_event, prepare_order, validate_order
+
+
+ENVIRONMENT = os.environ["ENVIRONMENT"]
+# Secret used to sign quotes, and duration in seconds during which a quote is valid
+QUOTE_SECRET_ARN = os.environ.get("QUOTE_SECRET_ARN")
+QUOTE_TTL = int(os.environ.get("QUOTE_TTL", "900"))
+
+
+logger = Logger() # pylint: disable=invalid-name
+tracer = Tracer() # pylint: disable=invalid-name
+metrics = Metrics(namespace="ecommerce.orders") # pylint: disable=invalid-name
+# Key used to sign quotes, retrieved on first use
+quote_key: Optional[bytes] = None # pylint: disable=invalid-name
+
+
+def get_quote_key() -> bytes:
+    """
+    Returns the key used to sign quotes
+    """
+
+    global quote_key # pylint: disable=global-statement,invalid-name
+
+    if quote_key is None:
+        secret = boto3.client("secretsmanager").get_secret_value(SecretId=QUOTE_SECRET_ARN)
+        quote_key = secret["SecretString"].encode("utf-8")
+
+    return quote_key
+
+
+def sign_quote(order: dict, expires: int) -> str:
+    """
+    Returns a signed quote for a validated order
+    """
+
+    payload = base64.urlsafe_b64encode(dumps({"order": order, "expires": expires}).encode("utf-8"))
+    signature = base64.urlsafe_b64encode(hmac.new(get_quote_key(), payload, hashlib.sha256).digest())
+
+    return (payload + b"." + signature).decode("utf-8")
+
+
+def verify_quote(quote_id: str, user_id: str) -> Tuple[Optional[dict], str]:
+    """
+    Returns the order from a signed quote, or None and an error message if the
+    quote is not valid
+    """
+
+    try:
+        payload, signature = quote_id.encode("utf-8").split(b".")
+    except ValueError:
+        return (None, "Invalid quote")
+
+    expected = base64.urlsafe_b64encode(hmac.new(get_quote_key(), payload, hashlib.sha256).digest())
+    if not hmac.compare_digest(signature, expected):
+        return (None, "Invalid quote")
+
+    quote = json.loads(base64.urlsafe_b64decode(payload))
+    if quote["order"]["userId"] != user_id:
+        return (None, "Invalid quote")
+    if quote["expires"] < time.time():
+        return (None, "Quote expired")
+
+    return (quote["order"], "")
+
+
+@metrics.log_metrics(raise_on_empty_metrics=False)
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def quote_handler(event, context):
+    """
+    Lambda function handler for order quotes
+
+    This validates an order and returns a signed quote that can be used to
+    create the order without validating it again.
+    """
+
+    metrics.add_dimension(name="environment", value=ENVIRONMENT)
+
+    response = check_event(event, ["order", "userId"])
+    if response is not None:
+        return response
+
+    order, response = prepare_order(event["order"], event["userId"])
+    if response is not None:
+        return response
+
+    response = validate_order(order, context)
+    if response is not None:
+        return response
+
+    expires = int(time.time()) + QUOTE_TTL
+
+    logger.info({
+        "message": "Order {} quoted".format(order["orderId"]),
+        "orderId": order["orderId"]
+    })
+    metrics.add_metric(name="orderQuoted", unit=MetricUnit.Count, value=1)
+
+    return {
+        "success": True,
+        "message": "Order quoted",
+        "quoteId": sign_quote(order, expires),
+        "order": order,
+        "expires": expires
+    }
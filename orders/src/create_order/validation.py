@@ -0,0 +1,471 @@
+"""
+Order validation shared by the CreateOrder, QuoteOrder and BatchCreateOrders
+functions
+"""
+
+
+import asyncio
+import datetime
+import json
+import os
+import time
+from typing import Any, List, Optional, Tuple
+import uuid
+import aiohttp
+import boto3
+import jsonschema
+from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
+from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
+from aws_lambda_powertools import Metrics # pylint: disable=import-error
+from aws_lambda_powertools.metrics import MetricUnit # pylint: disable=import-error
+from ecom import aiobackend # pylint: disable=import-error
+from ecom import pricing as delivery_pricing # pylint: disable=import-error
+from ecom.cache import TTLCache # pylint: disable=import-error
+from ecom.circuitbreaker import CircuitBreaker # pylint: disable=import-error
+from ecom.helpers import timeout_from_context # pylint: disable=import-error
+
+
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "schema.json")
+DELIVERY_API_URL = os.environ["DELIVERY_API_URL"]
+PAYMENT_API_URL = os.environ["PAYMENT_API_URL"]
+PRODUCTS_API_URL = os.environ["PRODUCTS_API_URL"]
+# Deadline for each backend, in seconds
+BACKEND_TIMEOUTS = {
+    "delivery": float(os.environ.get("DELIVERY_TIMEOUT", "3")),
+    "payment": float(os.environ.get("PAYMENT_TIMEOUT", "3")),
+    "products": float(os.environ.get("PRODUCTS_TIMEOUT", "3"))
+}
+# Latency percentile after which a second request is sent to a backend.
+# Hedged requests are disabled if this is not set.
+HEDGE_PERCENTILE = float(os.environ["HEDGE_PERCENTILE"]) if os.environ.get("HEDGE_PERCENTILE") else None
+# Optional table to share the circuit breakers state across execution environments
+CIRCUIT_BREAKER_TABLE_NAME = os.environ.get("CIRCUIT_BREAKER_TABLE_NAME")
+# Number of products and duration in seconds for the product cache. Cached
+# products are not invalidated when they change in the products service, so a
+# price change can take up to PRODUCT_CACHE_TTL to be enforced.
+PRODUCT_CACHE_SIZE = int(os.environ.get("PRODUCT_CACHE_SIZE", "1000"))
+PRODUCT_CACHE_TTL = float(os.environ.get("PRODUCT_CACHE_TTL", "60"))
+# Fields validated by the products service
+PRODUCT_FIELDS = ["name", "package", "price"]
+# Duration in seconds during which the rate table version returned by the
+# delivery-pricing service is trusted
+RATE_TABLE_TTL = float(os.environ.get("RATE_TABLE_TTL", "300"))
+# Set to "false" to always compute delivery prices locally
+DELIVERY_REMOTE_FALLBACK = os.environ.get("DELIVERY_REMOTE_FALLBACK", "true").lower() == "true"
+
+
+dynamodb = boto3.resource("dynamodb") # pylint: disable=invalid-name
+logger = Logger() # pylint: disable=invalid-name
+tracer = Tracer() # pylint: disable=invalid-name
+metrics = Metrics(namespace="ecommerce.orders") # pylint: disable=invalid-name
+latencies = {name: aiobackend.LatencyTracker() for name in BACKEND_TIMEOUTS} # pylint: disable=invalid-name
+breakers = { # pylint: disable=invalid-name
+    name: CircuitBreaker(
+        name,
+        table=dynamodb.Table(CIRCUIT_BREAKER_TABLE_NAME) if CIRCUIT_BREAKER_TABLE_NAME else None # pylint: disable=no-member
+    )
+    for name in BACKEND_TIMEOUTS
+}
+# Products validated by the products service, keyed by productId
+product_cache = TTLCache(maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL) # pylint: disable=invalid-name
+# Rate table version last returned by the delivery-pricing service
+rate_table_version = TTLCache(maxsize=1, ttl=RATE_TABLE_TTL) # pylint: disable=invalid-name
+
+
+with open(SCHEMA_FILE) as fp:
+    schema = json.load(fp) # pylint: disable=invalid-name
+# Build the validator once per execution environment, as jsonschema.validate()
+# checks the schema and looks up the validator class on every call.
+validator_class = jsonschema.validators.validator_for(schema) # pylint: disable=invalid-name
+validator_class.check_schema(schema)
+validator = validator_class(schema) # pylint: disable=invalid-name
+
+
+async def call_backend(name: str, url: str, context=None, payload: Any = None) -> Tuple[Optional[int], Any]:
+    """
+    Send a POST request to a backend and returns the status code and body
+
+    The request is bounded by the deadline of the backend. If hedging is
+    enabled, a second request is sent when the first one is slower than the
+    HEDGE_PERCENTILE latency of previous requests. If the circuit breaker of
+    the backend is open, this returns immediately with no status code, as it
+    does for timeouts and connection errors.
+    """
+
+    breaker = breakers[name]
+    if not breaker.allow_request():
+        logger.warning({
+            "message": "Circuit open for the {} service".format(name),
+            "url": url
+        })
+        metrics.add_metric(name="{}CircuitOpen".format(name), unit=MetricUnit.Count, value=1)
+        return None, None
+
+    delay = None
+    if HEDGE_PERCENTILE is not None:
+        delay = latencies[name].percentile(HEDGE_PERCENTILE)
+        if delay is not None:
+            delay /= 1000
+
+    attempts = []
+
+    async def send() -> Tuple[int, Any]:
+        # Only the latency of successful first attempts is tracked, as hedged
+        # requests, timeouts and errors would skew the hedging delay.
+        attempts.append(time.perf_counter())
+        primary = len(attempts) == 1
+        status_code, body = await aiobackend.post(url, context=context, json=payload)
+        if primary and 200 <= status_code < 300:
+            latencies[name].add((time.perf_counter() - attempts[0]) * 1000)
+        return status_code, body
+
+    start = time.perf_counter()
+    try:
+        status_code, body = await asyncio.wait_for(
+            aiobackend.hedge(send, delay),
+            timeout=timeout_from_context(context, BACKEND_TIMEOUTS[name])
+        )
+    except asyncio.TimeoutError:
+        logger.warning({
+            "message": "Timeout when contacting the {} service".format(name),
+            "url": url
+        })
+        status_code, body = None, None
+    except aiohttp.ClientError as exc:
+        logger.warning({
+            "message": "Error when contacting the {} service".format(name),
+            "url": url,
+            "exception": str(exc)
+        })
+        status_code, body = None, None
+    except Exception:
+        breaker.record_failure()
+        raise
+
+    # Client errors mean that the service is available
+    if status_code is None or status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+    latency = (time.perf_counter() - start) * 1000
+    metrics.add_metric(name="{}Latency".format(name), unit=MetricUnit.Milliseconds, value=latency)
+
+    return status_code, body
+
+
+def local_pricing_available() -> bool:
+    """
+    Returns True if the local rate table matches the one used by the
+    delivery-pricing service
+    """
+
+    if not DELIVERY_REMOTE_FALLBACK:
+        return True
+
+    return rate_table_version.get("version") == delivery_pricing.RATE_TABLE_VERSION
+
+
+async def get_delivery_pricing(products: List[dict], address: dict, context=None) -> Optional[int]:
+    """
+    Returns the delivery price, or None if the delivery service cannot be
+    contacted
+
+    The price is computed locally when the rate table is known to be up to
+    date. Otherwise, this calls the delivery-pricing service.
+    """
+
+    if local_pricing_available():
+        pricing = delivery_pricing.get_pricing(products, address)
+
+        logger.debug({
+            "message": "Computed delivery price locally",
+            "pricing": pricing,
+            "version": delivery_pricing.RATE_TABLE_VERSION
+        })
+
+        return pricing
+
+    # Send a POST request
+    status_code, body = await call_backend(
+        "delivery",
+        DELIVERY_API_URL+"/backend/pricing",
+        context=context,
+        payload={"products": products, "address": address}
+    )
+
+    logger.debug({
+        "message": "Response received from delivery",
+        "body": body
+    })
+
+    body = body or {}
+    if status_code != 200 or "pricing" not in body:
+        logger.warning({
+            "message": "Failure to contact the delivery service",
+            "statusCode": status_code,
+            "body": body
+        })
+        return None
+
+    if "version" in body:
+        rate_table_version.set("version", body["version"])
+
+    return body["pricing"]
+
+
+def check_delivery_pricing(order: dict, pricing: Optional[int]) -> Tuple[bool, str]:
+    """
+    Compare the delivery price of the order with the expected price
+    """
+
+    if pricing is None:
+        return (False, "Failure to contact the delivery service")
+
+    if pricing != order["deliveryPrice"]:
+        logger.info({
+            "message": "Wrong delivery price: got {}, expected {}".format(order["deliveryPrice"], pricing),
+            "orderPrice": order["deliveryPrice"],
+            "deliveryPrice": pricing
+        })
+        return (False, "Wrong delivery price: got {}, expected {}".format(order["deliveryPrice"], pricing))
+
+    return (True, "The delivery price is valid")
+
+
+async def validate_delivery(order: dict, context=None) -> Tuple[bool, str]:
+    """
+    Validate the delivery price
+    """
+
+    pricing = await get_delivery_pricing(order["products"], order["address"], context)
+    return check_delivery_pricing(order, pricing)
+
+
+async def validate_payment(order: dict, context=None) -> Tuple[bool, str]:
+    """
+    Validate the payment token
+    """
+
+    # Send a POST request
+    status_code, body = await call_backend(
+        "payment",
+        PAYMENT_API_URL+"/backend/validate",
+        context=context,
+        payload={"paymentToken": order["paymentToken"], "total": order["total"]}
+    )
+
+    logger.debug({
+        "message": "Response received from payment",
+        "body": body
+    })
+
+    body = body or {}
+    if status_code != 200 or "ok" not in body:
+        logger.warning({
+            "message": "Failure to contact the payment service",
+            "statusCode": status_code,
+            "body": body
+        })
+        return (False, "Failure to contact the payment service")
+
+    if not body["ok"]:
+        logger.info({
+            "message": "Wrong payment token",
+            "paymentToken": order["paymentToken"],
+            "total": order["total"]
+        })
+        return (False, "Wrong payment token")
+
+    return (True, "The payment token is valid")
+
+
+def product_fingerprint(product: dict) -> dict:
+    """
+    Returns the fields of a product validated by the products service
+    """
+
+    return {k: product.get(k) for k in PRODUCT_FIELDS}
+
+
+async def validate_products(order: dict, context=None) -> Tuple[bool, str]:
+    """
+    Validate the products in the order
+
+    Only products that do not match a recently validated product are sent to
+    the products service.
+    """
+
+    products = [
+        product for product in order["products"]
+        if product_cache.get(product["productId"]) != product_fingerprint(product)
+    ]
+
+    logger.debug({
+        "message": "{} products not found in cache".format(len(products)),
+        "cacheSize": len(product_cache)
+    })
+
+    if not products:
+        return (True, "All products are valid")
+
+    # Send a POST request
+    status_code, body = await call_backend(
+        "products",
+        PRODUCTS_API_URL+"/backend/validate",
+        context=context,
+        payload={"products": products}
+    )
+
+    logger.debug({
+        "message": "Response received from products",
+        "body": body
+    })
+
+    if status_code != 200 or body is None:
+        logger.warning({
+            "message": "Failure to contact the products service",
+            "statusCode": status_code,
+            "body": body
+        })
+        return (False, "Failure to contact the products service")
+
+    # Cache the products that passed validation
+    invalid_ids = {product["productId"] for product in body.get("products", [])}
+    for product in products:
+        if product["productId"] not in invalid_ids:
+            product_cache.set(product["productId"], product_fingerprint(product))
+
+    return (len(body.get("products", [])) == 0, body.get("message", ""))
+
+
+@tracer.capture_method
+async def validate(order: dict, context=None) -> List[str]:
+    """
+    Returns a list of error messages
+
+    This stops at the first validation error and cancels the remaining
+    requests.
+    """
+
+    error_msgs = []
+    tasks = [
+        asyncio.ensure_future(validate_delivery(order, context)),
+        asyncio.ensure_future(validate_payment(order, context)),
+        asyncio.ensure_future(validate_products(order, context))
+    ]
+    try:
+        for future in asyncio.as_completed(tasks):
+            valid, error_msg = await future
+            if not valid:
+                error_msgs.append(error_msg)
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Wait for the cancellations, as the event loop is reused across
+        # invocations
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if error_msgs:
+        logger.info({
+            "message": "Validation errors for order",
+            "order": order,
+            "errors": error_msgs
+        })
+
+    return error_msgs
+
+
+@tracer.capture_method
+def cleanup_products(products: List[dict]) -> List[dict]:
+    """
+    Cleanup products
+    """
+
+    return [{
+        "productId": product["productId"],
+        "name": product["name"],
+        "package": product["package"],
+        "price": product["price"],
+        "quantity": product.get("quantity", 1)
+    } for product in products]
+
+
+@tracer.capture_method
+def inject_order_fields(order: dict) -> dict:
+    """
+    Inject fields into the order and return the order
+    """
+
+    now = datetime.datetime.now()
+
+    order["orderId"] = str(uuid.uuid4())
+    order["status"] = "NEW"
+    order["createdDate"] = now.isoformat()
+    order["modifiedDate"] = now.isoformat()
+    order["total"] = sum([p["price"]*p.get("quantity", 1) for p in order["products"]]) + order["deliveryPrice"]
+
+    return order
+
+
+def error_response(message: str, errors: List[str]) -> dict:
+    """
+    Returns the response for an order that was not created or quoted
+    """
+
+    return {
+        "success": False,
+        "message": message,
+        "errors": errors
+    }
+
+
+def check_event(event: dict, keys: List[str]) -> Optional[dict]:
+    """
+    Returns the response to send back if one of `keys` is missing from the
+    event
+    """
+
+    for key in keys:
+        if event.get(key) is None:
+            return error_response("Invalid event", ["Missing {} in event".format(key)])
+
+    return None
+
+
+def prepare_order(order: dict, user_id: str) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Check the schema of an order and inject its fields
+
+    Returns the order, or None and the response to send back if the order is
+    not valid.
+    """
+
+    # Inject userId into the order
+    order["userId"] = user_id
+
+    # Validate the schema of the order
+    error = jsonschema.exceptions.best_match(validator.iter_errors(order))
+    if error is not None:
+        return (None, error_response("JSON Schema validation error", [str(error)]))
+
+    # Cleanup products
+    order["products"] = cleanup_products(order["products"])
+
+    # Inject fields in the order
+    return (inject_order_fields(order), None)
+
+
+def validate_order(order: dict, context=None) -> Optional[dict]:
+    """
+    Validate the order against other services
+
+    Returns the response to send back if the order is not valid.
+    """
+
+    error_msgs = aiobackend.run(validate(order, context))
+    if len(error_msgs) > 0:
+        return error_response("Validation errors", error_msgs)
+
+    return None
@@ -0,0 +1,97 @@
+"""
+GetAnalyticsFunction
+"""
+
+
+import os
+import re
+from typing import List, Optional
+import boto3
+from boto3.dynamodb.conditions import Key
+from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
+from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
+from ecom.apigateway import iam_user_id, response # pylint: disable=import-error
+
+
+ENVIRONMENT = os.environ["ENVIRONMENT"]
+ANALYTICS_TABLE_NAME = os.environ["ANALYTICS_TABLE_NAME"]
+# Views that need a key, e.g. a country code or a status
+KEYED_VIEWS = ["country", "status"]
+VIEWS = ["current", "total"] + KEYED_VIEWS
+# Hourly buckets, or prefixes of them (e.g. "2020-01-23")
+BUCKET_PATTERN = re.compile(r"^\d{4}(-\d{2}(-\d{2}(T\d{2})?)?)?$")
+
+
+dynamodb = boto3.resource("dynamodb") # pylint: disable=invalid-name
+table = dynamodb.Table(ANALYTICS_TABLE_NAME) # pylint: disable=invalid-name,no-member
+logger = Logger() # pylint: disable=invalid-name
+tracer = Tracer() # pylint: disable=invalid-name
+
+
+@tracer.capture_method
+def get_counters(view: str, start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+    """
+    Returns the counters for a view, optionally between two buckets
+    """
+
+    condition = Key("view").eq(view)
+    if start is not None and end is not None:
+        # "~" sorts after all characters used in buckets, so that prefixes
+        # include all the buckets they match.
+        condition = condition & Key("bucket").between(start, end + "~")
+    elif start is not None:
+        condition = condition & Key("bucket").gte(start)
+    elif end is not None:
+        condition = condition & Key("bucket").lte(end + "~")
+
+    counters = []
+    kwargs = {"KeyConditionExpression": condition}
+    while True:
+        res = table.query(**kwargs)
+        counters.extend(res.get("Items", []))
+        if "LastEvaluatedKey" not in res:
+            break
+        kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+    return [
+        {k: v for k, v in counter.items() if k != "view"}
+        for counter in counters
+    ]
+
+
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def handler(event, _):
+    """
+    Lambda function handler for GetAnalytics
+    """
+
+    logger.debug({"message": "Event received", "event": event})
+
+    # Retrieve the userId
+    user_id = iam_user_id(event)
+    if user_id is None:
+        logger.warning({"message": "User ID not found in event"})
+        return response("Unauthorized", 401)
+
+    params = event.get("queryStringParameters") or {}
+    view = params.get("view", "total")
+    if view not in VIEWS:
+        return response("Invalid view, must be one of {}".format(", ".join(VIEWS)), 400)
+    if view in KEYED_VIEWS:
+        if not params.get("key"):
+            return response("Missing key for view {}".format(view), 400)
+        view = "{}#{}".format(view, params["key"])
+
+    for param in ["from", "to"]:
+        if param in params and BUCKET_PATTERN.match(params[param]) is None:
+            return response("Invalid {} parameter".format(param), 400)
+    # Buckets are prefixes, so e.g. from=2020-01-23T10 and to=2020-01-23 is
+    # valid
+    start, end = params.get("from"), params.get("to")
+    if start is not None and end is not None and start[:len(end)] > end:
+        return response("from must not be after to", 400)
+
+    counters = get_counters(view, start, end)
+
+    return response({"counters": counters})
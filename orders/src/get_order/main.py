@@ -3,32 +3,73 @@ GetOrdersFunction
 """
 
 
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
-from typing import Optional
+import random
+import re
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import boto3
+from aws_lambda_powertools import Metrics # pylint: disable=import-error
+from aws_lambda_powertools.metrics import MetricUnit # pylint: disable=import-error
 from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
 from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
-from ecom.apigateway import iam_user_id, response # pylint: disable=import-error
+from ecom.apigateway import iam_user_id, raw_response, response # pylint: disable=import-error
+from ecom.cache import TTLCache # pylint: disable=import-error
+from ecom.dynamodb import deserialize_image # pylint: disable=import-error
+from ecom.helpers import dumps # pylint: disable=import-error
 
 
 ENVIRONMENT = os.environ["ENVIRONMENT"]
 TABLE_NAME = os.environ["TABLE_NAME"]
+# The order cache is disabled when the size is 0. Cached orders are not
+# invalidated when they change, so they can be up to ORDER_CACHE_TTL stale.
+ORDER_CACHE_SIZE = int(os.environ.get("ORDER_CACHE_SIZE", "0"))
+ORDER_CACHE_TTL = float(os.environ.get("ORDER_CACHE_TTL", "30"))
+# Maximum number of order IDs in a batch request
+BATCH_MAX_ORDERS = int(os.environ.get("BATCH_MAX_ORDERS", "1000"))
+# Maximum number of orders in a batch response
+BATCH_PAGE_SIZE = int(os.environ.get("BATCH_PAGE_SIZE", "300"))
+# Maximum number of keys in a BatchGetItem request
+BATCH_GET_SIZE = 100
+BATCH_GET_ATTEMPTS = 5
+BATCH_GET_WORKERS = 5
+# Fields that can be requested with the 'fields' query string parameter
+FIELD_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_]{0,63}$")
+# Index to list orders by user
+USER_INDEX_NAME = os.environ.get("USER_INDEX_NAME", "user")
+# Default and maximum number of orders per page when listing orders
+ORDERS_LIMIT = int(os.environ.get("ORDERS_LIMIT", "20"))
+ORDERS_MAX_LIMIT = int(os.environ.get("ORDERS_MAX_LIMIT", "100"))
+# Date filters, as a prefix of an ISO 8601 date
+DATE_PATTERN = re.compile(r"^\d{4}(-\d{2}(-\d{2}(T[0-9:.]{0,15})?)?)?$")
 
 
 dynamodb = boto3.resource("dynamodb") # pylint: disable=invalid-name
 table = dynamodb.Table(TABLE_NAME) # pylint: disable=invalid-name,no-member
 logger = Logger() # pylint: disable=invalid-name
 tracer = Tracer() # pylint: disable=invalid-name
+metrics = Metrics(namespace="ecommerce.orders") # pylint: disable=invalid-name
+# Orders, as (userId, body, order) tuples, by order ID
+order_cache = TTLCache(maxsize=ORDER_CACHE_SIZE, ttl=ORDER_CACHE_TTL) # pylint: disable=invalid-name
 
 
 @tracer.capture_method
-def get_order(order_id: str) -> Optional[dict]:
+def get_order(order_id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
     """
     Returns order from DynamoDB
+
+    If `fields` is set, only those top-level fields are retrieved.
     """
 
     # Send request to DynamoDB
-    res = table.get_item(Key={"orderId": order_id}) # pylint: disable=no-member
+    kwargs = {}
+    if fields is not None:
+        kwargs["ProjectionExpression"] = ", ".join("#f{}".format(i) for i in range(len(fields)))
+        kwargs["ExpressionAttributeNames"] = {"#f{}".format(i): field for i, field in enumerate(fields)}
+    res = table.get_item(Key={"orderId": order_id}, **kwargs) # pylint: disable=no-member
     order = res.get("Item", None)
 
     # Log retrieved informations
@@ -46,6 +87,411 @@ def get_order(order_id: str) -> Optional[dict]:
     return order
 
 
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Returns the list of fields from the 'fields' query string parameter
+
+    The orderId is always part of the fields. This raises a ValueError if a
+    field name is not valid.
+    """
+
+    if not fields:
+        return None
+
+    field_list = ["orderId"]
+    for field in fields.split(","):
+        field = field.strip()
+        if FIELD_PATTERN.match(field) is None:
+            raise ValueError("Invalid field '{}'".format(field))
+        if field not in field_list:
+            field_list.append(field)
+
+    return field_list
+
+
+@tracer.capture_method
+def get_serialized_order(order_id: str, fields: Optional[List[str]] = None) -> Optional[Tuple[str, str]]:
+    """
+    Returns the user ID and the serialized order, from the cache if possible
+
+    If `fields` is set, only those fields are serialized. Partial orders are
+    not cached, but can be served from a cached full order.
+    """
+
+    if ORDER_CACHE_SIZE > 0:
+        cached = order_cache.get(order_id)
+        if cached is not None:
+            metrics.add_metric(name="orderCacheHit", unit=MetricUnit.Count, value=1)
+            if fields is None:
+                return cached[0], cached[1]
+            return cached[0], dumps({k: cached[2][k] for k in fields if k in cached[2]})
+        metrics.add_metric(name="orderCacheMiss", unit=MetricUnit.Count, value=1)
+
+    if fields is not None:
+        # The user ID is needed to check access to the order
+        order = get_order(order_id, fields if "userId" in fields else fields + ["userId"])
+        if order is None:
+            return None
+        user_id = order["userId"]
+        return user_id, dumps({k: order[k] for k in fields if k in order})
+
+    order = get_order(order_id)
+    if order is None:
+        # Missing orders are not cached, as they could be created right after
+        return None
+
+    body = dumps(order)
+    if ORDER_CACHE_SIZE > 0:
+        order_cache.set(order_id, (order["userId"], body, order))
+
+    return order["userId"], body
+
+
+def _batch_get_orders(order_ids: List[str]) -> Tuple[List[dict], List[str]]:
+    """
+    Send BatchGetItem requests for up to BATCH_GET_SIZE orders
+
+    Unprocessed keys are retried with a jittered exponential backoff. This
+    returns the orders found and the IDs of the orders that are still
+    unprocessed after BATCH_GET_ATTEMPTS requests.
+    """
+
+    orders = []
+    request_items = {TABLE_NAME: {"Keys": [{"orderId": {"S": order_id}} for order_id in order_ids]}}
+
+    for attempt in range(BATCH_GET_ATTEMPTS):
+        if attempt > 0:
+            # Unprocessed keys are caused by throttling, so back off before
+            # retrying.
+            time.sleep(random.uniform(0, 0.05 * 2**attempt))
+        res = dynamodb.meta.client.batch_get_item(RequestItems=request_items)
+        orders.extend([
+            deserialize_image(item, use_int=True)
+            for item in res.get("Responses", {}).get(TABLE_NAME, [])
+        ])
+        request_items = res.get("UnprocessedKeys", {})
+        if not request_items:
+            break
+
+    return orders, [
+        key["orderId"]["S"]
+        for key in request_items.get(TABLE_NAME, {}).get("Keys", [])
+    ]
+
+
+@tracer.capture_method
+def get_serialized_orders(order_ids: List[str]) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Returns serialized orders by order ID, from the cache if possible, and
+    the IDs of the orders that could not be retrieved
+
+    Orders that are not in the cache are retrieved with parallel BatchGetItem
+    requests. Missing orders are not part of either return values.
+    """
+
+    serialized = {}
+    order_ids_to_get = []
+
+    for order_id in order_ids:
+        cached = order_cache.get(order_id) if ORDER_CACHE_SIZE > 0 else None
+        if cached is not None:
+            serialized[order_id] = cached[1]
+        else:
+            order_ids_to_get.append(order_id)
+
+    if ORDER_CACHE_SIZE > 0:
+        metrics.add_metric(name="orderCacheHit", unit=MetricUnit.Count, value=len(serialized))
+        metrics.add_metric(name="orderCacheMiss", unit=MetricUnit.Count, value=len(order_ids_to_get))
+
+    chunks = [
+        order_ids_to_get[i:i+BATCH_GET_SIZE]
+        for i in range(0, len(order_ids_to_get), BATCH_GET_SIZE)
+    ]
+    unprocessed = []
+    with ThreadPoolExecutor(max_workers=BATCH_GET_WORKERS) as executor:
+        for orders, chunk_unprocessed in executor.map(_batch_get_orders, chunks):
+            unprocessed.extend(chunk_unprocessed)
+            for order in orders:
+                serialized[order["orderId"]] = dumps(order)
+                if ORDER_CACHE_SIZE > 0:
+                    order_cache.set(order["orderId"], (order["userId"], serialized[order["orderId"]], order))
+
+    return serialized, unprocessed
+
+
+def encode_token(offset: int) -> str:
+    """
+    Returns a pagination token for batch requests
+    """
+
+    return base64.urlsafe_b64encode(str(offset).encode("utf-8")).decode("utf-8")
+
+
+def decode_token(token: str) -> Optional[int]:
+    """
+    Returns the offset from a pagination token, or None if the token is not
+    valid
+    """
+
+    try:
+        offset = int(base64.urlsafe_b64decode(token.encode("utf-8")))
+    except ValueError:
+        return None
+
+    return offset if offset >= 0 else None
+
+
+@metrics.log_metrics(raise_on_empty_metrics=False)
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def batch_handler(event, _):
+    """
+    Lambda function handler for BatchGetOrders
+
+    The request body contains a list of "orderIds" and an optional
+    "nextToken". Orders are returned in the same order as the order IDs,
+    with up to BATCH_PAGE_SIZE orders per response. If there are more orders,
+    the response contains a "nextToken" to send with the same order IDs.
+    """
+
+    logger.debug({"message": "Event received", "event": event})
+
+    metrics.add_dimension(name="environment", value=ENVIRONMENT)
+
+    # Retrieve the userId
+    user_id = iam_user_id(event)
+    if user_id is None:
+        logger.warning({"message": "User ID not found in event"})
+        return response("Unauthorized", 401)
+    logger.info({"message": "Received batch get orders from IAM user", "userArn": user_id})
+    tracer.put_annotation("userArn", user_id)
+    tracer.put_annotation("iamUser", True)
+
+    # Parse the request
+    try:
+        body = json.loads(event["body"])
+        order_ids = body["orderIds"]
+        next_token = body.get("nextToken")
+    except (KeyError, TypeError, ValueError, AttributeError):
+        logger.warning({"message": "Order IDs not found in event"})
+        return response("Missing orderIds", 400)
+    if not isinstance(order_ids, list) or not all(isinstance(o, str) for o in order_ids):
+        return response("orderIds must be a list of strings", 400)
+    if len(order_ids) > BATCH_MAX_ORDERS:
+        return response("Too many orderIds, maximum is {}".format(BATCH_MAX_ORDERS), 400)
+    offset = decode_token(next_token) if next_token is not None else 0
+    if offset is None:
+        return response("Invalid nextToken", 400)
+
+    # Remove duplicates while keeping the order
+    order_ids = list(dict.fromkeys(order_ids))
+    page = order_ids[offset:offset+BATCH_PAGE_SIZE]
+    serialized, unprocessed = get_serialized_orders(page)
+
+    logger.info({
+        "message": "Retrieved {} orders".format(len(serialized)),
+        "requested": len(page),
+        "unprocessed": len(unprocessed)
+    })
+
+    # Build the body from the serialized orders to avoid encoding them again
+    next_offset = offset + BATCH_PAGE_SIZE
+    return raw_response("{{\"orders\": [{}], \"unprocessedOrderIds\": {}, \"nextToken\": {}}}".format(
+        ", ".join(serialized[order_id] for order_id in page if order_id in serialized),
+        dumps(unprocessed),
+        dumps(encode_token(next_offset) if next_offset < len(order_ids) else None)
+    ))
+
+
+class OrdersQuery(NamedTuple):
+    """
+    Parameters to list the orders of a user
+
+    `start` and `end` are prefixes of the creation date of the first and last
+    orders to include.
+    """
+
+    start: Optional[str] = None
+    end: Optional[str] = None
+    limit: int = ORDERS_LIMIT
+    fields: Optional[List[str]] = None
+
+
+def parse_orders_query(params: dict) -> OrdersQuery:
+    """
+    Returns the query from the ListUserOrders query string parameters
+
+    This raises a ValueError if a parameter is not valid.
+    """
+
+    fields = parse_fields(params.get("fields"))
+    try:
+        limit = int(params.get("limit", ORDERS_LIMIT))
+    except ValueError as exc:
+        raise ValueError("Invalid limit '{}'".format(params["limit"])) from exc
+    if not 1 <= limit <= ORDERS_MAX_LIMIT:
+        raise ValueError("limit must be between 1 and {}".format(ORDERS_MAX_LIMIT))
+
+    start, end = params.get("from"), params.get("to")
+    for value in [start, end]:
+        if value is not None and DATE_PATTERN.match(value) is None:
+            raise ValueError("Invalid date '{}'".format(value))
+    # Dates are prefixes, so e.g. from=2020-01-05 and to=2020-01 is valid
+    if start is not None and end is not None and start[:len(end)] > end:
+        raise ValueError("from must not be after to")
+
+    return OrdersQuery(start, end, limit, fields)
+
+
+def query_orders(
+        user_id: str,
+        query: OrdersQuery,
+        start_key: Optional[dict] = None
+    ) -> Tuple[List[dict], Optional[dict]]:
+    """
+    Returns a page of orders for a user, newest first, and the key to
+    retrieve the next page
+    """
+
+    names = {"#u": "userId", "#c": "createdDate"}
+    values = {":u": user_id}
+    condition = "#u = :u"
+    # "~" sorts after all characters used in dates, so that prefixes include
+    # all the dates they match.
+    if query.start is not None and query.end is not None:
+        condition += " AND #c BETWEEN :start AND :end"
+        values.update({":start": query.start, ":end": query.end + "~"})
+    elif query.start is not None:
+        condition += " AND #c >= :start"
+        values[":start"] = query.start
+    elif query.end is not None:
+        condition += " AND #c <= :end"
+        values[":end"] = query.end + "~"
+
+    kwargs = {
+        "IndexName": USER_INDEX_NAME,
+        "KeyConditionExpression": condition,
+        "ExpressionAttributeValues": values,
+        "ScanIndexForward": False,
+        "Limit": query.limit
+    }
+    if query.fields is not None:
+        kwargs["ProjectionExpression"] = ", ".join("#f{}".format(i) for i in range(len(query.fields)))
+        names.update({"#f{}".format(i): field for i, field in enumerate(query.fields)})
+    kwargs["ExpressionAttributeNames"] = names
+    if start_key is not None:
+        kwargs["ExclusiveStartKey"] = start_key
+
+    res = table.query(**kwargs) # pylint: disable=no-member
+    return res.get("Items", []), res.get("LastEvaluatedKey")
+
+
+def encode_cursor(key: dict) -> str:
+    """
+    Returns a pagination cursor for a DynamoDB key
+    """
+
+    return base64.urlsafe_b64encode(dumps(key).encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor: str, user_id: str) -> Optional[dict]:
+    """
+    Returns the DynamoDB key from a pagination cursor, or None if the cursor
+    is not valid for that user
+    """
+
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except ValueError:
+        return None
+
+    if not isinstance(key, dict) or set(key.keys()) != {"orderId", "userId", "createdDate"}:
+        return None
+    if not all(isinstance(v, str) for v in key.values()) or key["userId"] != user_id:
+        return None
+
+    return key
+
+
+@tracer.capture_method
+def get_orders_page(
+        user_id: str,
+        query: OrdersQuery,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+    """
+    Returns a page of orders for a user and the cursor for the next page
+    """
+
+    start_key = decode_cursor(cursor, user_id) if cursor is not None else None
+    orders, last_key = query_orders(user_id, query, start_key)
+
+    next_cursor = encode_cursor(last_key) if last_key is not None else None
+    return orders, next_cursor
+
+
+@metrics.log_metrics(raise_on_empty_metrics=False)
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def list_handler(event, _):
+    """
+    Lambda function handler for ListUserOrders
+
+    Orders are returned newest first, with up to 'limit' orders per response.
+    If there are more orders, the response contains a "nextToken" to send with
+    the same query string parameters.
+    """
+
+    logger.debug({"message": "Event received", "event": event})
+
+    metrics.add_dimension(name="environment", value=ENVIRONMENT)
+
+    # Retrieve the userId
+    iam_user = iam_user_id(event)
+    if iam_user is None:
+        logger.warning({"message": "User ID not found in event"})
+        return response("Unauthorized", 401)
+    logger.info({"message": "Received list orders from IAM user", "userArn": iam_user})
+    tracer.put_annotation("userArn", iam_user)
+    tracer.put_annotation("iamUser", True)
+
+    # Retrieve the user to list orders for
+    try:
+        user_id = event["pathParameters"]["userId"]
+    except (KeyError, TypeError):
+        logger.warning({"message": "User ID not found in path"})
+        return response("Missing userId", 400)
+
+    # Parse the query string parameters
+    params = event.get("queryStringParameters") or {}
+    cursor = params.get("nextToken")
+    try:
+        query = parse_orders_query(params)
+        if cursor is not None and decode_cursor(cursor, user_id) is None:
+            raise ValueError("Invalid nextToken")
+    except ValueError as exc:
+        logger.warning({"message": "Invalid parameters in event", "exception": str(exc)})
+        return response(str(exc), 400)
+
+    tracer.put_annotation("userId", user_id)
+
+    orders, next_cursor = get_orders_page(user_id, query, cursor)
+
+    body = "{{\"orders\": [{}], \"nextToken\": {}}}".format(
+        ", ".join(dumps(order) for order in orders),
+        dumps(next_cursor)
+    )
+
+    logger.info({
+        "message": "Retrieved {} orders".format(len(orders)),
+        "userId": user_id,
+        "hasNextPage": next_cursor is not None
+    })
+
+    return raw_response(body)
+
+
+@metrics.log_metrics(raise_on_empty_metrics=False)
 @logger.inject_lambda_context
 @tracer.capture_lambda_handler
 def handler(event, _):
@@ -55,6 +501,8 @@ def handler(event, _):
 
     logger.debug({"message": "Event received", "event": event})
 
+    metrics.add_dimension(name="environment", value=ENVIRONMENT)
+
     # Retrieve the userId
     user_id = iam_user_id(event)
     if user_id is not None:
@@ -73,17 +521,24 @@ def handler(event, _):
         logger.warning({"message": "Order ID not found in event"})
         return response("Missing orderId", 400)
 
+    # Retrieve the fields to return
+    try:
+        fields = parse_fields((event.get("queryStringParameters") or {}).get("fields"))
+    except ValueError as exc:
+        logger.warning({"message": "Invalid fields in event", "exception": str(exc)})
+        return response(str(exc), 400)
+
     # Set a trace annotation
     tracer.put_annotation("orderId", order_id)
 
-    # Retrieve the order from DynamoDB
-    order = get_order(order_id)
+    # Retrieve the order from the cache or DynamoDB
+    serialized = get_serialized_order(order_id, fields)
 
     # Check that the order can be sent to the user
     # This includes both when the item is not found and when the user IDs do
     # not match.
-    if order is None or (not iam_user and user_id != order["userId"]):
+    if serialized is None or (not iam_user and user_id != serialized[0]):
         return response("Order not found", 404)
 
     # Send the response
-    return response(order)
+    return raw_response(serialized[1])
@@ -4,17 +4,33 @@ OnPackageCreated Function
 
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import os
-from typing import List, Optional
+import random
+import time
+from typing import Dict, List, Optional, Tuple
 import boto3
+from botocore.exceptions import ClientError
 from aws_lambda_powertools.tracing import Tracer # pylint: disable=import-error
 from aws_lambda_powertools.logging.logger import Logger # pylint: disable=import-error
 from aws_lambda_powertools import Metrics # pylint: disable=import-error
 from aws_lambda_powertools.metrics import MetricUnit # pylint: disable=import-error
+from ecom.orders import ALLOWED_TRANSITIONS # pylint: disable=import-error
 
 
 ENVIRONMENT = os.environ["ENVIRONMENT"]
 TABLE_NAME = os.environ["TABLE_NAME"]
+# Status and metric name by (source, detail-type)
+EVENT_UPDATES = {
+    ("ecommerce.warehouse", "PackageCreated"): ("PACKAGED", "orderPackaged"),
+    ("ecommerce.warehouse", "PackagingFailed"): ("PACKAGING_FAILED", "orderFailed"),
+    ("ecommerce.delivery", "DeliveryCompleted"): ("FULFILLED", "orderFulfilled"),
+    ("ecommerce.delivery", "DeliveryFailed"): ("DELIVERY_FAILED", "orderFailed")
+}
+# Maximum number of orders updated concurrently
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", "10"))
+UPDATE_ATTEMPTS = 3
+UPDATE_BACKOFF = 0.1
 
 
 dynamodb = boto3.resource("dynamodb") # pylint: disable=invalid-name
@@ -25,9 +41,14 @@ metrics = Metrics(namespace="ecommerce.orders") # pylint: disable=invalid-name
 
 
 @tracer.capture_method
-def update_order(order_id: str, status: str, products: Optional[List[dict]] = None) -> None:
+def update_order(order_id: str, status: str, products: Optional[List[dict]] = None) -> bool:
     """
     Update packages in the order
+
+    The update is only applied if the order exists and the transition to the
+    new status is allowed, without reading the order first. This returns
+    False if the update was rejected, e.g. for duplicate or out-of-order
+    events.
     """
 
     logger.info({
@@ -45,28 +66,84 @@ def update_order(order_id: str, status: str, products: Optional[List[dict]] = No
     }
 
     if products is not None:
-        product_ids = [p["productId"] for p in products]
-
-        item = table.get_item(
-            Key={"orderId": order_id},
-            AttributesToGet=["products"]
-        )["Item"]
-        new_products = []
-        for product in item["products"]:
-            if product["productId"] in product_ids:
-                new_products.append(product)
-
         update_expression += ", #p = :p"
         attribute_names["#p"] = "products"
         attribute_values[":p"] = products
 
+    from_statuses = ALLOWED_TRANSITIONS[status]
+    for i, from_status in enumerate(from_statuses):
+        attribute_values[":s{}".format(i)] = from_status
 
-    table.update_item(
-        Key={"orderId": order_id},
-        UpdateExpression=update_expression,
-        ExpressionAttributeNames=attribute_names,
-        ExpressionAttributeValues=attribute_values
-    )
+    try:
+        table.update_item(
+            Key={"orderId": order_id},
+            UpdateExpression=update_expression,
+            ConditionExpression="#s IN ({})".format(
+                ", ".join(":s{}".format(i) for i in range(len(from_statuses)))
+            ),
+            ExpressionAttributeNames=attribute_names,
+            ExpressionAttributeValues=attribute_values
+        )
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        logger.warning({
+            "message": "Rejected status update for order {} to {}".format(order_id, status),
+            "orderId": order_id,
+            "status": status,
+            "allowedFrom": from_statuses
+        })
+        return False
+
+    return True
+
+
+def update_orders(
+        order_ids: List[str],
+        status: str,
+        products: Optional[List[dict]] = None
+    ) -> Tuple[Dict[str, bool], Dict[str, Exception]]:
+    """
+    Update multiple orders concurrently
+
+    Orders that failed to update are retried with a jittered exponential
+    backoff, for up to UPDATE_ATTEMPTS rounds. This returns the result of
+    update_order() by order ID for the orders that were processed, and the
+    last exception by order ID for the orders that failed.
+    """
+
+    def _update(order_id: str) -> Tuple[str, Optional[bool], Optional[Exception]]:
+        try:
+            return order_id, update_order(order_id, status, products), None
+        except Exception as exc: # pylint: disable=broad-except
+            return order_id, None, exc
+
+    results = {}
+    failed = {}
+    pending = list(dict.fromkeys(order_ids))
+
+    with ThreadPoolExecutor(max_workers=UPDATE_WORKERS) as executor:
+        for attempt in range(UPDATE_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(random.uniform(0, UPDATE_BACKOFF * 2**(attempt-1)))
+
+            failed = {}
+            for order_id, result, exc in executor.map(_update, pending):
+                if exc is None:
+                    results[order_id] = result
+                else:
+                    failed[order_id] = exc
+
+            if not failed:
+                break
+            logger.warning({
+                "message": "Failed to update {} orders".format(len(failed)),
+                "attempt": attempt + 1,
+                "orderIds": list(failed.keys())
+            })
+            pending = list(failed.keys())
+
+    return results, failed
 
 
 @metrics.log_metrics
@@ -81,51 +158,40 @@ def handler(event, _):
 
     metrics_data = defaultdict(int)
 
-    for order_id in order_ids:
-        logger.info({
-            "message": "Got event of type {} from {} for order {}".format(event["detail-type"], event["source"], order_id),
+    logger.info({
+        "message": "Got event of type {} from {} for {} orders".format(
+            event["detail-type"], event["source"], len(order_ids)
+        ),
+        "source": event["source"],
+        "eventType": event["detail-type"],
+        "orderIds": order_ids
+    })
+    if len(order_ids) == 1:
+        tracer.put_annotation("orderId", order_ids[0])
+
+    failed = {}
+    update = EVENT_UPDATES.get((event["source"], event["detail-type"]))
+    if update is None:
+        logger.warning({
+            "message": "Unknown event type {} from {}".format(event["detail-type"], event["source"]),
             "source": event["source"],
             "eventType": event["detail-type"],
-            "orderId": order_id
+            "orderIds": order_ids
         })
-        tracer.put_annotation("orderId", order_id)
-        if event["source"] == "ecommerce.warehouse":
-            if event["detail-type"] == "PackageCreated":
-                metrics_data["orderPackaged"] += 1
-                update_order(order_id, "PACKAGED", event["detail"]["products"])
-            elif event["detail-type"] == "PackagingFailed":
-                metrics_data["orderFailed"] += 1
-                update_order(order_id, "PACKAGING_FAILED")
-            else:
-                logger.warning({
-                    "message": "Unknown event type {} for order {}".format(event["detail-type"], order_id),
-                    "source": event["source"],
-                    "eventType": event["detail-type"],
-                    "orderId": order_id
-                })
-        elif event["source"] == "ecommerce.delivery":
-            if event["detail-type"] == "DeliveryCompleted":
-                metrics_data["orderFulfilled"] += 1
-                update_order(order_id, "FULFILLED")
-            elif event["detail-type"] == "DeliveryFailed":
-                metrics_data["orderFailed"] += 1
-                update_order(order_id, "DELIVERY_FAILED")
-            else:
-                logger.warning({
-                    "message": "Unknown event type {} for order {}".format(event["detail-type"], order_id),
-                    "source": event["source"],
-                    "eventType": event["detail-type"],
-                    "orderId": order_id
-                })
-        else:
-            logger.warning({
-                "message": "Unknown source {} for order {}".format(event["source"], order_id),
-                "source": event["source"],
-                "eventType": event["detail-type"],
-                "orderId": order_id
-            })
+    else:
+        status, metric_name = update
+        products = event["detail"]["products"] if status == "PACKAGED" else None
+        results, failed = update_orders(order_ids, status, products)
+        for applied in results.values():
+            metrics_data[metric_name if applied else "orderUpdateRejected"] += 1
+        if failed:
+            metrics_data["orderUpdateFailed"] += len(failed)
 
     # Add custom metrics
     metrics.add_dimension(name="environment", value=ENVIRONMENT)
     for key, value in metrics_data.items():
-        metrics.add_metric(name=key, unit=MetricUnit.Count, value=value)
\ No newline at end of file
+        metrics.add_metric(name=key, unit=MetricUnit.Count, value=value)
+
+    # Raise an error so that the event is retried or sent to the DLQ
+    if failed:
+        raise Exception("Failed to update orders {}".format(", ".join(failed.keys())))
@@ -9,11 +9,35 @@ import boto3
 from boto3.dynamodb.types import TypeDeserializer
 from aws_lambda_powertools.tracing import Tracer
 from aws_lambda_powertools.logging.logger import Logger
-from ecom.eventbridge import ddb_to_event # pylint: disable=import-error
+from ecom.dynamodb import deserialize # pylint: disable=import-error
+from ecom.eventbridge import changed_keys, publish_events, records_to_events # pylint: disable=import-error
+from ecom.orders import STATUS_TRANSITIONS # pylint: disable=import-error
 
 
 ENVIRONMENT = os.environ["ENVIRONMENT"]
 EVENT_BUS_NAME = os.environ["EVENT_BUS_NAME"]
+# Merge repeated modifications of the same item within a batch of records
+COALESCE_RECORDS = os.environ.get("COALESCE_RECORDS", "false").lower() == "true"
+
+# Records that produce an event, by event type
+#
+# True means that all records produce an event. For OrderModified, this
+# maps fields to False if their changes alone do not produce an event, or to
+# the set of (old, new) values that produce an event. Changes to any other
+# field produce an event.
+EVENT_RULES = {
+    "OrderCreated": True,
+    "OrderDeleted": True,
+    "OrderModified": {
+        "status": STATUS_TRANSITIONS,
+        "modifiedDate": False
+    }
+}
+DETAIL_TYPES = {
+    "INSERT": "OrderCreated",
+    "MODIFY": "OrderModified",
+    "REMOVE": "OrderDeleted"
+}
 
 
 eventbridge = boto3.client("events") # pylint: disable=invalid-name
@@ -29,9 +53,35 @@ def send_events(events: List[dict]):
     """
 
     logger.info("Sending %d events to EventBridge", len(events))
-    # EventBridge only supports batches of up to 10 events
-    for i in range(0, len(events), 10):
-        eventbridge.put_events(Entries=events[i:i+10])
+    publish_events(eventbridge, events, logger=logger, raise_on_failure=True)
+
+
+def skip_record(ddb_record: dict) -> bool:
+    """
+    Returns True if a stream record does not produce any event
+
+    See EVENT_RULES.
+    """
+
+    rule = EVENT_RULES.get(DETAIL_TYPES.get(ddb_record["eventName"].upper()))
+    if rule is None or rule is True:
+        return rule is None
+
+    new_image = ddb_record["dynamodb"]["NewImage"]
+    old_image = ddb_record["dynamodb"]["OldImage"]
+    for key in changed_keys(new_image, old_image):
+        field_rule = rule.get(key, True)
+        if field_rule is True:
+            return False
+        if field_rule is not False:
+            transition = (
+                deserialize(old_image[key]) if key in old_image else None,
+                deserialize(new_image[key]) if key in new_image else None
+            )
+            if transition in field_rule:
+                return False
+
+    return True
 
 
 @logger.inject_lambda_context
@@ -51,15 +101,22 @@ def handler(event, _):
         "records": event.get("Records", [])
     })
 
-    events = [
-        ddb_to_event(record, EVENT_BUS_NAME, "ecommerce.orders", "Order", "orderId")
-        for record in event.get("Records", [])
-    ]
-
-    logger.info("Received %d event(s)", len(events))
+    events = records_to_events(
+        event.get("Records", []),
+        EVENT_BUS_NAME, "ecommerce.orders", "Order", "orderId",
+        use_int=True,
+        skip_record=skip_record,
+        coalesce=COALESCE_RECORDS,
+        # Coalescing two status changes could merge two allowed transitions
+        # into one that is not in STATUS_TRANSITIONS.
+        boundary_keys=["status"]
+    )
+
+    logger.info("Received %d event(s) from %d record(s)", len(events), len(event.get("Records", [])))
     logger.debug({
         "message": "Events processed from records",
         "events": events
     })
 
-    send_events(events)
+    if events:
+        send_events(events)
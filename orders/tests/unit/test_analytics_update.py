@@ -0,0 +1,263 @@
+import copy
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+from botocore import stub
+from botocore.exceptions import ClientError
+from fixtures import context, lambda_module, get_order, get_product # pylint: disable=import-error
+
+
+lambda_module = pytest.fixture(scope="module", params=[{
+    "function_dir": "analytics_update",
+    "module_name": "main",
+    "environ": {
+        "ENVIRONMENT": "test",
+        "ANALYTICS_TABLE_NAME": "ANALYTICS_TABLE_NAME",
+        "POWERTOOLS_TRACE_DISABLED": "true"
+    }
+}])(lambda_module)
+context = pytest.fixture(context)
+
+
+@pytest.fixture
+def order(get_order):
+    order = get_order()
+    order["createdDate"] = "2020-01-23T10:53:49.131052"
+    order["modifiedDate"] = "2020-01-23T10:53:49.131052"
+    order["status"] = "NEW"
+    order["address"]["country"] = "SE"
+    order["total"] = 1400
+    return order
+
+
+def get_record(
+        event_name: str, old_order: dict = None, new_order: dict = None,
+        sequence_number: str = "100"
+    ) -> dict:
+    """
+    Returns a stream record
+    """
+
+    order = new_order or old_order
+    record = {
+        "dynamodb": {
+            "Keys": {"orderId": {"S": order["orderId"]}},
+            "SequenceNumber": sequence_number,
+            "StreamViewType": "NEW_AND_OLD_IMAGES"
+        },
+        "eventName": event_name,
+        "eventSource": "aws:dynamodb"
+    }
+    if old_order is not None:
+        record["dynamodb"]["OldImage"] = {k: TypeSerializer().serialize(v) for k, v in old_order.items()}
+    if new_order is not None:
+        record["dynamodb"]["NewImage"] = {k: TypeSerializer().serialize(v) for k, v in new_order.items()}
+    return record
+
+
+def test_aggregate(lambda_module, order):
+    """
+    Test aggregate()
+    """
+
+    packaged_order = copy.deepcopy(order)
+    packaged_order["status"] = "PACKAGED"
+    packaged_order["modifiedDate"] = "2020-01-23T11:02:00"
+    other_order = copy.deepcopy(order)
+    other_order["orderId"] = "OTHER_ORDER"
+    other_order["address"]["country"] = "FR"
+    other_order["total"] = 1000
+
+    deltas = lambda_module.aggregate([
+        get_record("INSERT", new_order=order),
+        get_record("INSERT", new_order=other_order),
+        get_record("MODIFY", order, packaged_order)
+    ])
+
+    assert deltas == {
+        ("total", "2020-01-23T10"): {"orders": 2, "revenue": 2400},
+        ("country#SE", "2020-01-23T10"): {"orders": 1, "revenue": 1400},
+        ("country#FR", "2020-01-23T10"): {"orders": 1, "revenue": 1000},
+        # NEW orders cancel out
+        ("current", "NEW"): {"orders": 1},
+        ("current", "PACKAGED"): {"orders": 1},
+        ("status#PACKAGED", "2020-01-23T11"): {"orders": 1}
+    }
+
+
+def test_aggregate_modify_total(lambda_module, order):
+    """
+    Test aggregate() with a change of total
+    """
+
+    new_order = copy.deepcopy(order)
+    new_order["total"] = 1000
+    new_order["modifiedDate"] = "2020-01-24T10:00:00"
+
+    deltas = lambda_module.aggregate([get_record("MODIFY", order, new_order)])
+
+    assert deltas == {
+        ("total", "2020-01-23T10"): {"revenue": -400},
+        ("country#SE", "2020-01-23T10"): {"revenue": -400}
+    }
+
+
+def test_aggregate_remove(lambda_module, order):
+    """
+    Test aggregate() with a deleted order
+    """
+
+    deltas = lambda_module.aggregate([get_record("REMOVE", old_order=order)])
+
+    assert deltas == {
+        ("total", "2020-01-23T10"): {"orders": -1, "revenue": -1400},
+        ("country#SE", "2020-01-23T10"): {"orders": -1, "revenue": -1400},
+        ("current", "NEW"): {"orders": -1}
+    }
+
+
+def test_get_batch_id(lambda_module, order):
+    """
+    Test get_batch_id()
+    """
+
+    batch_id = lambda_module.get_batch_id([
+        get_record("INSERT", new_order=order, sequence_number="100"),
+        get_record("INSERT", new_order=order, sequence_number="200"),
+        get_record("INSERT", new_order=order, sequence_number="300")
+    ])
+
+    assert batch_id == "100-300"
+
+
+def test_update_counter(monkeypatch, lambda_module):
+    """
+    Test update_counter()
+    """
+
+    monkeypatch.setattr(lambda_module.time, "time", lambda: 1000)
+
+    table = stub.Stubber(lambda_module.table.meta.client)
+    expected_params = {
+        "TransactItems": [
+            {"Put": {
+                "TableName": "ANALYTICS_TABLE_NAME",
+                "Item": {
+                    "view": "batch#100-300",
+                    "bucket": "total#2020-01-23T10",
+                    "expiresAt": 1000 + lambda_module.MARKER_TTL
+                },
+                "ConditionExpression": "attribute_not_exists(#v)",
+                "ExpressionAttributeNames": {"#v": "view"}
+            }},
+            {"Update": {
+                "TableName": "ANALYTICS_TABLE_NAME",
+                "Key": {"view": "total", "bucket": "2020-01-23T10"},
+                "UpdateExpression": "ADD #a0 :a0, #a1 :a1",
+                "ExpressionAttributeNames": {"#a0": "orders", "#a1": "revenue"},
+                "ExpressionAttributeValues": {":a0": 2, ":a1": 2400}
+            }}
+        ]
+    }
+    table.add_response("transact_write_items", {}, expected_params)
+    table.activate()
+
+    retval = lambda_module.update_counter("total", "2020-01-23T10", {"orders": 2, "revenue": 2400}, "100-300")
+
+    assert retval == True
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+
+def test_update_counter_applied(lambda_module):
+    """
+    Test update_counter() with deltas that were already applied
+    """
+
+    table = stub.Stubber(lambda_module.table.meta.client)
+    table.add_client_error(
+        "transact_write_items", "TransactionCanceledException",
+        modeled_fields={"CancellationReasons": [
+            {"Code": "ConditionalCheckFailed"}, {"Code": "None"}
+        ]}
+    )
+    table.activate()
+
+    retval = lambda_module.update_counter("total", "2020-01-23T10", {"orders": 2}, "100-300")
+
+    assert retval == False
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+
+def test_update_counter_conflict(lambda_module):
+    """
+    Test update_counter() with a transaction conflict
+    """
+
+    table = stub.Stubber(lambda_module.table.meta.client)
+    table.add_client_error(
+        "transact_write_items", "TransactionCanceledException",
+        modeled_fields={"CancellationReasons": [
+            {"Code": "None"}, {"Code": "TransactionConflict"}
+        ]}
+    )
+    table.activate()
+
+    with pytest.raises(ClientError):
+        lambda_module.update_counter("total", "2020-01-23T10", {"orders": 2}, "100-300")
+
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+
+def test_update_counters_retry(monkeypatch, lambda_module):
+    """
+    Test update_counters() with failures
+    """
+
+    calls = []
+
+    def update_counter(view: str, bucket: str, values: dict, batch_id: str) -> bool:
+        calls.append(view)
+        if view == "fail" or (view == "retry" and calls.count(view) == 1):
+            raise ValueError("Something went wrong")
+        return True
+
+    monkeypatch.setattr(lambda_module, "update_counter", update_counter)
+    monkeypatch.setattr(lambda_module.time, "sleep", lambda _: None)
+
+    failed = lambda_module.update_counters({
+        ("ok", "1"): {"orders": 1},
+        ("retry", "1"): {"orders": 1},
+        ("fail", "1"): {"orders": 1}
+    }, "100-100")
+
+    assert failed == [("fail", "1")]
+    assert calls.count("ok") == 1
+    assert calls.count("retry") == 2
+    assert calls.count("fail") == lambda_module.UPDATE_ATTEMPTS
+
+
+def test_handler(monkeypatch, lambda_module, context, order):
+    """
+    Test handler()
+    """
+
+    updates = {}
+
+    def update_counter(view: str, bucket: str, values: dict, batch_id: str) -> bool:
+        updates[(view, bucket)] = values
+        assert batch_id == "100-100"
+        return True
+
+    monkeypatch.setattr(lambda_module, "update_counter", update_counter)
+
+    lambda_module.handler({"Records": [
+        get_record("INSERT", new_order=order)
+    ]}, context)
+
+    assert updates == {
+        ("total", "2020-01-23T10"): {"orders": 1, "revenue": 1400},
+        ("country#SE", "2020-01-23T10"): {"orders": 1, "revenue": 1400},
+        ("current", "NEW"): {"orders": 1}
+    }
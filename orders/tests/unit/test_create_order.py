@@ -1,11 +1,16 @@
 import asyncio
 import copy
+import importlib
 import json
-from typing import Tuple
+import time
+import timeit
+from typing import List, Tuple
+import aiohttp
 from botocore import stub
+from botocore.exceptions import ClientError
+import jsonschema
 import pytest
-import requests
-import requests_mock
+from ecom import pricing as delivery_pricing # pylint: disable=import-error
 from fixtures import context, lambda_module, get_order, get_product # pylint: disable=import-error
 from helpers import compare_dict, mock_table # pylint: disable=import-error,no-name-in-module
 
@@ -19,12 +24,69 @@ lambda_module = pytest.fixture(scope="module", params=[{
         "PAYMENT_API_URL": "mock://PAYMENT_API_URL",
         "PRODUCTS_API_URL": "mock://PRODUCTS_API_URL",
         "TABLE_NAME": "TABLE_NAME",
+        "IDEMPOTENCY_TABLE_NAME": "IDEMPOTENCY_TABLE_NAME",
         "POWERTOOLS_TRACE_DISABLED": "true"
     }
 }])(lambda_module)
 context = pytest.fixture(context)
 
 
+@pytest.fixture(scope="module")
+def validation_module(lambda_module):
+    """
+    Validation module shared by the Lambda functions
+    """
+
+    return importlib.import_module("validation")
+
+
+@pytest.fixture(scope="module")
+def quote_module(lambda_module):
+    """
+    Module of the QuoteOrder Lambda function
+    """
+
+    return importlib.import_module("quote")
+
+
+@pytest.fixture(scope="module")
+def batch_module(lambda_module):
+    """
+    Module of the BatchCreateOrders Lambda function
+    """
+
+    return importlib.import_module("batch")
+
+
+@pytest.fixture
+def mock_backend(monkeypatch, validation_module):
+    """
+    Mock backend requests
+
+    Responses are registered with `mock_backend.post(url, payload, status)`
+    and the requests received are stored in `mock_backend.requests`.
+    """
+
+    class MockBackend:
+        def __init__(self):
+            self.responses = {}
+            self.requests = []
+
+        def post(self, url: str, payload: dict, status: int = 200) -> None:
+            self.responses[("POST", url)] = (status, payload)
+
+        async def request(self, method: str, url: str, context=None, timeout=None, json=None, **kwargs):
+            self.requests.append({"method": method, "url": url, "json": json})
+            return self.responses[(method, url)]
+
+    backend = MockBackend()
+    monkeypatch.setattr(validation_module.aiobackend, "request", backend.request)
+    # Start with empty caches, so that requests are sent to the backends
+    validation_module.product_cache.clear()
+    validation_module.rate_table_version.clear()
+    return backend
+
+
 @pytest.fixture
 def order(get_order):
     """
@@ -46,12 +108,12 @@ def complete_order(get_order):
     return get_order()
 
 
-def test_inject_order_fields(lambda_module, order):
+def test_inject_order_fields(validation_module, order):
     """
     Test inject_order_fields()
     """
 
-    new_order = lambda_module.inject_order_fields(order)
+    new_order = validation_module.inject_order_fields(order)
 
     assert "orderId" in new_order
     assert "createdDate" in new_order
@@ -60,209 +122,469 @@ def test_inject_order_fields(lambda_module, order):
     assert new_order["total"] == sum([p["price"]*p.get("quantity", 1) for p in order["products"]]) + order["deliveryPrice"]
 
 
-def test_validate_delivery(lambda_module, order):
+def test_validate_delivery(validation_module, mock_backend, order):
     """
     Test validate_delivery()
     """
 
     url = "mock://DELIVERY_API_URL/backend/pricing"
 
-    with requests_mock.Mocker() as m:
-        m.post(url, text=json.dumps({"pricing": order["deliveryPrice"]}))
+    mock_backend.post(url, payload={"pricing": order["deliveryPrice"]})
 
-        valid, error_msg = lambda_module.validate_delivery(order)
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_delivery(order))
 
     print(valid, error_msg)
 
-    assert m.called
-    assert m.call_count == 1
-    assert m.request_history[0].method == "POST"
-    assert m.request_history[0].url == url
+    assert len(mock_backend.requests) == 1
+    assert mock_backend.requests[0]["method"] == "POST"
+    assert mock_backend.requests[0]["url"] == url
     assert valid == True
 
 
-def test_validate_delivery_incorrect(lambda_module, order):
+def test_validate_delivery_incorrect(validation_module, mock_backend, order):
     """
     Test validate_delivery() with incorrect price
     """
 
     url = "mock://DELIVERY_API_URL/backend/pricing"
 
-    with requests_mock.Mocker() as m:
-        m.post(url, text=json.dumps({"pricing": order["deliveryPrice"]+200}))
+    mock_backend.post(url, payload={"pricing": order["deliveryPrice"]+200})
 
-        valid, error_msg = lambda_module.validate_delivery(order)
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_delivery(order))
 
     print(valid, error_msg)
 
-    assert m.called
-    assert m.call_count == 1
-    assert m.request_history[0].method == "POST"
-    assert m.request_history[0].url == url
+    assert len(mock_backend.requests) == 1
+    assert mock_backend.requests[0]["method"] == "POST"
+    assert mock_backend.requests[0]["url"] == url
     assert valid == False
 
 
-def test_validate_delivery_fail(lambda_module, order):
+def test_validate_delivery_fail(validation_module, mock_backend, order):
     """
     Test validate_delivery() failing
     """
 
     url = "mock://DELIVERY_API_URL/backend/pricing"
 
-    with requests_mock.Mocker() as m:
-        m.post(url, text=json.dumps({"message": "Something went wrong"}), status_code=400)
+    mock_backend.post(url, payload={"message": "Something went wrong"}, status=400)
 
-        valid, error_msg = lambda_module.validate_delivery(order)
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_delivery(order))
 
     print(valid, error_msg)
 
-    assert m.called
-    assert m.call_count == 1
-    assert m.request_history[0].method == "POST"
-    assert m.request_history[0].url == url
+    assert len(mock_backend.requests) == 1
+    assert mock_backend.requests[0]["method"] == "POST"
+    assert mock_backend.requests[0]["url"] == url
+    assert valid == False
+
+
+def test_validate_delivery_local(validation_module, mock_backend, order):
+    """
+    Test validate_delivery() with an up to date local rate table
+    """
+
+    url = "mock://DELIVERY_API_URL/backend/pricing"
+
+    order = copy.deepcopy(order)
+    order["deliveryPrice"] = validation_module.delivery_pricing.get_pricing(order["products"], order["address"])
+    mock_backend.post(url, payload={
+        "pricing": order["deliveryPrice"],
+        "version": validation_module.delivery_pricing.RATE_TABLE_VERSION
+    })
+
+    # The first call checks the rate table version
+    for _ in range(3):
+        valid, _ = validation_module.aiobackend.run(validation_module.validate_delivery(order))
+        assert valid == True
+    assert len(mock_backend.requests) == 1
+
+    order["deliveryPrice"] += 100
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_delivery(order))
     assert valid == False
+    assert error_msg.startswith("Wrong delivery price")
+    assert len(mock_backend.requests) == 1
+
 
+def test_validate_delivery_stale(validation_module, mock_backend, order):
+    """
+    Test validate_delivery() with a stale local rate table
+    """
+
+    url = "mock://DELIVERY_API_URL/backend/pricing"
+    mock_backend.post(url, payload={"pricing": order["deliveryPrice"], "version": "STALE"})
 
-def test_validate_payment(lambda_module, complete_order):
+    for _ in range(3):
+        valid, _ = validation_module.aiobackend.run(validation_module.validate_delivery(order))
+        assert valid == True
+    assert len(mock_backend.requests) == 3
+
+
+def test_validate_payment(validation_module, mock_backend, complete_order):
     """
     Test validate_payment()
     """
 
     url = "mock://PAYMENT_API_URL/backend/validate"
 
-    with requests_mock.Mocker() as m:
-        m.post(url, text=json.dumps({"ok": True}))
+    mock_backend.post(url, payload={"ok": True})
 
-        valid, error_msg = lambda_module.validate_payment(complete_order)
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_payment(complete_order))
 
     print(valid, error_msg)
 
-    assert m.called
-    assert m.call_count == 1
-    assert m.request_history[0].method == "POST"
-    assert m.request_history[0].url == url
+    assert len(mock_backend.requests) == 1
+    assert mock_backend.requests[0]["method"] == "POST"
+    assert mock_backend.requests[0]["url"] == url
     assert valid == True
 
 
-def test_valid_payment_incorrect(lambda_module, complete_order):
+def test_valid_payment_incorrect(validation_module, mock_backend, complete_order):
     """
     Test validate_payment()
     """
 
     url = "mock://PAYMENT_API_URL/backend/validate"
 
-    with requests_mock.Mocker() as m:
-        m.post(url, text=json.dumps({"ok": False}))
+    mock_backend.post(url, payload={"ok": False})
 
-        valid, error_msg = lambda_module.validate_payment(complete_order)
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_payment(complete_order))
 
     print(valid, error_msg)
 
-    assert m.called
-    assert m.call_count == 1
-    assert m.request_history[0].method == "POST"
-    assert m.request_history[0].url == url
+    assert len(mock_backend.requests) == 1
+    assert mock_backend.requests[0]["method"] == "POST"
+    assert mock_backend.requests[0]["url"] == url
     assert valid == False
 
 
-def test_valid_payment_fail(lambda_module, complete_order):
+def test_valid_payment_fail(validation_module, mock_backend, complete_order):
     """
     Test validate_payment()
     """
 
     url = "mock://PAYMENT_API_URL/backend/validate"
 
-    with requests_mock.Mocker() as m:
-        m.post(url, text=json.dumps({"message": "Something went wrong"}), status_code=400)
+    mock_backend.post(url, payload={"message": "Something went wrong"}, status=400)
 
-        valid, error_msg = lambda_module.validate_payment(complete_order)
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_payment(complete_order))
 
     print(valid, error_msg)
 
-    assert m.called
-    assert m.call_count == 1
-    assert m.request_history[0].method == "POST"
-    assert m.request_history[0].url == url
+    assert len(mock_backend.requests) == 1
+    assert mock_backend.requests[0]["method"] == "POST"
+    assert mock_backend.requests[0]["url"] == url
     assert valid == False
 
 
-def test_validate_products(lambda_module, order):
+def test_validate_products(validation_module, mock_backend, order):
     """
     Test validate_products()
     """
 
     url = "mock://PRODUCTS_API_URL/backend/validate"
 
-    with requests_mock.Mocker() as m:
-        m.post(url, text=json.dumps({"message": "All products are valid"}))
+    mock_backend.post(url, payload={"message": "All products are valid"})
 
-        valid, error_msg = lambda_module.validate_products(order)
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_products(order))
 
     print(valid, error_msg)
 
-    assert m.called
-    assert m.call_count == 1
-    assert m.request_history[0].method == "POST"
-    assert m.request_history[0].url == url
+    assert len(mock_backend.requests) == 1
+    assert mock_backend.requests[0]["method"] == "POST"
+    assert mock_backend.requests[0]["url"] == url
     assert valid == True
 
 
-def test_validate_products_fail(lambda_module, order):
+def test_validate_products_fail(validation_module, mock_backend, order):
     """
     Test validate_products() failing
     """
 
     url = "mock://PRODUCTS_API_URL/backend/validate"
 
-    with requests_mock.Mocker() as m:
-        m.post(
-            url,
-            text=json.dumps({"message": "Something is wrong", "products": order["products"]}),
-            status_code=200
-        )
+    mock_backend.post(
+        url,
+        payload={"message": "Something is wrong", "products": order["products"]},
+        status=200
+    )
 
-        valid, error_msg = lambda_module.validate_products(order)
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_products(order))
 
     print(valid, error_msg)
 
-    assert m.called
-    assert m.call_count == 1
-    assert m.request_history[0].method == "POST"
-    assert m.request_history[0].url == url
+    assert len(mock_backend.requests) == 1
+    assert mock_backend.requests[0]["method"] == "POST"
+    assert mock_backend.requests[0]["url"] == url
     assert valid == False
     assert error_msg == "Something is wrong"
 
 
-def test_validate(monkeypatch, lambda_module, order):
+def test_validate_products_cache(validation_module, mock_backend, order):
+    """
+    Test validate_products() with cached products
+    """
+
+    url = "mock://PRODUCTS_API_URL/backend/validate"
+    mock_backend.post(url, payload={"message": "All products are valid"})
+
+    # First call populates the cache
+    valid, _ = validation_module.aiobackend.run(validation_module.validate_products(order))
+    assert valid == True
+    assert len(mock_backend.requests) == 1
+
+    # Second call is served from the cache
+    valid, _ = validation_module.aiobackend.run(validation_module.validate_products(order))
+    assert valid == True
+    assert len(mock_backend.requests) == 1
+
+    # Products that differ from the cache are sent to the products service
+    order = copy.deepcopy(order)
+    order["products"][0]["price"] += 100
+    validation_module.aiobackend.run(validation_module.validate_products(order))
+    assert len(mock_backend.requests) == 2
+    assert mock_backend.requests[1]["json"] == {"products": [order["products"][0]]}
+
+
+def test_validate_products_cache_invalid(validation_module, mock_backend, order):
+    """
+    Test that validate_products() does not cache invalid products
+    """
+
+    url = "mock://PRODUCTS_API_URL/backend/validate"
+    mock_backend.post(url, payload={"message": "Something is wrong", "products": order["products"][:1]})
+
+    valid, _ = validation_module.aiobackend.run(validation_module.validate_products(order))
+    assert valid == False
+    assert validation_module.product_cache.get(order["products"][0]["productId"]) is None
+    for product in order["products"][1:]:
+        assert validation_module.product_cache.get(product["productId"]) == validation_module.product_fingerprint(product)
+
+
+def test_call_backend_timeout(monkeypatch, validation_module, mock_backend, order):
+    """
+    Test call_backend() with a backend slower than its deadline
+    """
+
+    async def post(url: str, context=None, timeout=None, json=None):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(validation_module.aiobackend, "post", post)
+    monkeypatch.setitem(validation_module.BACKEND_TIMEOUTS, "delivery", 0.05)
+
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_delivery(order))
+
+    assert valid == False
+    assert error_msg == "Failure to contact the delivery service"
+
+
+def test_call_backend_client_error(monkeypatch, validation_module, mock_backend, order):
+    """
+    Test call_backend() with a connection error
+    """
+
+    async def post(url: str, context=None, timeout=None, json=None):
+        raise aiohttp.ClientConnectionError("Connection refused")
+
+    monkeypatch.setattr(validation_module.aiobackend, "post", post)
+    breaker = validation_module.CircuitBreaker("delivery", failure_threshold=5)
+    monkeypatch.setitem(validation_module.breakers, "delivery", breaker)
+
+    valid, error_msg = validation_module.aiobackend.run(validation_module.validate_delivery(order))
+
+    assert valid == False
+    assert error_msg == "Failure to contact the delivery service"
+    assert breaker.failures == 1
+
+
+def test_call_backend_hedge(monkeypatch, validation_module):
+    """
+    Test call_backend() sending a hedged request
+    """
+
+    calls = []
+
+    async def post(url: str, context=None, timeout=None, json=None):
+        calls.append(url)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+        return (200, {"ok": True})
+
+    latencies = validation_module.aiobackend.LatencyTracker()
+    for _ in range(latencies.min_samples):
+        latencies.add(10)
+
+    monkeypatch.setattr(validation_module.aiobackend, "post", post)
+    monkeypatch.setattr(validation_module, "HEDGE_PERCENTILE", 95)
+    monkeypatch.setitem(validation_module.latencies, "payment", latencies)
+
+    status_code, body = validation_module.aiobackend.run(
+        validation_module.call_backend("payment", "mock://PAYMENT_API_URL/backend/validate")
+    )
+
+    assert status_code == 200
+    assert body == {"ok": True}
+    assert len(calls) == 2
+    # The hedged request is not tracked
+    assert len(latencies.samples) == latencies.min_samples
+
+
+@pytest.mark.parametrize("status_code,tracked", [
+    (200, True),
+    (400, False),
+    (500, False),
+    (None, False)
+])
+def test_call_backend_latency(monkeypatch, validation_module, status_code, tracked):
+    """
+    Test that call_backend() only tracks the latency of successful requests
+    """
+
+    async def post(url: str, context=None, timeout=None, json=None):
+        if status_code is None:
+            await asyncio.sleep(10)
+        return (status_code, {})
+
+    latencies = validation_module.aiobackend.LatencyTracker()
+    monkeypatch.setattr(validation_module.aiobackend, "post", post)
+    monkeypatch.setitem(validation_module.latencies, "payment", latencies)
+    monkeypatch.setitem(validation_module.BACKEND_TIMEOUTS, "payment", 0.05)
+    monkeypatch.setitem(validation_module.breakers, "payment", validation_module.CircuitBreaker("payment"))
+
+    validation_module.aiobackend.run(
+        validation_module.call_backend("payment", "mock://PAYMENT_API_URL/backend/validate", payload={})
+    )
+
+    assert len(latencies.samples) == (1 if tracked else 0)
+
+
+def test_call_backend_circuit_open(monkeypatch, validation_module, mock_backend, order):
+    """
+    Test call_backend() when a backend keeps failing
+    """
+
+    url = "mock://PRODUCTS_API_URL/backend/validate"
+    mock_backend.post(url, payload={"message": "Internal error"}, status=500)
+    breaker = validation_module.CircuitBreaker("products", failure_threshold=2)
+    monkeypatch.setitem(validation_module.breakers, "products", breaker)
+
+    for _ in range(3):
+        valid, error_msg = validation_module.aiobackend.run(validation_module.validate_products(order))
+        assert valid == False
+        assert error_msg == "Failure to contact the products service"
+
+    # The third call failed fast
+    assert len(mock_backend.requests) == 2
+    assert breaker.state == "OPEN"
+
+
+def test_validate(monkeypatch, validation_module, order):
     """
     Test validate()
     """
 
-    def validate_true(order: dict) -> Tuple[bool, str]:
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
         return (True, "")
 
-    monkeypatch.setattr(lambda_module, "validate_delivery", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_payment", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_products", validate_true)
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
 
-    error_msgs = asyncio.run(lambda_module.validate(order))
+    error_msgs = validation_module.aiobackend.run(validation_module.validate(order))
     assert len(error_msgs) == 0
 
 
-def test_validate_fail(monkeypatch, lambda_module, order):
+def test_validate_fail(monkeypatch, validation_module, order):
     """
     Test validate() with failures
     """
 
-    def validate_true(order: dict) -> Tuple[bool, str]:
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
+        return (False, "Something is wrong")
+
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
+
+    error_msgs = validation_module.aiobackend.run(validation_module.validate(order))
+    # validate() stops at the first failure
+    assert len(error_msgs) == 1
+
+
+def test_validate_cancel(monkeypatch, validation_module, order):
+    """
+    Test that validate() cancels pending requests after a failure
+    """
+
+    cancelled = []
+
+    async def validate_false(order: dict, context=None) -> Tuple[bool, str]:
         return (False, "Something is wrong")
 
-    monkeypatch.setattr(lambda_module, "validate_delivery", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_payment", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_products", validate_true)
+    async def validate_slow(order: dict, context=None) -> Tuple[bool, str]:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return (True, "")
+
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_slow)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_false)
+    monkeypatch.setattr(validation_module, "validate_products", validate_slow)
+
+    error_msgs = validation_module.aiobackend.run(validation_module.validate(order))
+    assert error_msgs == ["Something is wrong"]
+    assert len(cancelled) == 2
+
+
+def test_validator(validation_module, order):
+    """
+    Test that the precompiled validator returns the same errors as
+    jsonschema.validate()
+    """
+
+    invalid_orders = [
+        {k: v for k, v in order.items() if k != "address"},
+        {**order, "deliveryPrice": "free"},
+        {**order, "products": [{**order["products"][0], "price": "free"}]}
+    ]
 
-    error_msgs = asyncio.run(lambda_module.validate(order))
-    assert len(error_msgs) == 3
+    assert jsonschema.exceptions.best_match(
+        validation_module.validator.iter_errors(order)
+    ) is None
+
+    for invalid_order in invalid_orders:
+        error = jsonschema.exceptions.best_match(
+            validation_module.validator.iter_errors(invalid_order)
+        )
+        with pytest.raises(jsonschema.ValidationError) as exc_info:
+            jsonschema.validate(invalid_order, validation_module.schema)
+        assert str(error) == str(exc_info.value)
+
+
+@pytest.mark.parametrize("n_products", [1, 10, 100, 500])
+def test_validator_benchmark(validation_module, get_order, get_product, n_products):
+    """
+    Test that the precompiled validator is faster than jsonschema.validate()
+    """
+
+    order = get_order(products=[get_product() for _ in range(n_products)])
+    order = {k: order[k] for k in [
+        "userId", "products", "address", "deliveryPrice", "paymentToken"
+    ]}
+    number = max(1, 50 // n_products)
+
+    baseline = min(timeit.repeat(
+        lambda: jsonschema.validate(order, validation_module.schema),
+        number=number, repeat=3
+    ))
+    compiled = min(timeit.repeat(
+        lambda: jsonschema.exceptions.best_match(validation_module.validator.iter_errors(order)),
+        number=number, repeat=3
+    ))
+
+    assert compiled < baseline
 
 
 def test_store_order(lambda_module, order):
@@ -273,29 +595,320 @@ def test_store_order(lambda_module, order):
     table = mock_table(
         lambda_module.table, "put_item",
         ["orderId"],
-        items=order
+        expected_params={
+            "TableName": lambda_module.table.name,
+            "Item": order,
+            "ConditionExpression": "attribute_not_exists(orderId)"
+        }
+    )
+
+    retval = lambda_module.store_order(order)
+
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+    assert retval is None
+
+
+def test_store_order_exists(lambda_module, complete_order):
+    """
+    Test store_order() with an existing order
+    """
+
+    table = stub.Stubber(lambda_module.table.meta.client)
+    table.add_client_error("put_item", service_error_code="ConditionalCheckFailedException")
+    table = mock_table(
+        table, "get_item",
+        ["orderId"],
+        items=complete_order,
+        table_name=lambda_module.table.name,
+        expected_params={
+            "TableName": lambda_module.table.name,
+            "Key": {"orderId": complete_order["orderId"]},
+            "ConsistentRead": True
+        }
+    )
+
+    retval = lambda_module.store_order(complete_order)
+
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+    assert retval == complete_order
+
+
+def test_get_stored_order_missing(lambda_module, complete_order):
+    """
+    Test get_stored_order() with an order that was not stored
+    """
+
+    table = mock_table(
+        lambda_module.table, "get_item",
+        ["orderId"],
+        expected_params={
+            "TableName": lambda_module.table.name,
+            "Key": {"orderId": complete_order["orderId"]},
+            "ConsistentRead": True
+        }
+    )
+
+    retval = lambda_module.get_stored_order(complete_order["orderId"])
+
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+    assert retval is None
+
+
+def test_claim_idempotency_key(lambda_module, context):
+    """
+    Test claim_idempotency_key()
+    """
+
+    previous = {"idempotencyKey": "USER#KEY", "status": "IN_PROGRESS", "orderId": "ORDER_ID"}
+
+    table = mock_table(
+        lambda_module.idempotency_table, "put_item",
+        ["idempotencyKey"],
+        expected_params={
+            "TableName": lambda_module.idempotency_table.name,
+            "Item": stub.ANY,
+            "ConditionExpression": stub.ANY,
+            "ExpressionAttributeNames": stub.ANY,
+            "ExpressionAttributeValues": stub.ANY,
+            "ReturnValues": "ALL_OLD"
+        },
+        response={"Attributes": {k: {"S": v} for k, v in previous.items()}}
+    )
+
+    claimed, record = lambda_module.claim_idempotency_key("USER#KEY", "NEW_ORDER_ID", context)
+
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+    assert claimed == True
+    assert record == previous
+
+
+def test_claim_idempotency_key_taken(lambda_module, context):
+    """
+    Test claim_idempotency_key() with a key used by another request
+    """
+
+    current = {"idempotencyKey": "USER#KEY", "status": "IN_PROGRESS", "orderId": "ORDER_ID"}
+
+    table = stub.Stubber(lambda_module.idempotency_table.meta.client)
+    table.add_client_error("put_item", service_error_code="ConditionalCheckFailedException")
+    table = mock_table(
+        table, "get_item",
+        ["idempotencyKey"],
+        items=current,
+        table_name=lambda_module.idempotency_table.name,
+        expected_params={
+            "TableName": lambda_module.idempotency_table.name,
+            "Key": {"idempotencyKey": "USER#KEY"},
+            "ConsistentRead": True
+        }
     )
 
-    lambda_module.store_order(order)
+    claimed, record = lambda_module.claim_idempotency_key("USER#KEY", "NEW_ORDER_ID", context)
 
     table.assert_no_pending_responses()
     table.deactivate()
 
+    assert claimed == False
+    assert record == current
+
+
+@pytest.fixture
+def idempotency_records(monkeypatch, lambda_module):
+    """
+    Replace the idempotency table with a dict
+    """
+
+    records = {}
+
+    def get_idempotency_record(key: str):
+        return copy.deepcopy(records.get(key))
+
+    def claim_idempotency_key(key: str, order_id: str, context=None):
+        record = records.get(key)
+        if record is not None and record["status"] == "COMPLETED":
+            return (False, copy.deepcopy(record))
+        records[key] = {"idempotencyKey": key, "status": "IN_PROGRESS", "orderId": order_id}
+        return (True, record)
+
+    def complete_idempotency_key(key: str, order_id: str, response: dict):
+        records[key] = {
+            "idempotencyKey": key,
+            "status": "COMPLETED",
+            "orderId": order_id,
+            "expiration": time.time() + 3600,
+            "response": json.dumps(response)
+        }
+
+    def release_idempotency_key(key: str):
+        del records[key]
+
+    monkeypatch.setattr(lambda_module, "get_idempotency_record", get_idempotency_record)
+    monkeypatch.setattr(lambda_module, "claim_idempotency_key", claim_idempotency_key)
+    monkeypatch.setattr(lambda_module, "complete_idempotency_key", complete_idempotency_key)
+    monkeypatch.setattr(lambda_module, "release_idempotency_key", release_idempotency_key)
+
+    return records
+
+
+def test_handler_idempotency(monkeypatch, lambda_module, validation_module, context, order, idempotency_records):
+    """
+    Test handler() with a retried request
+    """
+
+    calls = []
+
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
+        calls.append("validate")
+        return (True, "")
+
+    def store_order(order: dict) -> None:
+        calls.append("store_order")
+
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
+    monkeypatch.setattr(lambda_module, "store_order", store_order)
+
+    user_id = order["userId"]
+    del order["userId"]
+    event = {"order": order, "userId": user_id, "idempotencyKey": "KEY"}
+
+    response = lambda_module.handler(copy.deepcopy(event), context)
+    assert response["success"] == True
+    assert calls.count("store_order") == 1
+    assert idempotency_records[user_id+"#KEY"]["status"] == "COMPLETED"
+
+    calls.clear()
+    retry = lambda_module.handler(copy.deepcopy(event), context)
+    assert retry == response
+    assert calls == []
+
+    # Different users do not share idempotency keys
+    event["userId"] = "OTHER_USER"
+    other = lambda_module.handler(copy.deepcopy(event), context)
+    assert other["order"]["orderId"] != response["order"]["orderId"]
+
+
+def test_handler_idempotency_resume(monkeypatch, lambda_module, validation_module, context, order, idempotency_records):
+    """
+    Test handler() resuming a request that stopped before completing
+    """
+
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
+        return (True, "")
+
+    def store_order(order: dict) -> None:
+        pass
+
+    def get_stored_order(order_id: str) -> None:
+        # The previous request did not store the order
+        return None
+
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
+    monkeypatch.setattr(lambda_module, "store_order", store_order)
+    monkeypatch.setattr(lambda_module, "get_stored_order", get_stored_order)
+
+    user_id = order["userId"]
+    del order["userId"]
+    idempotency_records[user_id+"#KEY"] = {
+        "idempotencyKey": user_id+"#KEY",
+        "status": "IN_PROGRESS",
+        "orderId": "ORDER_ID"
+    }
+
+    response = lambda_module.handler({"order": order, "userId": user_id, "idempotencyKey": "KEY"}, context)
+
+    assert response["success"] == True
+    assert response["order"]["orderId"] == "ORDER_ID"
+    assert idempotency_records[user_id+"#KEY"]["status"] == "COMPLETED"
+
+
+def test_handler_idempotency_resume_stored(monkeypatch, lambda_module, validation_module, context, order, complete_order, idempotency_records):
+    """
+    Test handler() resuming a request that stored the order before stopping
+    """
+
+    calls = []
+
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
+        calls.append("validate")
+        return (True, "")
+
+    def store_order(order: dict) -> None:
+        calls.append("store_order")
+
+    def get_stored_order(order_id: str) -> dict:
+        calls.append("get_stored_order")
+        return copy.deepcopy(complete_order) if order_id == complete_order["orderId"] else None
+
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
+    monkeypatch.setattr(lambda_module, "store_order", store_order)
+    monkeypatch.setattr(lambda_module, "get_stored_order", get_stored_order)
+
+    user_id = order["userId"]
+    del order["userId"]
+    idempotency_records[user_id+"#KEY"] = {
+        "idempotencyKey": user_id+"#KEY",
+        "status": "IN_PROGRESS",
+        "orderId": complete_order["orderId"]
+    }
+
+    response = lambda_module.handler({"order": order, "userId": user_id, "idempotencyKey": "KEY"}, context)
+
+    assert response["success"] == True
+    assert response["order"] == complete_order
+    assert calls == ["get_stored_order"]
+    assert idempotency_records[user_id+"#KEY"]["status"] == "COMPLETED"
+    assert json.loads(idempotency_records[user_id+"#KEY"]["response"]) == response
+
+
+def test_handler_idempotency_validation_failure(monkeypatch, lambda_module, validation_module, context, order, idempotency_records):
+    """
+    Test that handler() releases the idempotency key on validation errors
+    """
+
+    async def validate_false(order: dict, context=None) -> Tuple[bool, str]:
+        return (False, "Something went wrong")
+
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_false)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_false)
+    monkeypatch.setattr(validation_module, "validate_products", validate_false)
+
+    user_id = order["userId"]
+    del order["userId"]
+
+    response = lambda_module.handler({"order": order, "userId": user_id, "idempotencyKey": "KEY"}, context)
+
+    assert response["success"] == False
+    assert len(idempotency_records) == 0
 
-def test_handler(monkeypatch, lambda_module, context, order):
+
+def test_handler(monkeypatch, lambda_module, validation_module, context, order):
     """
     Test handler()
     """
 
-    def validate_true(order: dict) -> Tuple[bool, str]:
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
         return (True, "")
 
     def store_order(order: dict) -> None:
         pass
 
-    monkeypatch.setattr(lambda_module, "validate_delivery", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_payment", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_products", validate_true)
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
     monkeypatch.setattr(lambda_module, "store_order", store_order)
 
     user_id = order["userId"]
@@ -314,20 +927,20 @@ def test_handler(monkeypatch, lambda_module, context, order):
     compare_dict(order, response["order"])
 
 
-def test_handler_wrong_event(monkeypatch, lambda_module, context, order):
+def test_handler_wrong_event(monkeypatch, lambda_module, validation_module, context, order):
     """
     Test handler() with an incorrect event
     """
 
-    def validate_true(order: dict) -> Tuple[bool, str]:
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
         return (True, "")
 
     def store_order(order: dict) -> None:
         pass
 
-    monkeypatch.setattr(lambda_module, "validate_delivery", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_payment", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_products", validate_true)
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
     monkeypatch.setattr(lambda_module, "store_order", store_order)
 
     response = lambda_module.handler({
@@ -339,20 +952,20 @@ def test_handler_wrong_event(monkeypatch, lambda_module, context, order):
     assert len(response.get("errors", [])) > 0
 
 
-def test_handler_wrong_order(monkeypatch, lambda_module, context, order):
+def test_handler_wrong_order(monkeypatch, lambda_module, validation_module, context, order):
     """
     Test handler() with an incorrect order
     """
 
-    def validate_true(order: dict) -> Tuple[bool, str]:
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
         return (True, "")
 
     def store_order(order: dict) -> None:
         pass
 
-    monkeypatch.setattr(lambda_module, "validate_delivery", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_payment", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_products", validate_true)
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
     monkeypatch.setattr(lambda_module, "store_order", store_order)
 
     user_id = order["userId"]
@@ -370,20 +983,20 @@ def test_handler_wrong_order(monkeypatch, lambda_module, context, order):
     assert len(response.get("errors", [])) > 0
 
 
-def test_handler_validation_failure(monkeypatch, lambda_module, context, order):
+def test_handler_validation_failure(monkeypatch, lambda_module, validation_module, context, order):
     """
     Test handler() with failing validation
     """
 
-    def validate_true(order: dict) -> Tuple[bool, str]:
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
         return (False, "Something went wrong")
 
     def store_order(order: dict) -> None:
         pass
 
-    monkeypatch.setattr(lambda_module, "validate_delivery", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_payment", validate_true)
-    monkeypatch.setattr(lambda_module, "validate_products", validate_true)
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
     monkeypatch.setattr(lambda_module, "store_order", store_order)
 
     user_id = order["userId"]
@@ -397,4 +1010,442 @@ def test_handler_validation_failure(monkeypatch, lambda_module, context, order):
 
     print(response)
     assert response["success"] == False
-    assert len(response.get("errors", [])) > 0
\ No newline at end of file
+    assert len(response.get("errors", [])) > 0
+
+def test_sign_quote(monkeypatch, quote_module, complete_order):
+    """
+    Test sign_quote() and verify_quote()
+    """
+
+    monkeypatch.setattr(quote_module, "quote_key", b"secret")
+
+    quote_id = quote_module.sign_quote(complete_order, int(time.time()) + 60)
+    order, error_msg = quote_module.verify_quote(quote_id, complete_order["userId"])
+
+    assert error_msg == ""
+    compare_dict(complete_order, order)
+
+
+def test_verify_quote_invalid(monkeypatch, quote_module, complete_order):
+    """
+    Test verify_quote() with tampered or foreign quotes
+    """
+
+    monkeypatch.setattr(quote_module, "quote_key", b"secret")
+
+    quote_id = quote_module.sign_quote(complete_order, int(time.time()) + 60)
+
+    # Wrong user
+    order, error_msg = quote_module.verify_quote(quote_id, "wrong-user-id")
+    assert order is None
+    assert error_msg == "Invalid quote"
+
+    # Tampered payload
+    tampered = copy.deepcopy(complete_order)
+    tampered["total"] = 1
+    payload = quote_module.sign_quote(tampered, int(time.time()) + 60).split(".")[0]
+    order, error_msg = quote_module.verify_quote(
+        payload + "." + quote_id.split(".")[1], complete_order["userId"]
+    )
+    assert order is None
+    assert error_msg == "Invalid quote"
+
+    # Malformed
+    order, error_msg = quote_module.verify_quote("not-a-quote", complete_order["userId"])
+    assert order is None
+    assert error_msg == "Invalid quote"
+
+    # Signed with another key
+    monkeypatch.setattr(quote_module, "quote_key", b"other-secret")
+    order, error_msg = quote_module.verify_quote(quote_id, complete_order["userId"])
+    assert order is None
+    assert error_msg == "Invalid quote"
+
+
+def test_verify_quote_expired(monkeypatch, quote_module, complete_order):
+    """
+    Test verify_quote() with an expired quote
+    """
+
+    monkeypatch.setattr(quote_module, "quote_key", b"secret")
+
+    quote_id = quote_module.sign_quote(complete_order, int(time.time()) - 1)
+    order, error_msg = quote_module.verify_quote(quote_id, complete_order["userId"])
+
+    assert order is None
+    assert error_msg == "Quote expired"
+
+
+def test_quote_handler(monkeypatch, quote_module, validation_module, context, order):
+    """
+    Test quote_handler()
+    """
+
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
+        return (True, "")
+
+    monkeypatch.setattr(quote_module, "quote_key", b"secret")
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
+
+    user_id = order["userId"]
+    order = copy.deepcopy(order)
+    del order["userId"]
+
+    response = quote_module.quote_handler({
+        "order": order,
+        "userId": user_id
+    }, context)
+
+    print(response)
+    assert response["success"] == True
+    assert response["expires"] > time.time()
+    compare_dict(order, response["order"])
+    quoted_order, _ = quote_module.verify_quote(response["quoteId"], user_id)
+    assert quoted_order == response["order"]
+
+
+def test_quote_handler_validation_failure(monkeypatch, quote_module, validation_module, context, order):
+    """
+    Test quote_handler() with failing validation
+    """
+
+    async def validate_false(order: dict, context=None) -> Tuple[bool, str]:
+        return (False, "Something went wrong")
+
+    monkeypatch.setattr(quote_module, "quote_key", b"secret")
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_false)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_false)
+    monkeypatch.setattr(validation_module, "validate_products", validate_false)
+
+    user_id = order["userId"]
+    order = copy.deepcopy(order)
+    del order["userId"]
+
+    response = quote_module.quote_handler({
+        "order": order,
+        "userId": user_id
+    }, context)
+
+    print(response)
+    assert response["success"] == False
+    assert "quoteId" not in response
+
+
+def test_handler_quote(monkeypatch, lambda_module, quote_module, validation_module, context, complete_order):
+    """
+    Test handler() with a quote
+    """
+
+    validations = []
+    stored = []
+
+    async def validate_true(order: dict, context=None) -> Tuple[bool, str]:
+        validations.append(order)
+        return (True, "")
+
+    def store_order(order: dict) -> None:
+        stored.append(order)
+
+    monkeypatch.setattr(quote_module, "quote_key", b"secret")
+    monkeypatch.setattr(validation_module, "validate_delivery", validate_true)
+    monkeypatch.setattr(validation_module, "validate_payment", validate_true)
+    monkeypatch.setattr(validation_module, "validate_products", validate_true)
+    monkeypatch.setattr(lambda_module, "store_order", store_order)
+
+    quote_id = quote_module.sign_quote(complete_order, int(time.time()) + 60)
+
+    response = lambda_module.handler({
+        "quoteId": quote_id,
+        "userId": complete_order["userId"]
+    }, context)
+
+    print(response)
+    assert response["success"] == True
+    assert len(validations) == 0
+    assert len(stored) == 1
+    assert stored[0]["orderId"] == complete_order["orderId"]
+    assert stored[0]["total"] == complete_order["total"]
+
+
+def test_handler_quote_invalid(monkeypatch, lambda_module, quote_module, context, complete_order):
+    """
+    Test handler() with a quote for another user
+    """
+
+    def store_order(order: dict) -> None:
+        raise AssertionError("Invalid quotes must not be stored")
+
+    monkeypatch.setattr(quote_module, "quote_key", b"secret")
+    monkeypatch.setattr(lambda_module, "store_order", store_order)
+
+    quote_id = quote_module.sign_quote(complete_order, int(time.time()) + 60)
+
+    response = lambda_module.handler({
+        "quoteId": quote_id,
+        "userId": "wrong-user-id"
+    }, context)
+
+    print(response)
+    assert response["success"] == False
+    assert response["errors"] == ["Invalid quote"]
+
+
+class FakeDynamoDB:
+    """
+    Fake DynamoDB resource for batch_write_item
+    """
+
+    def __init__(self, table_name: str, unprocessed: int = 0, fail_calls: List[int] = None):
+        self.table_name = table_name
+        self.unprocessed = unprocessed
+        self.fail_calls = fail_calls or []
+        self.items = []
+        self.calls = 0
+
+    def batch_write_item(self, RequestItems):
+        self.calls += 1
+        if self.calls in self.fail_calls:
+            raise ClientError({"Error": {"Code": "InternalServerError", "Message": "Internal error"}}, "BatchWriteItem")
+        requests = RequestItems[self.table_name]
+        assert len(requests) <= 25
+        # Leave the last items unprocessed
+        n_unprocessed = min(self.unprocessed, len(requests))
+        self.unprocessed -= n_unprocessed
+        processed = requests[:len(requests)-n_unprocessed]
+        self.items.extend([r["PutRequest"]["Item"] for r in processed])
+        unprocessed = requests[len(requests)-n_unprocessed:]
+        return {"UnprocessedItems": {self.table_name: unprocessed} if unprocessed else {}}
+
+
+@pytest.fixture
+def batch_orders(get_order, get_product):
+    """
+    Orders for batch creation, sharing a small set of products
+    """
+
+    def _batch_orders(n_orders: int, n_products: int = 5) -> List[dict]:
+        products = [get_product() for _ in range(n_products)]
+        orders = []
+        for i in range(n_orders):
+            order = get_order(products=[products[i % n_products], products[(i+1) % n_products]])
+            order = {k: order[k] for k in ["products", "address", "deliveryPrice", "paymentToken"]}
+            order["deliveryPrice"] = delivery_pricing.get_pricing(order["products"], order["address"])
+            orders.append(order)
+        return orders
+
+    return _batch_orders
+
+
+def test_store_orders(monkeypatch, batch_module, complete_order):
+    """
+    Test store_orders()
+    """
+
+    fake_dynamodb = FakeDynamoDB(batch_module.TABLE_NAME, unprocessed=3)
+    monkeypatch.setattr(batch_module, "dynamodb", fake_dynamodb)
+    orders = [dict(complete_order, orderId=str(i)) for i in range(30)]
+
+    failed = batch_module.store_orders(orders)
+
+    assert failed == []
+    assert fake_dynamodb.calls == 3
+    assert sorted(o["orderId"] for o in fake_dynamodb.items) == sorted(o["orderId"] for o in orders)
+
+
+def test_store_orders_failed(monkeypatch, batch_module, complete_order):
+    """
+    Test store_orders() with items that stay unprocessed
+    """
+
+    fake_dynamodb = FakeDynamoDB(batch_module.TABLE_NAME, unprocessed=1000)
+    monkeypatch.setattr(batch_module, "dynamodb", fake_dynamodb)
+    monkeypatch.setattr(batch_module.time, "sleep", lambda _: None)
+    orders = [dict(complete_order, orderId=str(i)) for i in range(2)]
+
+    failed = batch_module.store_orders(orders)
+
+    assert sorted(failed) == ["0", "1"]
+    assert fake_dynamodb.calls == batch_module.BATCH_WRITE_ATTEMPTS
+
+
+def test_store_orders_error(monkeypatch, batch_module, complete_order):
+    """
+    Test store_orders() with a request that fails
+    """
+
+    fake_dynamodb = FakeDynamoDB(batch_module.TABLE_NAME, fail_calls=[2])
+    monkeypatch.setattr(batch_module, "dynamodb", fake_dynamodb)
+    orders = [dict(complete_order, orderId=str(i)) for i in range(60)]
+
+    failed = batch_module.store_orders(orders)
+
+    # Only the orders of the second request failed
+    assert sorted(failed, key=int) == [str(i) for i in range(25, 50)]
+    assert sorted(o["orderId"] for o in fake_dynamodb.items) == sorted(
+        [str(i) for i in range(25)] + [str(i) for i in range(50, 60)]
+    )
+
+
+def test_product_messages(batch_module):
+    """
+    Test product_messages()
+    """
+
+    body = {
+        "message": "Product 'A' not found. Invalid value for 'price': want '100', got '50' in product 'B'",
+        "products": [{"productId": "A"}, {"productId": "B"}]
+    }
+
+    assert batch_module.product_messages(body) == {
+        "A": "Product 'A' not found",
+        "B": "Invalid value for 'price': want '100', got '50' in product 'B'"
+    }
+
+    # Reasons that cannot be matched with products
+    body["message"] = "Something is wrong"
+    assert batch_module.product_messages(body) == {
+        "A": "Something is wrong",
+        "B": "Something is wrong"
+    }
+
+
+def test_validate_batch(batch_module, validation_module, mock_backend, batch_orders):
+    """
+    Test validate_batch()
+    """
+
+    orders = [validation_module.inject_order_fields(dict(o, userId="USER")) for o in batch_orders(20)]
+    invalid_product = orders[0]["products"][0]
+    orders[1]["deliveryPrice"] += 100
+
+    validation_module.rate_table_version.set("version", validation_module.delivery_pricing.RATE_TABLE_VERSION)
+    mock_backend.post("mock://PAYMENT_API_URL/backend/validate", payload={"ok": True})
+    mock_backend.post("mock://PRODUCTS_API_URL/backend/validate", payload={
+        "message": "Something is wrong",
+        "products": [invalid_product]
+    })
+
+    error_msgs = validation_module.aiobackend.run(batch_module.validate_batch(orders))
+
+    assert len(error_msgs) == len(orders)
+    for order, order_errors in zip(orders, error_msgs):
+        expected = []
+        if order is orders[1]:
+            expected.append("Wrong delivery price: got {}, expected {}".format(
+                order["deliveryPrice"], order["deliveryPrice"]-100
+            ))
+        if invalid_product["productId"] in [p["productId"] for p in order["products"]]:
+            expected.append("Something is wrong")
+        assert order_errors == expected
+
+    # Products are only sent once to the products service
+    products_requests = [r for r in mock_backend.requests if r["url"].startswith("mock://PRODUCTS_API_URL")]
+    assert len(products_requests) == 1
+    assert len(products_requests[0]["json"]["products"]) == 5
+    payment_requests = [r for r in mock_backend.requests if r["url"].startswith("mock://PAYMENT_API_URL")]
+    assert len(payment_requests) == len(orders)
+
+
+def test_validate_deliveries_remote(batch_module, validation_module, mock_backend, batch_orders):
+    """
+    Test validate_deliveries() with a stale rate table
+    """
+
+    orders = batch_orders(20)
+    mock_backend.post("mock://DELIVERY_API_URL/backend/pricing", payload={
+        "pricing": orders[0]["deliveryPrice"],
+        "version": "STALE"
+    })
+
+    results = validation_module.aiobackend.run(batch_module.validate_deliveries(orders))
+
+    assert len(results) == len(orders)
+    # One request per distinct set of packages and country
+    distinct = {
+        (o["address"]["country"], tuple(sorted(p["productId"] for p in o["products"])))
+        for o in orders
+    }
+    assert len(mock_backend.requests) == len(distinct)
+
+
+def test_batch_handler(monkeypatch, batch_module, validation_module, context, mock_backend, batch_orders):
+    """
+    Test batch_handler()
+    """
+
+    fake_dynamodb = FakeDynamoDB(batch_module.TABLE_NAME)
+    monkeypatch.setattr(batch_module, "dynamodb", fake_dynamodb)
+    validation_module.rate_table_version.set("version", validation_module.delivery_pricing.RATE_TABLE_VERSION)
+    mock_backend.post("mock://PAYMENT_API_URL/backend/validate", payload={"ok": True})
+    mock_backend.post("mock://PRODUCTS_API_URL/backend/validate", payload={"message": "All products are valid"})
+
+    orders = batch_orders(10)
+    del orders[3]["paymentToken"]
+
+    response = batch_module.batch_handler({"orders": orders, "userId": "USER"}, context)
+
+    assert response["success"] == False
+    assert len(response["results"]) == 10
+    assert response["results"][3]["success"] == False
+    assert response["results"][3]["message"] == "JSON Schema validation error"
+    for i, result in enumerate(response["results"]):
+        if i != 3:
+            assert result["success"] == True
+            assert result["order"]["userId"] == "USER"
+    assert len(fake_dynamodb.items) == 9
+
+
+def test_batch_handler_wrong_event(batch_module, context, batch_orders):
+    """
+    Test batch_handler() with incorrect events
+    """
+
+    response = batch_module.batch_handler({"userId": "USER"}, context)
+    assert response["success"] == False
+    assert response["errors"] == ["Missing orders in event"]
+
+    response = batch_module.batch_handler({"orders": batch_orders(2)}, context)
+    assert response["success"] == False
+    assert response["errors"] == ["Missing userId in event"]
+
+
+@pytest.mark.parametrize("n_orders", [100, 1000])
+def test_batch_handler_benchmark(monkeypatch, lambda_module, batch_module, validation_module, context, mock_backend, batch_orders, n_orders):
+    """
+    Benchmark batch order creation with stubbed backends
+    """
+
+    async def request(method: str, url: str, context=None, timeout=None, json=None, **kwargs):
+        # Simulate the network latency of the backends
+        await asyncio.sleep(0.005)
+        return mock_backend.responses[(method, url)]
+
+    fake_dynamodb = FakeDynamoDB(batch_module.TABLE_NAME)
+    monkeypatch.setattr(batch_module, "dynamodb", fake_dynamodb)
+    monkeypatch.setattr(validation_module.aiobackend, "request", request)
+    mock_backend.post("mock://PAYMENT_API_URL/backend/validate", payload={"ok": True})
+    mock_backend.post("mock://PRODUCTS_API_URL/backend/validate", payload={"message": "All products are valid"})
+    validation_module.rate_table_version.set("version", validation_module.delivery_pricing.RATE_TABLE_VERSION)
+
+    orders = batch_orders(n_orders, n_products=50)
+
+    start = time.perf_counter()
+    response = batch_module.batch_handler({"orders": copy.deepcopy(orders), "userId": "USER"}, context)
+    duration = time.perf_counter() - start
+    assert response["success"] == True
+
+    # Baseline: one order per invocation
+    monkeypatch.setattr(lambda_module, "store_order", lambda order: None)
+    validation_module.product_cache.clear()
+    n_single = min(n_orders, 100)
+    start = time.perf_counter()
+    for order in copy.deepcopy(orders[:n_single]):
+        assert lambda_module.handler({"order": order, "userId": "USER"}, context)["success"] == True
+    single_duration = time.perf_counter() - start
+
+    print("{} orders: {:.0f} orders/s in batch, {:.0f} orders/s one by one".format(
+        n_orders, n_orders/duration, n_single/single_duration
+    ))
+    assert n_orders/duration > n_single/single_duration
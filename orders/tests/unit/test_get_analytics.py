@@ -0,0 +1,128 @@
+import json
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+from botocore import stub
+from fixtures import apigateway_event, context, lambda_module # pylint: disable=import-error
+
+
+lambda_module = pytest.fixture(scope="module", params=[{
+    "function_dir": "get_analytics",
+    "module_name": "main",
+    "environ": {
+        "ENVIRONMENT": "test",
+        "ANALYTICS_TABLE_NAME": "ANALYTICS_TABLE_NAME",
+        "POWERTOOLS_TRACE_DISABLED": "true"
+    }
+}])(lambda_module)
+context = pytest.fixture(context)
+
+
+def get_item(view: str, bucket: str, orders: int, revenue: int) -> dict:
+    """
+    Returns a serialized counter
+    """
+
+    return {
+        "view": {"S": view},
+        "bucket": {"S": bucket},
+        "orders": {"N": str(orders)},
+        "revenue": {"N": str(revenue)}
+    }
+
+
+def test_get_counters(lambda_module):
+    """
+    Test get_counters() with pagination
+    """
+
+    table = stub.Stubber(lambda_module.table.meta.client)
+    table.add_response("query", {
+        "Items": [get_item("total", "2020-01-23T10", 2, 2400)],
+        "LastEvaluatedKey": {"view": {"S": "total"}, "bucket": {"S": "2020-01-23T10"}}
+    }, {
+        "TableName": "ANALYTICS_TABLE_NAME",
+        "KeyConditionExpression": stub.ANY
+    })
+    table.add_response("query", {
+        "Items": [get_item("total", "2020-01-23T11", 1, 1000)]
+    }, {
+        "TableName": "ANALYTICS_TABLE_NAME",
+        "KeyConditionExpression": stub.ANY,
+        "ExclusiveStartKey": {"view": "total", "bucket": "2020-01-23T10"}
+    })
+    table.activate()
+
+    counters = lambda_module.get_counters("total", "2020-01-23", "2020-01-23")
+
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+    assert counters == [
+        {"bucket": "2020-01-23T10", "orders": 2, "revenue": 2400},
+        {"bucket": "2020-01-23T11", "orders": 1, "revenue": 1000}
+    ]
+
+
+def test_handler(monkeypatch, lambda_module, context, apigateway_event):
+    """
+    Test handler()
+    """
+
+    calls = []
+
+    def get_counters(view: str, start=None, end=None):
+        calls.append((view, start, end))
+        return [{"bucket": "2020-01-23T10", "orders": 2, "revenue": 2400}]
+
+    monkeypatch.setattr(lambda_module, "get_counters", get_counters)
+
+    response = lambda_module.handler(apigateway_event(
+        iam="USER_ARN",
+        query_params={"view": "country", "key": "SE", "from": "2020-01-23T10"}
+    ), context)
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"]) == {"counters": [
+        {"bucket": "2020-01-23T10", "orders": 2, "revenue": 2400}
+    ]}
+    assert calls == [("country#SE", "2020-01-23T10", None)]
+
+    # Range within the same day
+    response = lambda_module.handler(apigateway_event(
+        iam="USER_ARN",
+        query_params={"view": "total", "from": "2020-01-23T10", "to": "2020-01-23"}
+    ), context)
+
+    assert response["statusCode"] == 200
+    assert calls[-1] == ("total", "2020-01-23T10", "2020-01-23")
+
+
+@pytest.mark.parametrize("query_params,status_code", [
+    ({"view": "unknown"}, 400),
+    ({"view": "country"}, 400),
+    ({"view": "total", "from": "yesterday"}, 400),
+    ({"view": "total", "to": "2020-01-23T10:00"}, 400),
+    ({"view": "total", "from": "2020-01-24", "to": "2020-01-23"}, 400),
+    ({"view": "total", "from": "2021", "to": "2020-12"}, 400)
+])
+def test_handler_invalid(lambda_module, context, apigateway_event, query_params, status_code):
+    """
+    Test handler() with invalid parameters
+    """
+
+    response = lambda_module.handler(apigateway_event(
+        iam="USER_ARN",
+        query_params=query_params
+    ), context)
+
+    assert response["statusCode"] == status_code
+
+
+def test_handler_unauthorized(lambda_module, context, apigateway_event):
+    """
+    Test handler() without IAM credentials
+    """
+
+    response = lambda_module.handler(apigateway_event(), context)
+
+    assert response["statusCode"] == 401
@@ -2,10 +2,13 @@ import copy
 import datetime
 import decimal
 import json
+import threading
+import types
 import uuid
 import pytest
 from boto3.dynamodb.types import TypeSerializer
 from botocore import stub
+from botocore.exceptions import ClientError
 from fixtures import context, lambda_module # pylint: disable=import-error
 from helpers import compare_dict # pylint: disable=import-error,no-name-in-module
 
@@ -227,4 +230,575 @@ def test_handler_missing_order(lambda_module, apigateway_event, context):
     assert "body" in response
     body = json.loads(response["body"])
     assert "message" in body
-    assert isinstance(body["message"], str)
\ No newline at end of file
+    assert isinstance(body["message"], str)
+
+@pytest.fixture
+def order_cache(monkeypatch, lambda_module):
+    """
+    Enable the order cache
+    """
+
+    monkeypatch.setattr(lambda_module, "ORDER_CACHE_SIZE", 10)
+    monkeypatch.setattr(lambda_module.order_cache, "maxsize", 10)
+    monkeypatch.setattr(lambda_module.order_cache, "hits", 0)
+    monkeypatch.setattr(lambda_module.order_cache, "misses", 0)
+    lambda_module.order_cache.clear()
+    yield lambda_module.order_cache
+    lambda_module.order_cache.clear()
+
+
+def test_handler_cache(lambda_module, apigateway_event, order, context, order_cache):
+    """
+    Test handler() with the order cache
+    """
+
+    # Stub boto3
+    table = stub.Stubber(lambda_module.table.meta.client)
+    response = {
+        "Item": {k: TypeSerializer().serialize(v) for k, v in order.items()},
+        # We do not use ConsumedCapacity
+        "ConsumedCapacity": {}
+    }
+    expected_params = {
+        "TableName": lambda_module.TABLE_NAME,
+        "Key": {"orderId": order["orderId"]}
+    }
+    # Only one request to DynamoDB
+    table.add_response("get_item", response, expected_params)
+    table.activate()
+
+    # Send requests
+    responses = [lambda_module.handler(apigateway_event, context) for _ in range(3)]
+
+    # Remove stub
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+    for response in responses:
+        assert response["statusCode"] == 200
+        compare_dict(order, json.loads(response["body"]))
+    assert order_cache.misses == 1
+    assert order_cache.hits == 2
+
+
+def test_handler_cache_not_found(lambda_module, apigateway_event, order, context, order_cache):
+    """
+    Test that missing orders are not cached
+    """
+
+    # Stub boto3
+    table = stub.Stubber(lambda_module.table.meta.client)
+    expected_params = {
+        "TableName": lambda_module.TABLE_NAME,
+        "Key": {"orderId": order["orderId"]}
+    }
+    table.add_response("get_item", {"ConsumedCapacity": {}}, expected_params)
+    table.add_response("get_item", {"ConsumedCapacity": {}}, expected_params)
+    table.activate()
+
+    # Send requests
+    for _ in range(2):
+        response = lambda_module.handler(apigateway_event, context)
+        assert response["statusCode"] == 404
+
+    # Remove stub
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+    assert len(order_cache) == 0
+
+
+def test_get_order_fields(lambda_module, order):
+    """
+    Test get_order() with a list of fields
+    """
+
+    fields = ["orderId", "address"]
+
+    # Stub boto3
+    table = stub.Stubber(lambda_module.table.meta.client)
+    response = {
+        "Item": {k: TypeSerializer().serialize(order[k]) for k in fields},
+        # We do not use ConsumedCapacity
+        "ConsumedCapacity": {}
+    }
+    expected_params = {
+        "TableName": lambda_module.TABLE_NAME,
+        "Key": {"orderId": order["orderId"]},
+        "ProjectionExpression": "#f0, #f1",
+        "ExpressionAttributeNames": {"#f0": "orderId", "#f1": "address"}
+    }
+    table.add_response("get_item", response, expected_params)
+    table.activate()
+
+    # Gather orders
+    ddb_order = lambda_module.get_order(order["orderId"], fields)
+
+    # Remove stub
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+    # Check response
+    compare_dict({k: order[k] for k in fields}, ddb_order)
+
+
+def test_parse_fields(lambda_module):
+    """
+    Test parse_fields()
+    """
+
+    assert lambda_module.parse_fields(None) is None
+    assert lambda_module.parse_fields("") is None
+    assert lambda_module.parse_fields("address") == ["orderId", "address"]
+    assert lambda_module.parse_fields("status, total,status,orderId") == ["orderId", "status", "total"]
+    with pytest.raises(ValueError):
+        lambda_module.parse_fields("address.country")
+    with pytest.raises(ValueError):
+        lambda_module.parse_fields("address,")
+
+
+def test_handler_fields(lambda_module, apigateway_event, order, context):
+    """
+    Test handler() with a list of fields
+    """
+
+    apigateway_event = copy.deepcopy(apigateway_event)
+    apigateway_event["queryStringParameters"] = {"fields": "address"}
+
+    # Stub boto3
+    table = stub.Stubber(lambda_module.table.meta.client)
+    response = {
+        "Item": {k: TypeSerializer().serialize(order[k]) for k in ["orderId", "address", "userId"]},
+        # We do not use ConsumedCapacity
+        "ConsumedCapacity": {}
+    }
+    expected_params = {
+        "TableName": lambda_module.TABLE_NAME,
+        "Key": {"orderId": order["orderId"]},
+        "ProjectionExpression": "#f0, #f1, #f2",
+        "ExpressionAttributeNames": {"#f0": "orderId", "#f1": "address", "#f2": "userId"}
+    }
+    table.add_response("get_item", response, expected_params)
+    table.activate()
+
+    # Send request
+    response = lambda_module.handler(apigateway_event, context)
+
+    # Remove stub
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+    assert response["statusCode"] == 200
+    body = json.loads(response["body"])
+    assert body == {"orderId": order["orderId"], "address": order["address"]}
+
+
+def test_handler_fields_invalid(lambda_module, apigateway_event, context):
+    """
+    Test handler() with an invalid field
+    """
+
+    apigateway_event = copy.deepcopy(apigateway_event)
+    apigateway_event["queryStringParameters"] = {"fields": "address,#f0"}
+
+    response = lambda_module.handler(apigateway_event, context)
+
+    assert response["statusCode"] == 400
+    assert isinstance(json.loads(response["body"])["message"], str)
+
+
+def test_handler_fields_cache(lambda_module, apigateway_event, order, context, order_cache):
+    """
+    Test handler() with a list of fields and a cached order
+    """
+
+    apigateway_event = copy.deepcopy(apigateway_event)
+    apigateway_event["queryStringParameters"] = {"fields": "status,total"}
+    order_cache.set(order["orderId"], (order["userId"], json.dumps(order), order))
+
+    response = lambda_module.handler(apigateway_event, context)
+
+    assert response["statusCode"] == 200
+    body = json.loads(response["body"])
+    assert body == {"orderId": order["orderId"], "status": order["status"], "total": order["total"]}
+    assert order_cache.hits == 1
+
+class FakeClient:
+    """
+    Fake DynamoDB client for BatchGetItem
+
+    The first `unprocessed` keys of each request are returned as unprocessed
+    keys.
+    """
+
+    def __init__(self, table_name: str, orders: list, unprocessed: int = 0):
+        self.table_name = table_name
+        self.orders = {
+            order["orderId"]: {k: TypeSerializer().serialize(v) for k, v in order.items()}
+            for order in orders
+        }
+        self.unprocessed = unprocessed
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def batch_get_item(self, RequestItems: dict) -> dict:
+        keys = RequestItems[self.table_name]["Keys"]
+        assert len(keys) <= 100
+        with self.lock:
+            self.requests.append(keys)
+        unprocessed, keys = keys[:self.unprocessed], keys[self.unprocessed:]
+        response = {"Responses": {self.table_name: [
+            self.orders[key["orderId"]["S"]]
+            for key in keys
+            if key["orderId"]["S"] in self.orders
+        ]}}
+        if unprocessed:
+            response["UnprocessedKeys"] = {self.table_name: {"Keys": unprocessed}}
+        return response
+
+
+@pytest.fixture
+def orders(order):
+    """
+    List of orders
+    """
+
+    orders = []
+    for _ in range(250):
+        new_order = copy.deepcopy(order)
+        new_order["orderId"] = str(uuid.uuid4())
+        orders.append(new_order)
+    return orders
+
+
+@pytest.fixture
+def batch_event(apigateway_event):
+    """
+    API Gateway Lambda Proxy event for the batch endpoint
+    """
+
+    def _batch_event(body: dict) -> dict:
+        event = copy.deepcopy(apigateway_event)
+        event["resource"] = "/backend/batch"
+        event["path"] = "/backend/batch"
+        event["httpMethod"] = "POST"
+        event["pathParameters"] = None
+        event["body"] = json.dumps(body)
+        return event
+
+    return _batch_event
+
+
+def fake_dynamodb(monkeypatch, lambda_module, client: FakeClient) -> None:
+    """
+    Replace the DynamoDB resource with a fake client
+    """
+
+    monkeypatch.setattr(
+        lambda_module, "dynamodb",
+        types.SimpleNamespace(meta=types.SimpleNamespace(client=client))
+    )
+
+
+def test_get_serialized_orders(monkeypatch, lambda_module, orders):
+    """
+    Test get_serialized_orders()
+    """
+
+    client = FakeClient(lambda_module.TABLE_NAME, orders)
+    fake_dynamodb(monkeypatch, lambda_module, client)
+
+    order_ids = [o["orderId"] for o in orders] + [str(uuid.uuid4())]
+    serialized, unprocessed = lambda_module.get_serialized_orders(order_ids)
+
+    assert unprocessed == []
+    assert len(serialized) == len(orders)
+    assert len(client.requests) == 3
+    for order in orders:
+        compare_dict(order, json.loads(serialized[order["orderId"]]))
+
+
+def test_get_serialized_orders_unprocessed(monkeypatch, lambda_module, orders):
+    """
+    Test get_serialized_orders() with unprocessed keys
+    """
+
+    monkeypatch.setattr(lambda_module.time, "sleep", lambda _: None)
+    client = FakeClient(lambda_module.TABLE_NAME, orders[:10], unprocessed=2)
+    fake_dynamodb(monkeypatch, lambda_module, client)
+
+    serialized, unprocessed = lambda_module.get_serialized_orders([o["orderId"] for o in orders[:10]])
+
+    # 2 keys are unprocessed on every attempt
+    assert len(client.requests) == lambda_module.BATCH_GET_ATTEMPTS
+    assert len(serialized) == 10 - 2
+    assert unprocessed == [o["orderId"] for o in orders[:2]]
+
+
+def test_get_serialized_orders_cache(monkeypatch, lambda_module, orders, order_cache):
+    """
+    Test get_serialized_orders() with the order cache
+    """
+
+    client = FakeClient(lambda_module.TABLE_NAME, orders[:10])
+    fake_dynamodb(monkeypatch, lambda_module, client)
+    order_ids = [o["orderId"] for o in orders[:10]]
+
+    lambda_module.get_serialized_orders(order_ids[:5])
+    serialized, _ = lambda_module.get_serialized_orders(order_ids)
+
+    assert len(serialized) == 10
+    # Only the orders that were not cached are requested the second time
+    assert [k["orderId"]["S"] for k in client.requests[1]] == order_ids[5:]
+
+
+def test_batch_handler(monkeypatch, lambda_module, context, orders, batch_event):
+    """
+    Test batch_handler()
+    """
+
+    monkeypatch.setattr(lambda_module, "BATCH_PAGE_SIZE", 100)
+    client = FakeClient(lambda_module.TABLE_NAME, orders)
+    fake_dynamodb(monkeypatch, lambda_module, client)
+    order_ids = [o["orderId"] for o in orders]
+
+    retrieved = []
+    next_token = None
+    for _ in range(3):
+        body = {"orderIds": order_ids}
+        if next_token is not None:
+            body["nextToken"] = next_token
+        response = lambda_module.batch_handler(batch_event(body), context)
+        assert response["statusCode"] == 200
+        body = json.loads(response["body"])
+        assert body["unprocessedOrderIds"] == []
+        retrieved.extend(body["orders"])
+        next_token = body["nextToken"]
+
+    assert next_token is None
+    assert [o["orderId"] for o in retrieved] == order_ids
+    for order, ret_order in zip(orders, retrieved):
+        compare_dict(order, ret_order)
+
+
+@pytest.mark.parametrize("body", [
+    {},
+    {"orderIds": "not-a-list"},
+    {"orderIds": [1, 2]},
+    {"orderIds": ["a"], "nextToken": "not-a-token"}
+])
+def test_batch_handler_invalid(lambda_module, context, batch_event, body):
+    """
+    Test batch_handler() with invalid requests
+    """
+
+    response = lambda_module.batch_handler(batch_event(body), context)
+
+    assert response["statusCode"] == 400
+    assert isinstance(json.loads(response["body"])["message"], str)
+
+
+def test_batch_handler_too_many(monkeypatch, lambda_module, context, batch_event):
+    """
+    Test batch_handler() with too many order IDs
+    """
+
+    monkeypatch.setattr(lambda_module, "BATCH_MAX_ORDERS", 10)
+
+    response = lambda_module.batch_handler(batch_event({
+        "orderIds": [str(uuid.uuid4()) for _ in range(11)]
+    }), context)
+
+    assert response["statusCode"] == 400
+
+
+class FakeTable:
+    """
+    Fake DynamoDB table for queries on the user index
+    """
+
+    def __init__(self, orders: list):
+        self.orders = [
+            json.loads(json.dumps(order), parse_float=decimal.Decimal, parse_int=decimal.Decimal)
+            for order in orders
+        ]
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def query(self, **kwargs) -> dict:
+        with self.lock:
+            self.requests.append(kwargs)
+        values = kwargs["ExpressionAttributeValues"]
+        if values.get(":start", "") > values.get(":end", "~"):
+            raise ClientError({"Error": {"Code": "ValidationException"}}, "Query")
+        orders = sorted([
+            o for o in self.orders
+            if o["userId"] == values[":u"]
+            and o["createdDate"] >= values.get(":start", "")
+            and o["createdDate"] <= values.get(":end", "~")
+        ], key=lambda o: o["createdDate"], reverse=not kwargs["ScanIndexForward"])
+
+        start = 0
+        if "ExclusiveStartKey" in kwargs:
+            start = [o["orderId"] for o in orders].index(kwargs["ExclusiveStartKey"]["orderId"]) + 1
+        items = orders[start:start+kwargs["Limit"]]
+        if "ProjectionExpression" in kwargs:
+            fields = [kwargs["ExpressionAttributeNames"][f.strip()] for f in kwargs["ProjectionExpression"].split(",")]
+            items = [{k: v for k, v in item.items() if k in fields} for item in items]
+
+        res = {"Items": items}
+        if start + kwargs["Limit"] < len(orders):
+            last = orders[start+kwargs["Limit"]-1]
+            res["LastEvaluatedKey"] = {k: last[k] for k in ["orderId", "userId", "createdDate"]}
+        return res
+
+
+@pytest.fixture
+def user_orders(order):
+    """
+    Orders for a single user, one per day
+    """
+
+    orders = []
+    for i in range(25):
+        new_order = copy.deepcopy(order)
+        new_order["orderId"] = str(uuid.uuid4())
+        new_order["createdDate"] = (datetime.datetime(2020, 1, 1) + datetime.timedelta(days=i)).isoformat()
+        orders.append(new_order)
+    return orders
+
+
+@pytest.fixture
+def list_event(apigateway_event, order):
+    """
+    API Gateway Lambda Proxy event for the list endpoint
+    """
+
+    def _list_event(params: dict = None) -> dict:
+        event = copy.deepcopy(apigateway_event)
+        event["resource"] = "/backend/users/{userId}/orders"
+        event["path"] = "/backend/users/{}/orders".format(order["userId"])
+        event["pathParameters"] = {"userId": order["userId"]}
+        event["queryStringParameters"] = params
+        return event
+
+    return _list_event
+
+
+def list_all(lambda_module, context, list_event, params: dict) -> list:
+    """
+    Retrieve all pages from list_handler()
+    """
+
+    retrieved = []
+    params = dict(params)
+    while True:
+        response = lambda_module.list_handler(list_event(params), context)
+        assert response["statusCode"] == 200
+        body = json.loads(response["body"])
+        retrieved.extend(body["orders"])
+        if body["nextToken"] is None:
+            return retrieved
+        params["nextToken"] = body["nextToken"]
+
+
+def test_query_orders(monkeypatch, lambda_module, user_orders):
+    """
+    Test query_orders()
+    """
+
+    fake_table = FakeTable(user_orders)
+    monkeypatch.setattr(lambda_module, "table", fake_table)
+    user_id = user_orders[0]["userId"]
+
+    query = lambda_module.OrdersQuery(start="2020-01-10", end="2020-01-12", limit=2)
+    orders, last_key = lambda_module.query_orders(user_id, query)
+
+    assert [o["createdDate"][:10] for o in orders] == ["2020-01-12", "2020-01-11"]
+    assert last_key["orderId"] == orders[-1]["orderId"]
+    request = fake_table.requests[0]
+    assert request["IndexName"] == lambda_module.USER_INDEX_NAME
+    assert request["ScanIndexForward"] is False
+    assert request["ExpressionAttributeValues"][":end"] == "2020-01-12~"
+
+
+def test_decode_cursor(lambda_module):
+    """
+    Test encode_cursor() and decode_cursor()
+    """
+
+    key = {"orderId": "ORDER_ID", "userId": "USER_ID", "createdDate": "2020-01-01T00:00:00"}
+    cursor = lambda_module.encode_cursor(key)
+
+    assert lambda_module.decode_cursor(cursor, "USER_ID") == key
+    assert lambda_module.decode_cursor(cursor, "OTHER_USER_ID") is None
+    assert lambda_module.decode_cursor("not-a-cursor", "USER_ID") is None
+    assert lambda_module.decode_cursor(lambda_module.encode_cursor({"orderId": "ORDER_ID"}), "USER_ID") is None
+
+
+def test_list_handler(monkeypatch, lambda_module, context, user_orders, list_event):
+    """
+    Test list_handler()
+    """
+
+    fake_table = FakeTable(user_orders)
+    monkeypatch.setattr(lambda_module, "table", fake_table)
+
+    retrieved = list_all(lambda_module, context, list_event, {"limit": "10"})
+
+    assert len(fake_table.requests) == 3
+    assert [o["orderId"] for o in retrieved] == [o["orderId"] for o in reversed(user_orders)]
+    for order, ret_order in zip(reversed(user_orders), retrieved):
+        compare_dict(order, ret_order)
+
+
+def test_list_handler_filters(monkeypatch, lambda_module, context, user_orders, list_event):
+    """
+    Test list_handler() with date filters and fields
+    """
+
+    monkeypatch.setattr(lambda_module, "table", FakeTable(user_orders))
+
+    retrieved = list_all(lambda_module, context, list_event, {
+        "from": "2020-01-05", "to": "2020-01-14", "limit": "3", "fields": "createdDate"
+    })
+
+    assert [o["createdDate"][:10] for o in retrieved] == [
+        "2020-01-{:02d}".format(day) for day in range(14, 4, -1)
+    ]
+    assert all(set(o.keys()) == {"orderId", "createdDate"} for o in retrieved)
+
+
+def test_list_handler_date_prefixes(monkeypatch, lambda_module, context, user_orders, list_event):
+    """
+    Test list_handler() with a date range within the same prefix
+    """
+
+    monkeypatch.setattr(lambda_module, "table", FakeTable(user_orders))
+
+    retrieved = list_all(lambda_module, context, list_event, {"from": "2020-01-20", "to": "2020-01"})
+
+    assert [o["createdDate"][:10] for o in retrieved] == [
+        "2020-01-{:02d}".format(day) for day in range(25, 19, -1)
+    ]
+
+
+@pytest.mark.parametrize("params", [
+    {"limit": "0"},
+    {"limit": "1000"},
+    {"limit": "abc"},
+    {"from": "yesterday"},
+    {"from": "2021", "to": "2020"},
+    {"from": "2020-01-05", "to": "2020-01-04"},
+    {"fields": "a b"},
+    {"nextToken": "not-a-token"}
+])
+def test_list_handler_invalid(lambda_module, context, list_event, params):
+    """
+    Test list_handler() with invalid parameters
+    """
+
+    response = lambda_module.list_handler(list_event(params), context)
+
+    assert response["statusCode"] == 400
+    assert isinstance(json.loads(response["body"])["message"], str)
@@ -1,6 +1,6 @@
 import json
-from boto3.dynamodb.types import TypeSerializer
 from botocore import stub
+from botocore.exceptions import ClientError
 import pytest
 from fixtures import context, lambda_module, get_order, get_product # pylint: disable=import-error
 
@@ -27,24 +27,26 @@ def test_update_order(lambda_module):
     """
 
     order_id = "ORDER_ID"
-    status = "STATUS"
+    status = "FULFILLED"
 
     table = stub.Stubber(lambda_module.table.meta.client)
     expected_params = {
         "TableName": "TABLE_NAME",
         "Key": {"orderId": order_id},
         "UpdateExpression": stub.ANY,
+        "ConditionExpression": "#s IN (:s0)",
         "ExpressionAttributeNames": {
             "#s": "status"
         },
         "ExpressionAttributeValues": {
-            ":s": status
+            ":s": status,
+            ":s0": "PACKAGED"
         }
     }
     table.add_response("update_item", {}, expected_params)
     table.activate()
 
-    lambda_module.update_order(order_id, status)
+    assert lambda_module.update_order(order_id, status) == True
 
     table.assert_no_pending_responses()
     table.deactivate()
@@ -56,41 +58,60 @@ def test_update_order_products(lambda_module, order):
     """
 
     order_id = "ORDER_ID"
-    status = "STATUS"
+    status = "PACKAGED"
 
     table = stub.Stubber(lambda_module.table.meta.client)
-    # get_item stub
-    expected_params = {
-        "TableName": "TABLE_NAME",
-        "Key": {"orderId": order_id},
-        "AttributesToGet": ["products"]
-    }
-    response = {
-        "Item": {
-            k: TypeSerializer().serialize(v)
-            for k, v in order.items()
-        }
-    }
-    print(response)
-    table.add_response("get_item", response, expected_params)
-    # update_item stub
+    # update_item stub, without reading the order first
     expected_params = {
         "TableName": "TABLE_NAME",
         "Key": {"orderId": order_id},
         "UpdateExpression": stub.ANY,
+        "ConditionExpression": "#s IN (:s0)",
         "ExpressionAttributeNames": {
             "#s": "status",
             "#p": "products"
         },
         "ExpressionAttributeValues": {
             ":p": order["products"],
-            ":s": status
+            ":s": status,
+            ":s0": "NEW"
         }
     }
     table.add_response("update_item", {}, expected_params)
     table.activate()
 
-    lambda_module.update_order(order_id, status, order["products"])
+    assert lambda_module.update_order(order_id, status, order["products"]) == True
+
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+
+def test_update_order_rejected(lambda_module):
+    """
+    test update_order() with a transition that is not allowed
+    """
+
+    table = stub.Stubber(lambda_module.table.meta.client)
+    table.add_client_error("update_item", "ConditionalCheckFailedException")
+    table.activate()
+
+    assert lambda_module.update_order("ORDER_ID", "FULFILLED") == False
+
+    table.assert_no_pending_responses()
+    table.deactivate()
+
+
+def test_update_order_error(lambda_module):
+    """
+    test update_order() with another DynamoDB error
+    """
+
+    table = stub.Stubber(lambda_module.table.meta.client)
+    table.add_client_error("update_item", "ProvisionedThroughputExceededException")
+    table.activate()
+
+    with pytest.raises(ClientError):
+        lambda_module.update_order("ORDER_ID", "FULFILLED")
 
     table.assert_no_pending_responses()
     table.deactivate()
@@ -146,6 +167,7 @@ def test_handler(monkeypatch, lambda_module, context, order):
             assert status == test_case["status"]
             if test_case.get("products", False):
                 assert products is not None
+            return True
         monkeypatch.setattr(lambda_module, "update_order", update_order)
 
         event = {
@@ -154,4 +176,83 @@ def test_handler(monkeypatch, lambda_module, context, order):
             "detail-type": test_case["detail-type"],
             "detail": order
         }
-        lambda_module.handler(event, context)
\ No newline at end of file
+        lambda_module.handler(event, context)
+
+def test_update_orders(monkeypatch, lambda_module):
+    """
+    Test update_orders() with failures
+    """
+
+    calls = []
+
+    def update_order(order_id: str, status: str, products=None) -> bool:
+        calls.append(order_id)
+        # ORDER_1 fails once, ORDER_2 always fails
+        if order_id == "ORDER_2" or (order_id == "ORDER_1" and calls.count(order_id) == 1):
+            raise ValueError("Something went wrong")
+        return order_id != "ORDER_3"
+
+    monkeypatch.setattr(lambda_module, "update_order", update_order)
+    monkeypatch.setattr(lambda_module.time, "sleep", lambda _: None)
+
+    order_ids = ["ORDER_{}".format(i) for i in range(10)]
+    results, failed = lambda_module.update_orders(order_ids, "FULFILLED")
+
+    assert list(failed.keys()) == ["ORDER_2"]
+    assert len(results) == 9
+    assert results["ORDER_1"] == True
+    assert results["ORDER_3"] == False
+    # Only the failed orders are retried
+    assert calls.count("ORDER_0") == 1
+    assert calls.count("ORDER_1") == 2
+    assert calls.count("ORDER_2") == lambda_module.UPDATE_ATTEMPTS
+
+
+def test_handler_multiple_orders(monkeypatch, lambda_module, context, order):
+    """
+    Test handler() with multiple orders
+    """
+
+    metrics_data = {}
+
+    def update_order(order_id: str, status: str, products=None) -> bool:
+        assert status == "PACKAGED"
+        assert products == order["products"]
+        return order_id != "ORDER_0"
+
+    def add_metric(name: str, unit, value) -> None:
+        metrics_data[name] = value
+
+    monkeypatch.setattr(lambda_module, "update_order", update_order)
+    monkeypatch.setattr(lambda_module.metrics, "add_metric", add_metric)
+
+    lambda_module.handler({
+        "resources": ["ORDER_{}".format(i) for i in range(20)],
+        "source": "ecommerce.warehouse",
+        "detail-type": "PackageCreated",
+        "detail": order
+    }, context)
+
+    assert metrics_data == {"orderPackaged": 19, "orderUpdateRejected": 1}
+
+
+def test_handler_failure(monkeypatch, lambda_module, context, order):
+    """
+    Test handler() when an order cannot be updated
+    """
+
+    def update_order(order_id: str, status: str, products=None) -> bool:
+        if order_id == "ORDER_1":
+            raise ValueError("Something went wrong")
+        return True
+
+    monkeypatch.setattr(lambda_module, "update_order", update_order)
+    monkeypatch.setattr(lambda_module.time, "sleep", lambda _: None)
+
+    with pytest.raises(Exception, match="ORDER_1"):
+        lambda_module.handler({
+            "resources": ["ORDER_0", "ORDER_1", "ORDER_2"],
+            "source": "ecommerce.delivery",
+            "detail-type": "DeliveryCompleted",
+            "detail": order
+        }, context)
@@ -195,4 +195,156 @@ def test_handler(lambda_module, context, insert_data):
 
     # Check that events were sent
     eventbridge.assert_no_pending_responses()
-    eventbridge.deactivate()
\ No newline at end of file
+    eventbridge.deactivate()
+
+
+def get_modify_record(old_order: dict, new_order: dict) -> dict:
+    """
+    Returns a MODIFY stream record
+    """
+
+    return {
+        "awsRegion": "us-east-1",
+        "dynamodb": {
+            "Keys": {
+                "orderId": {"S": old_order["orderId"]}
+            },
+            "OldImage": {k: TypeSerializer().serialize(v) for k, v in old_order.items()},
+            "NewImage": {k: TypeSerializer().serialize(v) for k, v in new_order.items()},
+            "SequenceNumber": "1234567890123456789012345",
+            "SizeBytes": 123,
+            "StreamViewType": "NEW_AND_OLD_IMAGES"
+        },
+        "eventID": str(uuid.uuid4()),
+        "eventName": "MODIFY",
+        "eventSource": "aws:dynamodb",
+        "eventVersion": "1.0"
+    }
+
+
+@pytest.mark.parametrize("changes,skipped", [
+    ({"modifiedDate": "2020-01-01T00:00:00"}, True),
+    ({}, True),
+    ({"status": "PACKAGED"}, False),
+    ({"status": "PACKAGED", "modifiedDate": "2020-01-01T00:00:00"}, False),
+    # Not an allowed status transition
+    ({"status": "FULFILLED"}, True),
+    ({"total": 1500}, False),
+    ({"products": []}, False),
+    ({"address": {"country": "FR"}}, False),
+    # Fields that are not listed in the rules
+    ({"paymentToken": "NEW_TOKEN"}, False),
+    ({"status": "FULFILLED", "paymentToken": "NEW_TOKEN"}, False),
+])
+def test_skip_record(lambda_module, order, changes, skipped):
+    """
+    Test skip_record() with MODIFY records
+    """
+
+    new_order = copy.deepcopy(order)
+    new_order.update(changes)
+
+    assert lambda_module.skip_record(get_modify_record(order, new_order)) == skipped
+
+
+def test_skip_record_insert_remove(lambda_module, insert_data, remove_data):
+    """
+    Test skip_record() with INSERT and REMOVE records
+    """
+
+    assert lambda_module.skip_record(insert_data["record"]) == False
+    assert lambda_module.skip_record(remove_data["record"]) == False
+
+
+def test_handler_skip(lambda_module, context, order, insert_data):
+    """
+    Test the Lambda function handler with records that produce no events
+    """
+
+    new_order = copy.deepcopy(order)
+    new_order["modifiedDate"] = "2020-01-01T00:00:00"
+    packaged_order = copy.deepcopy(order)
+    packaged_order["status"] = "PACKAGED"
+
+    event = {"Records": [
+        get_modify_record(order, new_order),
+        insert_data["record"],
+        get_modify_record(order, packaged_order)
+    ]}
+
+    # Stubbing boto3
+    eventbridge = stub.Stubber(lambda_module.eventbridge)
+    expected_params = {"Entries": [stub.ANY, stub.ANY]}
+    eventbridge.add_response("put_events", {}, expected_params)
+    eventbridge.activate()
+
+    # Send request
+    lambda_module.handler(event, context)
+
+    # Check that only two events were sent
+    eventbridge.assert_no_pending_responses()
+    eventbridge.deactivate()
+
+    # No records to send
+    eventbridge.activate()
+    lambda_module.handler({"Records": [get_modify_record(order, new_order)]}, context)
+    eventbridge.assert_no_pending_responses()
+    eventbridge.deactivate()
+
+
+def test_handler_coalesce(monkeypatch, lambda_module, context, order):
+    """
+    Test the Lambda function handler with repeated modifications of an order
+    """
+
+    monkeypatch.setattr(lambda_module, "COALESCE_RECORDS", True)
+
+    packaged_order = copy.deepcopy(order)
+    packaged_order["status"] = "PACKAGED"
+    modified_order = copy.deepcopy(packaged_order)
+    modified_order["modifiedDate"] = "2020-01-01T00:00:00"
+
+    event = {"Records": [
+        get_modify_record(order, packaged_order),
+        get_modify_record(packaged_order, modified_order)
+    ]}
+
+    sent = []
+    monkeypatch.setattr(lambda_module, "send_events", sent.extend)
+
+    lambda_module.handler(event, context)
+
+    assert len(sent) == 1
+    detail = json.loads(sent[0]["Detail"])
+    assert detail["old"]["status"] == "NEW"
+    assert detail["new"]["status"] == "PACKAGED"
+    assert sorted(detail["changed"]) == ["modifiedDate", "status"]
+
+
+def test_handler_coalesce_status(monkeypatch, lambda_module, context, order):
+    """
+    Test the Lambda function handler with two status changes of an order
+    """
+
+    monkeypatch.setattr(lambda_module, "COALESCE_RECORDS", True)
+
+    packaged_order = copy.deepcopy(order)
+    packaged_order["status"] = "PACKAGED"
+    fulfilled_order = copy.deepcopy(packaged_order)
+    fulfilled_order["status"] = "FULFILLED"
+
+    event = {"Records": [
+        get_modify_record(order, packaged_order),
+        get_modify_record(packaged_order, fulfilled_order)
+    ]}
+
+    sent = []
+    monkeypatch.setattr(lambda_module, "send_events", sent.extend)
+
+    lambda_module.handler(event, context)
+
+    assert len(sent) == 2
+    details = [json.loads(e["Detail"]) for e in sent]
+    assert [(d["old"]["status"], d["new"]["status"]) for d in details] == [
+        ("NEW", "PACKAGED"), ("PACKAGED", "FULFILLED")
+    ]
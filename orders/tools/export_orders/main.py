@@ -0,0 +1,344 @@
+"""
+Export the orders table to columnar files
+
+This is meant to be run from an operator machine, for offline analytics:
+
+    python3 main.py --table TABLE_NAME --output ./export
+
+The table is read with a parallel segmented scan, and orders are written in
+Parquet (default) or Arrow IPC files. Products are flattened in a separate
+'products' dataset with one row per product, linked to the 'orders' dataset by
+orderId. Payment tokens and personal address fields are not exported.
+
+Each segment writes a new part file every --rows-per-file orders, so memory
+usage is bounded by the number of segments and the size of a part. After each
+part, the position of the segment in the scan is saved in 'checkpoint.json'
+in the output folder. Running the same command again resumes the export from
+the checkpoint.
+
+Use --endpoint-url to export from a local DynamoDB instance.
+"""
+
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+from typing import Iterator, List, Optional, Tuple
+import boto3
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+from ecom.dynamodb import deserialize_image # pylint: disable=import-error
+
+
+__all__ = [
+    "ORDER_SCHEMA", "PRODUCT_SCHEMA", "Checkpoint", "export", "flatten_order",
+    "scan_segment", "write_part"
+]
+
+
+CHECKPOINT_FILE = "checkpoint.json"
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+ORDER_SCHEMA = pyarrow.schema([
+    ("orderId", pyarrow.string()),
+    ("userId", pyarrow.string()),
+    ("createdDate", pyarrow.string()),
+    ("modifiedDate", pyarrow.string()),
+    ("status", pyarrow.string()),
+    ("deliveryPrice", pyarrow.int64()),
+    ("total", pyarrow.int64()),
+    ("address_postCode", pyarrow.string()),
+    ("address_city", pyarrow.string()),
+    ("address_state", pyarrow.string()),
+    ("address_country", pyarrow.string())
+])
+
+PRODUCT_SCHEMA = pyarrow.schema([
+    ("orderId", pyarrow.string()),
+    ("productId", pyarrow.string()),
+    ("name", pyarrow.string()),
+    ("price", pyarrow.int64()),
+    ("quantity", pyarrow.int64()),
+    ("package_width", pyarrow.int64()),
+    ("package_length", pyarrow.int64()),
+    ("package_height", pyarrow.int64()),
+    ("package_weight", pyarrow.int64())
+])
+
+
+def _int(value) -> Optional[int]:
+    """
+    Returns a number as an int, or None
+    """
+
+    return int(value) if value is not None else None
+
+
+def flatten_order(order: dict) -> Tuple[dict, List[dict]]:
+    """
+    Returns the order row and the product rows for an order
+    """
+
+    address = order.get("address", {})
+    order_row = {
+        "orderId": order["orderId"],
+        "userId": order.get("userId"),
+        "createdDate": order.get("createdDate"),
+        "modifiedDate": order.get("modifiedDate"),
+        "status": order.get("status"),
+        "deliveryPrice": _int(order.get("deliveryPrice")),
+        "total": _int(order.get("total")),
+        "address_postCode": address.get("postCode"),
+        "address_city": address.get("city"),
+        "address_state": address.get("state"),
+        "address_country": address.get("country")
+    }
+
+    product_rows = []
+    for product in order.get("products", []):
+        package = product.get("package", {})
+        product_rows.append({
+            "orderId": order["orderId"],
+            "productId": product.get("productId"),
+            "name": product.get("name"),
+            "price": _int(product.get("price")),
+            "quantity": _int(product.get("quantity")),
+            "package_width": _int(package.get("width")),
+            "package_length": _int(package.get("length")),
+            "package_height": _int(package.get("height")),
+            "package_weight": _int(package.get("weight"))
+        })
+
+    return order_row, product_rows
+
+
+def scan_segment(
+        client,
+        table_name: str,
+        segment: int,
+        total_segments: int,
+        start_key: Optional[dict] = None,
+        page_size: int = 1000
+    ) -> Iterator[Tuple[List[dict], Optional[dict]]]:
+    """
+    Scan a segment of a table
+
+    This yields the items of each page, with the key to resume the scan after
+    that page, or None after the last page.
+    """
+
+    kwargs = {
+        "TableName": table_name,
+        "Segment": segment,
+        "TotalSegments": total_segments,
+        "Limit": page_size
+    }
+    if start_key is not None:
+        kwargs["ExclusiveStartKey"] = start_key
+
+    while True:
+        res = client.scan(**kwargs)
+        last_key = res.get("LastEvaluatedKey")
+        yield [deserialize_image(item, use_int=True) for item in res.get("Items", [])], last_key
+        if last_key is None:
+            return
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def write_part(rows: List[dict], schema: pyarrow.Schema, path: str, file_format: str) -> None:
+    """
+    Write rows to a file
+
+    The file is written under a temporary name first, so that a part file is
+    either complete or missing.
+    """
+
+    table = pyarrow.Table.from_pylist(rows, schema=schema)
+    tmp_path = path + ".tmp"
+
+    if file_format == "parquet":
+        pyarrow.parquet.write_table(table, tmp_path)
+    else:
+        with pyarrow.OSFile(tmp_path, "wb") as sink:
+            with pyarrow.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table)
+
+    os.replace(tmp_path, path)
+
+
+class Checkpoint:
+    """
+    Position of each segment in the scan, saved in the output folder
+    """
+
+    def __init__(self, output: str, table_name: str, total_segments: int, file_format: str):
+        self.path = os.path.join(output, CHECKPOINT_FILE)
+        self.lock = threading.Lock()
+        self.state = {
+            "table": table_name,
+            "totalSegments": total_segments,
+            "format": file_format,
+            "segments": {}
+        }
+
+        if os.path.isfile(self.path):
+            with open(self.path) as fp:
+                state = json.load(fp)
+            for key in ["table", "totalSegments", "format"]:
+                if state[key] != self.state[key]:
+                    raise ValueError("Checkpoint {} does not match: {} != {}".format(
+                        key, state[key], self.state[key]
+                    ))
+            self.state = state
+
+    def get(self, segment: int) -> dict:
+        """
+        Returns the position of a segment
+        """
+
+        with self.lock:
+            return dict(self.state["segments"].get(
+                str(segment), {"lastKey": None, "part": 0, "done": False}
+            ))
+
+    def save(self, segment: int, last_key: Optional[dict], part: int) -> None:
+        """
+        Save the position of a segment after writing a part
+        """
+
+        with self.lock:
+            self.state["segments"][str(segment)] = {
+                "lastKey": last_key,
+                "part": part,
+                "done": last_key is None
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as fp:
+                json.dump(self.state, fp)
+            os.replace(tmp_path, self.path)
+
+
+def export_segment(
+        client,
+        table_name: str,
+        segment: int,
+        total_segments: int,
+        output: str,
+        checkpoint: Checkpoint,
+        file_format: str = "parquet",
+        rows_per_file: int = 50000,
+        page_size: int = 1000
+    ) -> int:
+    """
+    Export a segment of the table
+
+    Returns the number of orders exported by this call.
+    """
+
+    position = checkpoint.get(segment)
+    if position["done"]:
+        return 0
+
+    part = position["part"]
+    count = 0
+    orders: List[dict] = []
+    products: List[dict] = []
+
+    def _flush(last_key: Optional[dict]) -> None:
+        nonlocal part, orders, products
+        name = "segment-{:04d}-part-{:06d}{}".format(segment, part, FORMATS[file_format])
+        write_part(orders, ORDER_SCHEMA, os.path.join(output, "orders", name), file_format)
+        write_part(products, PRODUCT_SCHEMA, os.path.join(output, "products", name), file_format)
+        part += 1
+        checkpoint.save(segment, last_key, part)
+        orders, products = [], []
+
+    pages = scan_segment(client, table_name, segment, total_segments, position["lastKey"], page_size)
+    for items, last_key in pages:
+        for item in items:
+            order_row, product_rows = flatten_order(item)
+            orders.append(order_row)
+            products.extend(product_rows)
+        count += len(items)
+
+        # Parts end on page boundaries, so that the checkpoint key matches
+        # the last order written.
+        if last_key is None or len(orders) >= rows_per_file:
+            _flush(last_key)
+
+    return count
+
+
+def export(
+        client,
+        table_name: str,
+        output: str,
+        total_segments: int = 8,
+        file_format: str = "parquet",
+        rows_per_file: int = 50000,
+        page_size: int = 1000
+    ) -> int:
+    """
+    Export a table with a parallel segmented scan
+
+    Returns the number of orders exported by this call.
+    """
+
+    if file_format not in FORMATS:
+        raise ValueError("Unknown format {}, must be one of {}".format(file_format, ", ".join(FORMATS)))
+
+    for folder in ["orders", "products"]:
+        os.makedirs(os.path.join(output, folder), exist_ok=True)
+    checkpoint = Checkpoint(output, table_name, total_segments, file_format)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        counts = executor.map(
+            lambda segment: export_segment(
+                client, table_name, segment, total_segments, output, checkpoint,
+                file_format, rows_per_file, page_size
+            ),
+            range(total_segments)
+        )
+        return sum(counts)
+
+
+def get_args(args: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Retrieve arguments from the commandline
+    """
+
+    parser = argparse.ArgumentParser(description="Export the orders table to columnar files")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--format", choices=list(FORMATS.keys()), default="parquet")
+    parser.add_argument("--rows-per-file", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--endpoint-url")
+
+    return parser.parse_args(args)
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    """
+    Export the orders table
+    """
+
+    args = get_args(args)
+    client = boto3.client("dynamodb", endpoint_url=args.endpoint_url)
+
+    count = export(
+        client, args.table, args.output,
+        total_segments=args.segments,
+        file_format=args.format,
+        rows_per_file=args.rows_per_file,
+        page_size=args.page_size
+    )
+    print("Exported {} orders to {}".format(count, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import copy
+import importlib.util
+import json
+import os
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+from fixtures import get_order, get_product # pylint: disable=import-error
+
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.ipc # pylint: disable=wrong-import-position
+import pyarrow.parquet # pylint: disable=wrong-import-position
+
+
+@pytest.fixture(scope="module")
+def export_module():
+    """
+    Main module of the export tool
+    """
+
+    spec = importlib.util.spec_from_file_location(
+        "export_orders",
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), "main.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeClient:
+    """
+    DynamoDB client that supports segmented scans over a list of items
+    """
+
+    def __init__(self, orders: list, fail_after: int = None):
+        self.items = [
+            {k: TypeSerializer().serialize(v) for k, v in order.items()}
+            for order in orders
+        ]
+        self.fail_after = fail_after
+        self.calls = []
+
+    def scan(self, TableName, Segment, TotalSegments, Limit, ExclusiveStartKey=None):
+        if self.fail_after is not None and len(self.calls) >= self.fail_after:
+            raise RuntimeError("Connection lost")
+        self.calls.append({"Segment": Segment, "ExclusiveStartKey": ExclusiveStartKey})
+
+        items = [
+            item for i, item in enumerate(self.items)
+            if i % TotalSegments == Segment
+        ]
+        start = 0
+        if ExclusiveStartKey is not None:
+            start = [item["orderId"] for item in items].index(ExclusiveStartKey["orderId"]) + 1
+
+        res = {"Items": items[start:start+Limit]}
+        if start + Limit < len(items):
+            res["LastEvaluatedKey"] = {"orderId": items[start+Limit-1]["orderId"]}
+        return res
+
+
+@pytest.fixture
+def orders(get_order):
+    return [get_order() for _ in range(23)]
+
+
+def read_dataset(path: str, file_format: str = "parquet"):
+    tables = []
+    for name in sorted(os.listdir(path)):
+        if file_format == "parquet":
+            tables.append(pyarrow.parquet.read_table(os.path.join(path, name)))
+        else:
+            with pyarrow.OSFile(os.path.join(path, name), "rb") as source:
+                tables.append(pyarrow.ipc.open_file(source).read_all())
+    return pyarrow.concat_tables(tables)
+
+
+def test_flatten_order(export_module, get_order):
+    """
+    Test flatten_order()
+    """
+
+    order = get_order()
+
+    order_row, product_rows = export_module.flatten_order(order)
+
+    assert order_row["orderId"] == order["orderId"]
+    assert order_row["total"] == order["total"]
+    assert order_row["address_country"] == order["address"]["country"]
+    assert "paymentToken" not in order_row
+    assert "address_streetAddress" not in order_row
+    assert set(order_row.keys()) == set(export_module.ORDER_SCHEMA.names)
+    assert len(product_rows) == len(order["products"])
+    for product, row in zip(order["products"], product_rows):
+        assert row["orderId"] == order["orderId"]
+        assert row["productId"] == product["productId"]
+        assert row["package_weight"] == product["package"]["weight"]
+        assert set(row.keys()) == set(export_module.PRODUCT_SCHEMA.names)
+
+
+def test_scan_segment(export_module, orders):
+    """
+    Test scan_segment()
+    """
+
+    client = FakeClient(orders)
+
+    pages = list(export_module.scan_segment(client, "TABLE_NAME", 1, 3, page_size=3))
+
+    assert [len(items) for items, _ in pages] == [3, 3, 2]
+    assert pages[-1][1] is None
+    assert [item["orderId"] for items, _ in pages for item in items] == \
+        [order["orderId"] for order in orders[1::3]]
+    assert isinstance(pages[0][0][0]["total"], int)
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_export(export_module, orders, tmp_path, file_format):
+    """
+    Test export()
+    """
+
+    client = FakeClient(orders)
+    output = str(tmp_path)
+
+    count = export_module.export(
+        client, "TABLE_NAME", output,
+        total_segments=4, file_format=file_format, rows_per_file=4, page_size=2
+    )
+
+    assert count == len(orders)
+    table = read_dataset(os.path.join(output, "orders"), file_format)
+    assert table.schema == export_module.ORDER_SCHEMA
+    assert sorted(table.column("orderId").to_pylist()) == sorted(o["orderId"] for o in orders)
+    products = read_dataset(os.path.join(output, "products"), file_format)
+    assert products.num_rows == sum(len(o["products"]) for o in orders)
+
+    with open(os.path.join(output, "checkpoint.json")) as fp:
+        checkpoint = json.load(fp)
+    assert all(checkpoint["segments"][str(i)]["done"] for i in range(4))
+
+    # Running the export again does not scan the table
+    client.calls = []
+    assert export_module.export(client, "TABLE_NAME", output, total_segments=4, file_format=file_format) == 0
+    assert client.calls == []
+
+
+def test_export_resume(export_module, orders, tmp_path):
+    """
+    Test resuming an export after a failure
+    """
+
+    output = str(tmp_path)
+
+    with pytest.raises(RuntimeError):
+        export_module.export(
+            FakeClient(orders, fail_after=5), "TABLE_NAME", output,
+            total_segments=2, rows_per_file=2, page_size=2
+        )
+
+    client = FakeClient(orders)
+    export_module.export(
+        client, "TABLE_NAME", output,
+        total_segments=2, rows_per_file=2, page_size=2
+    )
+
+    # The second run starts after the last part written by each segment, so
+    # it needs less than the 12 pages of a full scan.
+    assert len(client.calls) < 12
+    table = read_dataset(os.path.join(output, "orders"))
+    assert sorted(table.column("orderId").to_pylist()) == sorted(o["orderId"] for o in orders)
+
+
+def test_export_mismatch(export_module, orders, tmp_path):
+    """
+    Test resuming an export with different parameters
+    """
+
+    output = str(tmp_path)
+    export_module.export(FakeClient(orders), "TABLE_NAME", output, total_segments=2)
+
+    with pytest.raises(ValueError):
+        export_module.export(FakeClient(orders), "TABLE_NAME", output, total_segments=3)
@@ -9,11 +9,13 @@ import boto3
 from boto3.dynamodb.types import TypeDeserializer
 from aws_lambda_powertools.tracing import Tracer
 from aws_lambda_powertools.logging.logger import Logger
-from ecom.eventbridge import ddb_to_event # pylint: disable=import-error
+from ecom.eventbridge import publish_events, records_to_events # pylint: disable=import-error
 
 
 ENVIRONMENT = os.environ["ENVIRONMENT"]
 EVENT_BUS_NAME = os.environ["EVENT_BUS_NAME"]
+# Merge repeated modifications of the same item within a batch of records
+COALESCE_RECORDS = os.environ.get("COALESCE_RECORDS", "false").lower() == "true"
 
 
 eventbridge = boto3.client("events") # pylint: disable=invalid-name
@@ -29,9 +31,7 @@ def send_events(events: List[dict]):
     """
 
     logger.info("Sending %d events to EventBridge", len(events))
-    # EventBridge only supports batches of up to 10 events
-    for i in range(0, len(events), 10):
-        eventbridge.put_events(Entries=events[i:i+10])
+    publish_events(eventbridge, events, logger=logger, raise_on_failure=True)
 
 
 @logger.inject_lambda_context
@@ -51,10 +51,12 @@ def handler(event, _):
         "records": event.get("Records", [])
     })
 
-    events = [
-        ddb_to_event(record, EVENT_BUS_NAME, "ecommerce.products", "Product", "productId")
-        for record in event.get("Records", [])
-    ]
+    events = records_to_events(
+        event.get("Records", []),
+        EVENT_BUS_NAME, "ecommerce.products", "Product", "productId",
+        use_int=True,
+        coalesce=COALESCE_RECORDS
+    )
 
     logger.info("Received %d event(s)", len(events))
     logger.debug({
@@ -3,6 +3,9 @@ Lambda function helpers for AWS Serverless Ecommerce Platform
 
 To use this, add "shared/src/ecom/" in your requirements.txt for your Lambda
 function.
+
+The `aiobackend` and `backend` modules are not imported by default as they
+require additional dependencies.
 """
 
-from . import apigateway, eventbridge, helpers
\ No newline at end of file
+from . import apigateway, cache, circuitbreaker, dynamodb, eventbridge, helpers, orders, pricing
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+Asynchronous HTTP client for service-to-service calls to /backend endpoints
+
+This keeps one event loop and one aiohttp connection pool for the lifetime of
+the Lambda execution environment, so warm invocations reuse TLS connections.
+Requests are signed with the credentials of the Lambda function.
+
+This module requires the 'aiohttp' package, which is not installed by default
+with ecom. Add it in the requirements.txt for your Lambda function.
+"""
+
+
+import asyncio
+import collections
+import math
+from typing import Any, Awaitable, Callable, Coroutine, Iterable, List, Optional, Tuple
+import aiohttp
+import boto3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from .helpers import dumps, timeout_from_context
+
+
+__all__ = ["LatencyTracker", "gather", "get", "get_loop", "hedge", "post", "request", "run"]
+
+
+# Maximum number of connections kept open per host
+LIMIT_PER_HOST = 10
+# Number of latency samples kept by a LatencyTracker
+WINDOW_SIZE = 100
+# Number of latency samples needed before computing percentiles
+MIN_SAMPLES = 20
+
+
+_boto3_session = boto3.session.Session() # pylint: disable=invalid-name
+_region = _boto3_session.region_name # pylint: disable=invalid-name
+_credentials = _boto3_session.get_credentials() # pylint: disable=invalid-name
+_loop: Optional[asyncio.AbstractEventLoop] = None # pylint: disable=invalid-name
+_client: Optional[aiohttp.ClientSession] = None # pylint: disable=invalid-name
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the event loop shared across invocations
+    """
+
+    global _loop # pylint: disable=global-statement,invalid-name
+
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+
+    return _loop
+
+
+def run(coro: Coroutine) -> Any:
+    """
+    Run a coroutine in the shared event loop
+    """
+
+    return get_loop().run_until_complete(coro)
+
+
+def _get_client() -> aiohttp.ClientSession:
+    """
+    Returns the HTTP client for the running event loop
+    """
+
+    global _client # pylint: disable=global-statement,invalid-name
+
+    loop = asyncio.get_running_loop()
+    # pylint: disable=protected-access
+    if _client is None or _client.closed or _client._loop is not loop:
+        _client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=LIMIT_PER_HOST)
+        )
+
+    return _client
+
+
+def _sign(method: str, url: str, data: Optional[str], service: str) -> dict:
+    """
+    Returns the headers for a request signed with SigV4
+    """
+
+    aws_request = AWSRequest(method=method, url=url, data=data, headers={
+        "Content-Type": "application/json"
+    })
+    SigV4Auth(_credentials.get_frozen_credentials(), service, _region).add_auth(aws_request)
+
+    return dict(aws_request.headers.items())
+
+
+async def request(
+        method: str,
+        url: str,
+        context=None,
+        timeout: Optional[float] = None,
+        json: Any = None,
+        service: str = "execute-api"
+    ) -> Tuple[int, Any]:
+    """
+    Send a signed request and returns the status code and the JSON body
+
+    If a Lambda context is provided, the request timeout is bounded by the
+    remaining time of the invocation.
+    """
+
+    data = dumps(json) if json is not None else None
+
+    async with _get_client().request(
+            method, url,
+            data=data,
+            headers=_sign(method, url, data, service),
+            timeout=aiohttp.ClientTimeout(total=timeout_from_context(context, timeout))
+        ) as response:
+        try:
+            body = await response.json(content_type=None)
+        except ValueError:
+            body = None
+
+        return response.status, body
+
+
+async def get(url: str, context=None, timeout: Optional[float] = None) -> Tuple[int, Any]:
+    """
+    Send a signed GET request
+    """
+
+    return await request("GET", url, context, timeout)
+
+
+async def post(url: str, context=None, timeout: Optional[float] = None, json: Any = None) -> Tuple[int, Any]:
+    """
+    Send a signed POST request
+    """
+
+    return await request("POST", url, context, timeout, json)
+
+
+class LatencyTracker:
+    """
+    Rolling window of request latencies, in milliseconds
+    """
+
+    def __init__(self, window_size: int = WINDOW_SIZE, min_samples: int = MIN_SAMPLES):
+        self.samples = collections.deque(maxlen=window_size)
+        self.min_samples = min_samples
+
+    def add(self, latency: float) -> None:
+        """
+        Record a latency
+        """
+
+        self.samples.append(latency)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        Returns the latency at the given percentile, or None if there are not
+        enough samples yet
+        """
+
+        if len(self.samples) < self.min_samples:
+            return None
+
+        samples = sorted(self.samples)
+        index = min(len(samples) - 1, max(0, math.ceil(percentile / 100 * len(samples)) - 1))
+        return samples[index]
+
+
+async def hedge(factory: Callable[[], Awaitable], delay: Optional[float]) -> Any:
+    """
+    Await a coroutine, and start a second one if the first is still pending
+    after `delay` seconds
+
+    `factory` must return a new coroutine on every call. This returns the
+    result of the first coroutine to succeed and cancels the other one. If
+    `delay` is None, no second coroutine is started.
+    """
+
+    tasks = {asyncio.ensure_future(factory())}
+
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                tasks.add(asyncio.ensure_future(factory()))
+
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            # All coroutines failed
+            if not pending:
+                return done.pop().result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def gather(aws: Iterable[Awaitable], limit: int = LIMIT_PER_HOST) -> List[Any]:
+    """
+    Await multiple awaitables with at most `limit` running at the same time
+
+    This returns the results in the same order as `aws`.
+    """
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _run(aw: Awaitable) -> Any:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[_run(aw) for aw in aws])
@@ -3,13 +3,12 @@ API Gateway helpers for Lambda functions
 """
 
 
-import json
 from typing import Dict, Optional, Union
-from .helpers import Encoder
+from .helpers import dumps
 
 
 __all__ = [
-    "cognito_user_id", "iam_user_id", "response"
+    "cognito_user_id", "iam_user_id", "raw_response", "response"
 ]
 
 
@@ -35,20 +34,17 @@ def iam_user_id(event: dict) -> Optional[str]:
         return None
 
 
-def response(
-        msg: Union[dict, str],
+def raw_response(
+        body: str,
         status_code: int = 200,
         allow_origin: str = "*",
         allow_headers: str = "Content-Type,X-Amz-Date,Authorization,X-Api-Key,x-requested-with",
         allow_methods: str = "GET,POST,PUT,DELETE,OPTIONS"
     ) -> Dict[str, Union[int, str]]:
     """
-    Returns a response for API Gateway
+    Returns a response for API Gateway with an already serialized body
     """
 
-    if isinstance(msg, str):
-        msg = {"message": msg}
-
     return {
         "statusCode": status_code,
         "headers": {
@@ -56,5 +52,22 @@ def response(
             "Access-Control-Allow-Origin": allow_origin,
             "Access-Control-Allow-Methods": allow_methods
         },
-        "body": json.dumps(msg, cls=Encoder)
+        "body": body
     }
+
+
+def response(
+        msg: Union[dict, str],
+        status_code: int = 200,
+        allow_origin: str = "*",
+        allow_headers: str = "Content-Type,X-Amz-Date,Authorization,X-Api-Key,x-requested-with",
+        allow_methods: str = "GET,POST,PUT,DELETE,OPTIONS"
+    ) -> Dict[str, Union[int, str]]:
+    """
+    Returns a response for API Gateway
+    """
+
+    if isinstance(msg, str):
+        msg = {"message": msg}
+
+    return raw_response(dumps(msg), status_code, allow_origin, allow_headers, allow_methods)
@@ -0,0 +1,98 @@
+"""
+HTTP client for service-to-service calls to /backend endpoints
+
+This keeps one keep-alive connection pool and one IAM signature helper per
+host for the lifetime of the Lambda execution environment, so warm
+invocations reuse TLS connections and cached credentials.
+
+This module requires the 'requests' and 'aws_requests_auth' packages, which
+are not installed by default with ecom. Add them in the requirements.txt for
+your Lambda function.
+"""
+
+
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import boto3
+import requests
+from requests.adapters import HTTPAdapter
+from aws_requests_auth.boto_utils import BotoAWSRequestsAuth
+from .helpers import timeout_from_context
+
+
+__all__ = ["get", "get_session", "post", "request"]
+
+
+# Maximum number of connections kept open per host
+POOL_MAXSIZE = 10
+
+
+_region = boto3.session.Session().region_name # pylint: disable=invalid-name
+_sessions: Dict[str, requests.Session] = {} # pylint: disable=invalid-name
+_lock = threading.Lock() # pylint: disable=invalid-name
+
+
+def get_session(url: str, service: str = "execute-api") -> requests.Session:
+    """
+    Returns a signed session with a connection pool for the host of the URL
+    """
+
+    host = urlparse(url).netloc
+    key = "{}|{}".format(service, host)
+
+    session = _sessions.get(key, None)
+    if session is not None:
+        return session
+
+    with _lock:
+        if key not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.auth = BotoAWSRequestsAuth(
+                aws_host=host,
+                aws_region=_region,
+                aws_service=service
+            )
+            _sessions[key] = session
+
+    return _sessions[key]
+
+
+def request(
+        method: str,
+        url: str,
+        context=None,
+        timeout: Optional[float] = None,
+        **kwargs
+    ) -> requests.Response:
+    """
+    Send a signed request
+
+    If a Lambda context is provided, the request timeout is bounded by the
+    remaining time of the invocation.
+    """
+
+    return get_session(url).request(
+        method, url,
+        timeout=timeout_from_context(context, timeout),
+        **kwargs
+    )
+
+
+def get(url: str, context=None, timeout: Optional[float] = None, **kwargs) -> requests.Response:
+    """
+    Send a signed GET request
+    """
+
+    return request("GET", url, context, timeout, **kwargs)
+
+
+def post(url: str, context=None, timeout: Optional[float] = None, **kwargs) -> requests.Response:
+    """
+    Send a signed POST request
+    """
+
+    return request("POST", url, context, timeout, **kwargs)
@@ -0,0 +1,72 @@
+"""
+In-memory cache for Lambda functions
+
+Entries are kept for the lifetime of the execution environment, so this
+should only cache data that can be stale for up to `ttl` seconds.
+"""
+
+
+import collections
+import time
+from typing import Any, Hashable, Optional
+
+
+__all__ = ["TTLCache"]
+
+
+class TTLCache:
+    """
+    Bounded cache with least-recently-used eviction and time-based expiry
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the value for a key, or `default` if the key is missing or
+        expired
+        """
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store a value
+        """
+
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """
+        Remove a key from the cache
+        """
+
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove all entries
+        """
+
+        self._entries.clear()
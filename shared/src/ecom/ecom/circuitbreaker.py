@@ -0,0 +1,153 @@
+"""
+Circuit breaker for calls to other services
+
+The state of a circuit breaker is kept in memory, and thus per execution
+environment. It can optionally be shared through an item in a DynamoDB table,
+so that other execution environments stop calling a failing service without
+having to detect the failures themselves.
+"""
+
+
+import time
+from typing import Optional
+from botocore.exceptions import ClientError
+
+
+__all__ = ["CircuitBreaker", "CLOSED", "HALF_OPEN", "OPEN"]
+
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker
+
+    After `failure_threshold` consecutive failures, the circuit opens and
+    requests are rejected for `recovery_timeout` seconds. After that, one
+    probe request is let through: the circuit closes if it succeeds, and opens
+    again if it fails.
+
+    If `table` (a boto3 DynamoDB Table resource with an "id" partition key) is
+    set, the circuit breaker reads the shared state at most every
+    `sync_interval` seconds and writes it when the circuit opens or closes.
+    Errors from DynamoDB are ignored, as the local state is enough to protect
+    the function.
+
+    Usage:
+
+        breaker = CircuitBreaker("payment")
+
+        if not breaker.allow_request():
+            # Fail fast
+            ...
+        try:
+            response = ...
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+    """
+
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = 5,
+            recovery_timeout: float = 30,
+            table=None,
+            sync_interval: float = 5
+        ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.table = table
+        self.sync_interval = sync_interval
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._synced_at: Optional[float] = None
+
+    def allow_request(self) -> bool:
+        """
+        Returns True if a request can be sent
+        """
+
+        now = time.time()
+        self._sync(now)
+
+        if self.state == CLOSED:
+            return True
+
+        # Let one probe request through per recovery timeout
+        if now - self.opened_at >= self.recovery_timeout:
+            self.state = HALF_OPEN
+            self.opened_at = now
+            return True
+
+        return False
+
+    def record_success(self) -> None:
+        """
+        Record a successful request
+        """
+
+        self.failures = 0
+        if self.state != CLOSED:
+            self.state = CLOSED
+            self._save(None)
+
+    def record_failure(self) -> None:
+        """
+        Record a failed request
+        """
+
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.time()
+            self._save(self.opened_at + self.recovery_timeout)
+
+    def _sync(self, now: float) -> None:
+        """
+        Open the circuit if it is open in the shared state
+        """
+
+        if self.table is None or self.state != CLOSED:
+            return
+        if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+
+        try:
+            item = self.table.get_item(Key={"id": self.name}).get("Item", {})
+        except ClientError:
+            return
+
+        open_until = float(item.get("openUntil", 0))
+        if open_until > now:
+            self.state = OPEN
+            self.opened_at = open_until - self.recovery_timeout
+
+    def _save(self, open_until: Optional[float]) -> None:
+        """
+        Save the state in the shared state
+        """
+
+        if self.table is None:
+            return
+
+        try:
+            if open_until is None:
+                self.table.delete_item(Key={"id": self.name})
+            else:
+                self.table.put_item(Item={
+                    "id": self.name,
+                    "openUntil": int(open_until),
+                    # Let DynamoDB delete stale items
+                    "ttl": int(open_until + self.recovery_timeout)
+                })
+        except ClientError:
+            pass
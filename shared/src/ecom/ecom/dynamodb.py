@@ -0,0 +1,82 @@
+"""
+DynamoDB helpers for Lambda functions
+"""
+
+
+from decimal import Decimal
+from typing import Any, Callable, Dict
+from boto3.dynamodb.types import Binary
+
+
+__all__ = ["deserialize", "deserialize_image"]
+
+
+def _to_number(value: str) -> Decimal:
+    return Decimal(value)
+
+
+def _to_int_or_number(value: str) -> Any:
+    # Integral numbers are sent without a fractional part or an exponent by
+    # DynamoDB, so checking the digits is enough to know if int() is safe.
+    if value.isdigit() or (value[:1] == "-" and value[1:].isdigit()):
+        return int(value)
+    return Decimal(value)
+
+
+def _build_deserializer(to_number: Callable[[str], Any]) -> Callable[[dict], Any]:
+    """
+    Create a deserializer for the DynamoDB wire format
+
+    This uses a table keyed by the type descriptor instead of the chain of
+    method lookups done by boto3's TypeDeserializer.
+    """
+
+    def _deserialize(value: dict) -> Any:
+        try:
+            for dynamodb_type, raw in value.items():
+                return handlers[dynamodb_type](raw)
+        except (AttributeError, KeyError):
+            pass
+
+        raise TypeError("Value must be a nonempty dictionary whose key is a valid dynamodb type.")
+
+    handlers: Dict[str, Callable[[Any], Any]] = {
+        "NULL": lambda raw: None,
+        "BOOL": lambda raw: raw,
+        "N": to_number,
+        "S": lambda raw: raw,
+        "B": Binary,
+        "NS": lambda raw: set(map(to_number, raw)),
+        "SS": set,
+        "BS": lambda raw: set(map(Binary, raw)),
+        "L": lambda raw: [_deserialize(v) for v in raw],
+        "M": lambda raw: {k: _deserialize(v) for k, v in raw.items()}
+    }
+
+    return _deserialize
+
+
+_deserialize_decimal = _build_deserializer(_to_number) # pylint: disable=invalid-name
+_deserialize_int = _build_deserializer(_to_int_or_number) # pylint: disable=invalid-name
+
+
+def deserialize(value: dict, use_int: bool = False) -> Any:
+    """
+    Transforms a DynamoDB attribute value into a python object
+
+    This produces the same output as boto3's TypeDeserializer. If `use_int` is
+    True, integral numbers are returned as int instead of Decimal.
+    """
+
+    if use_int:
+        return _deserialize_int(value)
+    return _deserialize_decimal(value)
+
+
+def deserialize_image(image: dict, use_int: bool = False) -> dict:
+    """
+    Transforms a DynamoDB item (e.g. a stream record image) into a dict
+    """
+
+    _deserialize = _deserialize_int if use_int else _deserialize_decimal
+    return {k: _deserialize(v) for k, v in image.items()}
@@ -3,87 +3,438 @@ EventBridge helpers for Lambda functions
 """
 
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import json
-from boto3.dynamodb.types import TypeDeserializer
-from .helpers import Encoder
+from decimal import Decimal
+import logging
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from botocore.exceptions import ClientError
+from .dynamodb import _build_deserializer, deserialize, deserialize_image
+from .helpers import _decimal_to_number, dumps
 
 
-__all__ = ["ddb_to_event"]
-deserialize = TypeDeserializer().deserialize
+__all__ = [
+    "PublishError", "changed_keys", "coalesce_records", "ddb_to_event", "publish_events",
+    "records_to_events"
+]
+# PutEvents limits
+MAX_ENTRIES = 10
+MAX_REQUEST_SIZE = 256*1024
+# Error codes of failed entries or requests that are worth retrying
+TRANSIENT_ERRORS = {"InternalException", "InternalFailure", "ThrottlingException"}
 
 
-def ddb_to_event(
+class PublishError(Exception):
+    """
+    Some events could not be sent to EventBridge
+
+    The failed entries are in `failed`, in the same format as returned by
+    publish_events().
+    """
+
+    def __init__(self, failed: List[dict]):
+        super().__init__("Failed to send {} events to EventBridge".format(len(failed)))
+        self.failed = failed
+
+
+def changed_keys(new_image: dict, old_image: dict) -> List[str]:
+    """
+    Returns the keys that differ between two DynamoDB images
+
+    This compares the raw attribute values and only deserializes them when
+    they are not identical, as sets can be serialized in any order.
+    """
+
+    # Old keys not in NewImage
+    changed = [k for k in old_image.keys() if k not in new_image]
+    for k, v in new_image.items():
+        # New keys not in OldImage
+        if k not in old_image:
+            changed.append(k)
+        # New keys that are not equal to old values
+        elif v != old_image[k] and deserialize(v) != deserialize(old_image[k]):
+            changed.append(k)
+
+    return changed
+
+
+def _detail_deserializer() -> Callable[[dict], Any]:
+    """
+    Create a deserializer for the images sent in event details
+
+    Numbers are returned as the int or float that dumps() would encode them
+    to, so the JSON encoder does not call back for every Decimal. Conversions
+    are cached by their string value: a deserializer shared by a batch of
+    records converts each distinct number once.
+    """
+
+    numbers: Dict[str, Any] = {}
+
+    def _to_number(value: str) -> Any:
+        number = numbers.get(value)
+        if number is None:
+            number = numbers[value] = _decimal_to_number(Decimal(value))
+        return number
+
+    _deserialize = _build_deserializer(_to_number)
+    return lambda image: {k: _deserialize(v) for k, v in image.items()}
+
+
+def _ddb_to_event( # pylint: disable=too-many-arguments
         ddb_record: dict,
         event_bus_name: str,
         source: str,
         object_type: str,
-        resource_key: str
-    ) -> dict:
+        resource_key: str,
+        use_int: bool,
+        changed_only: bool,
+        skip_unchanged: bool,
+        now: datetime,
+        to_detail: Callable[[dict], Any]
+    ) -> Optional[dict]:
     """
     Transforms a DynamoDB Streams record into an EventBridge event
 
-    For this function to works, you need to have a StreamViewType of
-    NEW_AND_OLD_IMAGES.
+    See ddb_to_event(). Images are deserialized with `to_detail`.
     """
 
     event = {
-        "Time": datetime.now(),
+        "Time": now,
         "Source": source,
         "Resources": [
-            str(deserialize(ddb_record["dynamodb"]["Keys"][resource_key]))
+            str(deserialize(ddb_record["dynamodb"]["Keys"][resource_key], use_int))
         ],
         "EventBusName": event_bus_name
     }
+    event_name = ddb_record["eventName"].upper()
 
     # Created event
-    if ddb_record["eventName"].upper() == "INSERT":
+    if event_name == "INSERT":
         event["DetailType"] = "{}Created".format(object_type)
-        event["Detail"] = json.dumps({
-            k: deserialize(v)
-            for k, v
-            in ddb_record["dynamodb"]["NewImage"].items()
-        }, cls=Encoder)
+        event["Detail"] = dumps(to_detail(ddb_record["dynamodb"]["NewImage"]))
 
     # Deleted event
-    elif ddb_record["eventName"].upper() == "REMOVE":
+    elif event_name == "REMOVE":
         event["DetailType"] = "{}Deleted".format(object_type)
-        event["Detail"] = json.dumps({
-            k: deserialize(v)
-            for k, v
-            in ddb_record["dynamodb"]["OldImage"].items()
-        }, cls=Encoder)
-
-    elif ddb_record["eventName"].upper() == "MODIFY":
-        new = {
-            k: deserialize(v)
-            for k, v
-            in ddb_record["dynamodb"]["NewImage"].items()
-        }
-        old = {
-            k: deserialize(v)
-            for k, v
-            in ddb_record["dynamodb"]["OldImage"].items()
-        }
-
-        # Old keys not in NewImage
-        changed = [k for k in old.keys() if k not in new.keys()]
-        for k in new.keys():
-            # New keys not in OldImage
-            if k not in old.keys():
-                changed.append(k)
-            # New keys that are not equal to old values
-            elif new[k] != old[k]:
-                changed.append(k)
+        event["Detail"] = dumps(to_detail(ddb_record["dynamodb"]["OldImage"]))
+
+    elif event_name == "MODIFY":
+        new_image = ddb_record["dynamodb"]["NewImage"]
+        old_image = ddb_record["dynamodb"]["OldImage"]
+
+        changed = changed_keys(new_image, old_image)
+        if skip_unchanged and not changed:
+            return None
+
+        if changed_only:
+            keys = set(changed)
+            keys.add(resource_key)
+            new_image = {k: v for k, v in new_image.items() if k in keys}
+            old_image = {k: v for k, v in old_image.items() if k in keys}
 
         event["DetailType"] = "{}Modified".format(object_type)
-        event["Detail"] = json.dumps({
-            "new": new,
-            "old": old,
+        event["Detail"] = dumps({
+            "new": to_detail(new_image),
+            "old": to_detail(old_image),
             "changed": changed
-        }, cls=Encoder)
+        })
 
     else:
         raise ValueError("Wrong eventName value for DynamoDB event: {}".format(ddb_record["eventName"]))
 
-    return event
\ No newline at end of file
+    return event
+
+
+def ddb_to_event(
+        ddb_record: dict,
+        event_bus_name: str,
+        source: str,
+        object_type: str,
+        resource_key: str,
+        use_int: bool = False,
+        changed_only: bool = False,
+        skip_unchanged: bool = False,
+        now: Optional[datetime] = None
+    ) -> Optional[dict]:
+    """
+    Transforms a DynamoDB Streams record into an EventBridge event
+
+    For this function to works, you need to have a StreamViewType of
+    NEW_AND_OLD_IMAGES.
+
+    If `use_int` is True, integral numbers are deserialized as int instead of
+    Decimal, which skips the JSON encoder callback for those values.
+
+    For MODIFY records, if `changed_only` is True, the 'new' and 'old' values
+    only contain the resource key and the fields that changed. If
+    `skip_unchanged` is True, this returns None when no field changed.
+
+    If `now` is set, it is used as the event time instead of the current time.
+    """
+
+    return _ddb_to_event(
+        ddb_record, event_bus_name, source, object_type, resource_key,
+        use_int, changed_only, skip_unchanged,
+        now or datetime.now(), lambda image: deserialize_image(image, use_int)
+    )
+
+
+def coalesce_records(
+        ddb_records: Iterable[dict],
+        boundary_keys: Iterable[str] = ()
+    ) -> List[dict]:
+    """
+    Merge consecutive MODIFY records for the same key
+
+    Each run of MODIFY records for a key, with no INSERT or REMOVE record for
+    that key in between, is replaced by a single record with the OldImage of
+    the first record and the NewImage of the last one. The merged record takes
+    the place of the last record of the run. Records for the same key keep
+    their relative order, but a merged record can move after records for
+    other keys.
+
+    A run contains at most one record that changes one of the `boundary_keys`
+    attributes, so that e.g. two status changes are never merged into one.
+
+    This only compares the raw keys and values, without deserializing the
+    images.
+    """
+
+    boundary_keys = list(boundary_keys)
+    records: List[Optional[dict]] = []
+    # Index in `records` of the pending MODIFY record for each key, and
+    # whether that run changes a boundary attribute
+    pending: Dict[tuple, Tuple[int, bool]] = {}
+
+    for ddb_record in ddb_records:
+        key = tuple(sorted(
+            (name, tuple(value.items()))
+            for name, value in ddb_record["dynamodb"]["Keys"].items()
+        ))
+        index, run_boundary = pending.pop(key, (None, False))
+
+        if ddb_record["eventName"].upper() == "MODIFY":
+            new_image = ddb_record["dynamodb"]["NewImage"]
+            old_image = ddb_record["dynamodb"]["OldImage"]
+            boundary = any(new_image.get(k) != old_image.get(k) for k in boundary_keys)
+
+            if index is not None and not (boundary and run_boundary):
+                first = records[index]
+                records[index] = None
+                ddb_record = dict(ddb_record, dynamodb=dict(
+                    ddb_record["dynamodb"],
+                    OldImage=first["dynamodb"]["OldImage"]
+                ))
+                boundary = boundary or run_boundary
+            pending[key] = (len(records), boundary)
+
+        records.append(ddb_record)
+
+    return [r for r in records if r is not None]
+
+
+def records_to_events(
+        ddb_records: Iterable[dict],
+        event_bus_name: str,
+        source: str,
+        object_type: str,
+        resource_key: str,
+        use_int: bool = False,
+        changed_only: bool = False,
+        skip_unchanged: bool = False,
+        skip_record: Optional[Callable[[dict], bool]] = None,
+        coalesce: bool = False,
+        boundary_keys: Iterable[str] = ()
+    ) -> List[dict]:
+    """
+    Transforms a batch of DynamoDB Streams records into EventBridge events
+
+    All events in the batch share the same timestamp, and numbers in the
+    event details are converted once per batch. If `coalesce` is True,
+    repeated MODIFY records for the same key are merged first, see
+    coalesce_records() for `boundary_keys`. Records for which `skip_record`
+    returns True are dropped before any deserialization or JSON encoding
+    happens.
+
+    See ddb_to_event() for the other parameters.
+    """
+
+    now = datetime.now()
+    to_detail = _detail_deserializer()
+    events = []
+
+    if coalesce:
+        ddb_records = coalesce_records(ddb_records, boundary_keys)
+
+    for ddb_record in ddb_records:
+        if skip_record is not None and skip_record(ddb_record):
+            continue
+
+        event = _ddb_to_event(
+            ddb_record, event_bus_name, source, object_type, resource_key,
+            use_int, changed_only, skip_unchanged, now, to_detail
+        )
+        if event is not None:
+            events.append(event)
+
+    return events
+
+
+def entry_size(entry: dict) -> int:
+    """
+    Returns the size of a PutEvents entry
+
+    See https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-putevent-size.html
+    """
+
+    size = 0
+    if entry.get("Time") is not None:
+        size += 14
+    for key in ["Source", "DetailType", "Detail"]:
+        if entry.get(key) is not None:
+            size += len(entry[key].encode("utf-8"))
+    for resource in entry.get("Resources", []):
+        size += len(resource.encode("utf-8"))
+
+    return size
+
+
+def _pack_entries(entries: List[dict]) -> Tuple[List[List[dict]], List[dict]]:
+    """
+    Split entries into PutEvents requests by count and size
+
+    Returns the requests and the entries that are too large to be sent.
+    """
+
+    chunks = []
+    too_large = []
+    chunk = []
+    chunk_size = 0
+
+    for entry in entries:
+        size = entry_size(entry)
+        if size > MAX_REQUEST_SIZE:
+            too_large.append(entry)
+            continue
+
+        if len(chunk) >= MAX_ENTRIES or chunk_size + size > MAX_REQUEST_SIZE:
+            chunks.append(chunk)
+            chunk = []
+            chunk_size = 0
+
+        chunk.append(entry)
+        chunk_size += size
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks, too_large
+
+
+def _put_events(client, entries: List[dict]) -> List[Tuple[dict, str, str]]:
+    """
+    Send one PutEvents request and return the failed entries
+    """
+
+    try:
+        response = client.put_events(Entries=entries)
+    except ClientError as exc:
+        error = exc.response.get("Error", {})
+        return [
+            (entry, error.get("Code", "ClientError"), error.get("Message", str(exc)))
+            for entry in entries
+        ]
+
+    if response.get("FailedEntryCount", 0) == 0:
+        return []
+
+    # Response entries are in the same order as the request entries
+    return [
+        (entry, result["ErrorCode"], result.get("ErrorMessage", ""))
+        for entry, result in zip(entries, response.get("Entries", []))
+        if result.get("ErrorCode") is not None
+    ]
+
+
+def publish_events(
+        client,
+        events: List[dict],
+        max_workers: int = 10,
+        max_attempts: int = 3,
+        backoff: float = 0.1,
+        logger: Optional[logging.Logger] = None,
+        raise_on_failure: bool = False
+    ) -> dict:
+    """
+    Send events to EventBridge
+
+    Events are packed into PutEvents requests by both count and size, and the
+    requests are sent concurrently using up to `max_workers` threads. Only the
+    entries that failed with a transient error (see TRANSIENT_ERRORS) are
+    retried, with a jittered exponential backoff, for up to `max_attempts`
+    rounds. Other failures are reported without retrying.
+
+    If `logger` is set, the result is logged there. If `raise_on_failure` is
+    True, this raises a PublishError if any event could not be sent.
+
+    This returns a dict with the following keys:
+     - failed: list of failed entries, as {"Entry", "ErrorCode", "ErrorMessage"}
+     - latency: total time spent publishing, in milliseconds
+     - attempts: number of rounds of requests
+    """
+
+    start = time.perf_counter()
+    chunks, too_large = _pack_entries(events)
+    failed = [
+        (entry, "EntryTooLarge", "Entry exceeds the PutEvents size limit")
+        for entry in too_large
+    ]
+
+    attempts = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while chunks:
+            if attempts > 0:
+                time.sleep(random.uniform(0, backoff * 2**(attempts-1)))
+            attempts += 1
+
+            retries = []
+            for chunk_failed in executor.map(lambda chunk: _put_events(client, chunk), chunks):
+                for entry_failed in chunk_failed:
+                    if entry_failed[1] in TRANSIENT_ERRORS:
+                        retries.append(entry_failed)
+                    else:
+                        failed.append(entry_failed)
+
+            if attempts >= max_attempts:
+                failed.extend(retries)
+                break
+
+            chunks, _ = _pack_entries([entry for entry, _, _ in retries])
+
+    result = {
+        "failed": [
+            {"Entry": entry, "ErrorCode": error_code, "ErrorMessage": error_message}
+            for entry, error_code, error_message in failed
+        ],
+        "latency": (time.perf_counter() - start) * 1000,
+        "attempts": attempts
+    }
+
+    if logger is not None:
+        logger.info({
+            "message": "Sent {} events to EventBridge".format(len(events) - len(failed)),
+            "latency": result["latency"],
+            "attempts": attempts
+        })
+        if failed:
+            logger.error({
+                "message": "Failed to send {} events to EventBridge".format(len(failed)),
+                "failed": result["failed"]
+            })
+
+    if raise_on_failure and failed:
+        raise PublishError(result["failed"])
+
+    return result
@@ -6,9 +6,49 @@ Helpers for Lambda functions
 from datetime import datetime, date
 from decimal import Decimal
 import json
+from typing import Any, Optional, Union
 
 
-__all__ = ["Encoder"]
+__all__ = ["Encoder", "dumps", "timeout_from_context"]
+
+
+# Time kept for the Lambda function to handle a timeout, in seconds
+TIMEOUT_MARGIN = 0.5
+# Lowest timeout allowed for a request, in seconds
+MIN_TIMEOUT = 0.1
+
+
+def _decimal_to_number(o: Decimal) -> Union[float, int]:
+    numerator, denominator = o.as_integer_ratio()
+    if denominator == 1:
+        return numerator
+    return float(o)
+
+
+# Conversion functions keyed by exact type, to avoid a chain of isinstance()
+# calls for every value the JSON encoder cannot handle natively.
+_CONVERTERS = {
+    Decimal: _decimal_to_number,
+    datetime: datetime.isoformat,
+    date: date.isoformat
+}
+
+
+def _default(o: Any) -> Union[float, int, str]:
+    """
+    Convert a value that the JSON encoder cannot handle natively
+    """
+
+    converter = _CONVERTERS.get(type(o))
+    if converter is not None:
+        return converter(o)
+
+    # Subclasses of the supported types
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return _decimal_to_number(o)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(o).__name__))
 
 
 class Encoder(json.JSONEncoder):
@@ -17,10 +57,37 @@ class Encoder(json.JSONEncoder):
     """
 
     def default(self, o): # pylint: disable=method-hidden
-        if isinstance(o, datetime) or isinstance(o, date):
-            return o.isoformat()
-        if isinstance(o, Decimal):
-            if abs(o) % 1 > 0:
-                return float(o)
-            return int(o)
-        return super(Encoder, self).default(o)
\ No newline at end of file
+        return _default(o)
+
+
+# JSONEncoder instances are stateless, so one encoder is shared by all calls.
+# DynamoDB items cannot contain reference cycles, so this also skips the
+# circular reference check on every container.
+_encoder = json.JSONEncoder(default=_default, check_circular=False) # pylint: disable=invalid-name
+
+
+def dumps(o: Any) -> str:
+    """
+    Serialize an object to JSON
+
+    This returns the same output as `json.dumps(o, cls=Encoder)` with a
+    shared encoder that calls the conversion function directly.
+    """
+
+    return _encoder.encode(o)
+
+
+def timeout_from_context(context, timeout: Optional[float] = None) -> Optional[float]:
+    """
+    Returns a timeout in seconds bounded by the remaining time of the Lambda
+    function invocation
+    """
+
+    if context is None:
+        return timeout
+
+    remaining = context.get_remaining_time_in_millis() / 1000 - TIMEOUT_MARGIN
+    if timeout is not None:
+        remaining = min(remaining, timeout)
+
+    return max(remaining, MIN_TIMEOUT)
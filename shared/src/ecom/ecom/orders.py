@@ -0,0 +1,26 @@
+"""
+Order status state machine
+
+This is used by the functions of the orders service that apply status
+changes and that publish them, so that both follow the same transitions.
+"""
+
+
+__all__ = ["ALLOWED_TRANSITIONS", "STATUS_TRANSITIONS"]
+
+
+# Statuses from which an order can move to a given status
+ALLOWED_TRANSITIONS = {
+    "PACKAGED": ["NEW"],
+    "PACKAGING_FAILED": ["NEW"],
+    "FULFILLED": ["PACKAGED"],
+    "DELIVERY_FAILED": ["PACKAGED"]
+}
+
+
+# Allowed transitions, as (old status, new status) pairs
+STATUS_TRANSITIONS = {
+    (old_status, new_status)
+    for new_status, old_statuses in ALLOWED_TRANSITIONS.items()
+    for old_status in old_statuses
+}
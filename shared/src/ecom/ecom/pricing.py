@@ -0,0 +1,77 @@
+"""
+Delivery pricing engine
+
+This is used by the delivery-pricing service and by other services that need
+to compute delivery prices without calling it. RATE_TABLE_VERSION must be
+changed whenever the rate table changes, so that services built with an older
+version of this module know that their local prices are stale.
+"""
+
+
+import math
+from typing import Dict, List
+
+
+__all__ = [
+    "BOX_VOLUME", "BOX_WEIGHT", "COUNTRY_SHIPPING_FEES", "RATE_TABLE_VERSION",
+    "count_boxes", "get_pricing", "get_shipping_cost"
+]
+
+
+RATE_TABLE_VERSION = "1"
+
+
+# 50*50*50 cm cube
+BOX_VOLUME = 500*500*500
+# 12kg per box
+BOX_WEIGHT = 12000
+
+
+COUNTRY_SHIPPING_FEES = {
+    # Nordics countries
+    "DK":    0, "FI":    0, "NO":    0, "SE":    0,
+
+    # Other EU countries
+    "AT": 1000, "BE": 1000, "BG": 1000, "CY": 1000,
+    "CZ": 1000, "DE": 1000, "EE": 1000, "ES": 1000,
+    "FR": 1000, "GR": 1000, "HR": 1000, "HU": 1000,
+    "IE": 1000, "IT": 1000, "LT": 1000, "LU": 1000,
+    "LV": 1000, "MT": 1000, "NL": 1000, "PO": 1000,
+    "PT": 1000, "RO": 1000, "SI": 1000, "SK": 1000,
+
+    # North America
+    "CA": 1500, "US": 1500,
+
+    # Rest of the world
+    "*": 2500
+}
+
+
+def count_boxes(packages: List[dict], box_volume: int = BOX_VOLUME, box_weight: int = BOX_WEIGHT) -> int:
+    """
+    Count number of boxes based on the product packaging
+    """
+
+    volume = sum([p["width"]*p["length"]*p["height"] for p in packages])
+    weight = sum([p["weight"] for p in packages])
+
+    return max(math.ceil(volume/box_volume), math.ceil(weight/box_weight))
+
+
+def get_shipping_cost(address: dict, country_shipping_fees: Dict[str, int] = None) -> int:
+    """
+    Get the shipping cost per box
+    """
+
+    if country_shipping_fees is None:
+        country_shipping_fees = COUNTRY_SHIPPING_FEES
+
+    return country_shipping_fees.get(address["country"], country_shipping_fees["*"])
+
+
+def get_pricing(products: List[dict], address: dict) -> int:
+    """
+    Calculate the delivery cost for a specific address and list of products
+    """
+
+    return count_boxes([p["package"] for p in products]) * get_shipping_cost(address)
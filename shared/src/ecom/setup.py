@@ -6,6 +6,10 @@ from setuptools import find_packages, setup
 
 setup(
     author="Amazon Web Services",
+    extras_require={
+        "aiobackend": ["aiohttp"],
+        "backend": ["aws_requests_auth", "requests"]
+    },
     install_requires=["boto3"],
     license="MIT-0",
     name="ecom",
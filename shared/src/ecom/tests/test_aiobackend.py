@@ -0,0 +1,244 @@
+import asyncio
+import json
+from aiohttp import web
+import pytest
+from ecom import aiobackend # pylint: disable=import-error
+
+
+class FakeContext:
+    def __init__(self, remaining: int):
+        self.remaining = remaining
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining
+
+
+@pytest.fixture
+def server():
+    """
+    Start a local HTTP server in the shared event loop
+
+    The requests received are stored in `server.requests`.
+    """
+
+    requests = []
+
+    async def handle(request):
+        body = await request.text()
+        requests.append({
+            "method": request.method,
+            "path": request.path,
+            "headers": dict(request.headers),
+            "body": json.loads(body) if body else None
+        })
+        if request.path == "/backend/text":
+            return web.Response(text="not json")
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handle)
+    runner = web.AppRunner(app)
+    aiobackend.run(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    aiobackend.run(site.start())
+    port = runner.addresses[0][1]
+
+    class Server:
+        url = "http://127.0.0.1:{}".format(port)
+
+    Server.requests = requests
+    yield Server
+
+    aiobackend.run(runner.cleanup())
+
+
+def test_run():
+    """
+    Test that run() reuses the same event loop
+    """
+
+    async def get_running_loop():
+        return asyncio.get_running_loop()
+
+    loop = aiobackend.run(get_running_loop())
+
+    assert aiobackend.run(get_running_loop()) is loop
+    assert aiobackend.get_loop() is loop
+
+
+def test_post(server):
+    """
+    Test post()
+    """
+
+    status, body = aiobackend.run(aiobackend.post(
+        server.url+"/backend/validate",
+        context=FakeContext(3000),
+        json={"key": "value"}
+    ))
+
+    assert status == 200
+    assert body == {"ok": True}
+    assert len(server.requests) == 1
+    assert server.requests[0]["method"] == "POST"
+    assert server.requests[0]["body"] == {"key": "value"}
+    assert "Authorization" in server.requests[0]["headers"]
+
+
+def test_get(server):
+    """
+    Test get()
+    """
+
+    status, body = aiobackend.run(aiobackend.get(server.url+"/backend/text"))
+
+    assert status == 200
+    assert body is None
+    assert server.requests[0]["method"] == "GET"
+    assert server.requests[0]["body"] is None
+
+
+def test_connection_reuse(server):
+    """
+    Test that requests share the same connection pool
+    """
+
+    async def send():
+        return await asyncio.gather(*[
+            aiobackend.get(server.url+"/backend/{}".format(i))
+            for i in range(5)
+        ])
+
+    aiobackend.run(send())
+    client = aiobackend._client # pylint: disable=protected-access
+    aiobackend.run(send())
+
+    assert aiobackend._client is client # pylint: disable=protected-access
+    assert len(server.requests) == 10
+
+
+
+def test_latency_tracker():
+    """
+    Test LatencyTracker
+    """
+
+    tracker = aiobackend.LatencyTracker(window_size=100, min_samples=10)
+    for i in range(9):
+        tracker.add(i)
+    assert tracker.percentile(50) is None
+
+    for i in range(9, 200):
+        tracker.add(i)
+    # Only the last 100 samples are kept
+    assert tracker.percentile(0) == 100
+    assert tracker.percentile(50) == 149
+    assert tracker.percentile(95) == 194
+    assert tracker.percentile(100) == 199
+
+
+def test_hedge():
+    """
+    Test hedge()
+    """
+
+    calls = []
+
+    async def slow_then_fast():
+        calls.append(True)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+            return "slow"
+        return "fast"
+
+    assert aiobackend.run(aiobackend.hedge(slow_then_fast, 0.01)) == "fast"
+    assert len(calls) == 2
+
+
+def test_hedge_no_delay():
+    """
+    Test hedge() without a delay
+    """
+
+    calls = []
+
+    async def slow():
+        calls.append(True)
+        await asyncio.sleep(0.05)
+        return "slow"
+
+    assert aiobackend.run(aiobackend.hedge(slow, None)) == "slow"
+    assert len(calls) == 1
+
+
+def test_hedge_failure():
+    """
+    Test hedge() when the first request fails after the second one started
+    """
+
+    calls = []
+
+    async def fail_then_succeed():
+        calls.append(True)
+        if len(calls) == 1:
+            await asyncio.sleep(0.05)
+            raise ValueError("Something went wrong")
+        await asyncio.sleep(0.1)
+        return "ok"
+
+    assert aiobackend.run(aiobackend.hedge(fail_then_succeed, 0.01)) == "ok"
+
+    async def always_fail():
+        raise ValueError("Something went wrong")
+
+    with pytest.raises(ValueError):
+        aiobackend.run(aiobackend.hedge(always_fail, 0.01))
+
+
+def test_hedge_failure_same_round(monkeypatch):
+    """
+    Test hedge() when both requests complete together and the first one failed
+    """
+
+    async def fail():
+        raise ValueError("Something went wrong")
+
+    async def succeed():
+        return "ok"
+
+    factories = iter([fail, succeed])
+    wait = asyncio.wait
+
+    async def _wait(aws, timeout=None, return_when=asyncio.ALL_COMPLETED):
+        # Let both requests complete before returning
+        await asyncio.sleep(0.01)
+        done, pending = await wait(aws, timeout=timeout, return_when=return_when)
+        if timeout is not None:
+            return set(), pending | done
+        # Failed requests first
+        return sorted(done, key=lambda task: task.exception() is None), pending
+
+    monkeypatch.setattr(aiobackend.asyncio, "wait", _wait)
+
+    assert aiobackend.run(aiobackend.hedge(lambda: next(factories)(), 0.01)) == "ok"
+
+
+def test_gather():
+    """
+    Test gather()
+    """
+
+    running = []
+    max_running = []
+
+    async def task(i):
+        running.append(i)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(i)
+        return i
+
+    results = aiobackend.run(aiobackend.gather([task(i) for i in range(10)], limit=3))
+
+    assert results == list(range(10))
+    assert max(max_running) == 3
@@ -0,0 +1,60 @@
+import json
+import pytest
+import requests_mock
+from ecom import backend, helpers # pylint: disable=import-error
+
+
+class FakeContext:
+    def __init__(self, remaining: int):
+        self.remaining = remaining
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining
+
+
+def test_get_session():
+    """
+    Test get_session()
+    """
+
+    session = backend.get_session("https://example.local/prod/backend/validate")
+
+    assert backend.get_session("https://example.local/prod/backend/pricing") is session
+    assert backend.get_session("https://other.local/prod/backend/validate") is not session
+    assert session.auth.aws_host == "example.local"
+
+
+def test_post():
+    """
+    Test post()
+    """
+
+    url = "mock://BACKEND_API_URL/backend/validate"
+
+    with requests_mock.Mocker() as m:
+        m.post(url, text=json.dumps({"ok": True}))
+
+        response = backend.post(url, context=FakeContext(3000), json={"key": "value"})
+
+    assert response.json() == {"ok": True}
+    assert m.call_count == 1
+    assert m.request_history[0].json() == {"key": "value"}
+    assert m.request_history[0].timeout == 3 - helpers.TIMEOUT_MARGIN
+    assert "Authorization" in m.request_history[0].headers
+
+
+def test_get():
+    """
+    Test get()
+    """
+
+    url = "mock://BACKEND_API_URL/backend/123"
+
+    with requests_mock.Mocker() as m:
+        m.get(url, text=json.dumps({"orderId": "123"}))
+
+        response = backend.get(url)
+
+    assert response.json() == {"orderId": "123"}
+    assert m.request_history[0].method == "GET"
+    assert m.request_history[0].timeout is None
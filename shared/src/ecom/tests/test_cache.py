@@ -0,0 +1,68 @@
+from ecom import cache # pylint: disable=import-error
+
+
+def test_get_set():
+    """
+    Test TTLCache.get() and TTLCache.set()
+    """
+
+    ttl_cache = cache.TTLCache()
+
+    assert ttl_cache.get("key") is None
+    assert ttl_cache.get("key", "default") == "default"
+    ttl_cache.set("key", "value")
+    assert ttl_cache.get("key") == "value"
+
+    assert ttl_cache.hits == 1
+    assert ttl_cache.misses == 2
+
+
+def test_expiry():
+    """
+    Test that entries expire after the TTL
+    """
+
+    ttl_cache = cache.TTLCache(ttl=60)
+
+    ttl_cache.set("key", "value", ttl=-1)
+    assert ttl_cache.get("key") is None
+    assert len(ttl_cache) == 0
+
+    ttl_cache.set("key", "value")
+    assert ttl_cache.get("key") == "value"
+
+
+def test_eviction():
+    """
+    Test that the least recently used entries are evicted
+    """
+
+    ttl_cache = cache.TTLCache(maxsize=2)
+
+    ttl_cache.set("key1", "value1")
+    ttl_cache.set("key2", "value2")
+    ttl_cache.get("key1")
+    ttl_cache.set("key3", "value3")
+
+    assert len(ttl_cache) == 2
+    assert ttl_cache.get("key1") == "value1"
+    assert ttl_cache.get("key2") is None
+    assert ttl_cache.get("key3") == "value3"
+
+
+def test_delete():
+    """
+    Test TTLCache.delete() and TTLCache.clear()
+    """
+
+    ttl_cache = cache.TTLCache()
+    ttl_cache.set("key1", "value1")
+    ttl_cache.set("key2", "value2")
+
+    ttl_cache.delete("key1")
+    ttl_cache.delete("missing")
+    assert ttl_cache.get("key1") is None
+    assert ttl_cache.get("key2") == "value2"
+
+    ttl_cache.clear()
+    assert len(ttl_cache) == 0
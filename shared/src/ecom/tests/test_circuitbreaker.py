@@ -0,0 +1,123 @@
+import time
+from botocore.exceptions import ClientError
+from ecom import circuitbreaker # pylint: disable=import-error
+
+
+class FakeTable:
+    """
+    Fake DynamoDB table with an "id" partition key
+    """
+
+    def __init__(self, fail: bool = False):
+        self.items = {}
+        self.fail = fail
+        self.get_count = 0
+
+    def _check(self, operation: str):
+        if self.fail:
+            raise ClientError({"Error": {"Code": "InternalServerError", "Message": ""}}, operation)
+
+    def get_item(self, Key):
+        self._check("GetItem")
+        self.get_count += 1
+        item = self.items.get(Key["id"])
+        return {"Item": item} if item is not None else {}
+
+    def put_item(self, Item):
+        self._check("PutItem")
+        self.items[Item["id"]] = Item
+
+    def delete_item(self, Key):
+        self._check("DeleteItem")
+        self.items.pop(Key["id"], None)
+
+
+def test_open():
+    """
+    Test that the circuit opens after the failure threshold
+    """
+
+    breaker = circuitbreaker.CircuitBreaker("test", failure_threshold=3)
+
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.state == circuitbreaker.CLOSED
+
+    # Successes reset the failure count
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == circuitbreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == circuitbreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_half_open():
+    """
+    Test the half-open state
+    """
+
+    breaker = circuitbreaker.CircuitBreaker("test", failure_threshold=1, recovery_timeout=30)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    # Only one probe request is let through
+    breaker.opened_at -= 30
+    assert breaker.allow_request()
+    assert breaker.state == circuitbreaker.HALF_OPEN
+    assert not breaker.allow_request()
+
+    # Failed probe
+    breaker.record_failure()
+    assert breaker.state == circuitbreaker.OPEN
+    assert not breaker.allow_request()
+
+    # Successful probe
+    breaker.opened_at -= 30
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == circuitbreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_shared_state():
+    """
+    Test sharing the state through a DynamoDB table
+    """
+
+    table = FakeTable()
+    breaker1 = circuitbreaker.CircuitBreaker("test", failure_threshold=1, table=table)
+    breaker2 = circuitbreaker.CircuitBreaker("test", failure_threshold=1, table=table, sync_interval=60)
+
+    assert breaker2.allow_request()
+    breaker1.record_failure()
+    assert table.items["test"]["openUntil"] >= int(time.time())
+
+    # breaker2 only reads the shared state every sync_interval
+    assert breaker2.allow_request()
+    assert table.get_count == 1
+    breaker2._synced_at -= 60 # pylint: disable=protected-access
+    assert not breaker2.allow_request()
+    assert breaker2.state == circuitbreaker.OPEN
+
+    # Closing the circuit clears the shared state
+    breaker1.opened_at -= breaker1.recovery_timeout
+    assert breaker1.allow_request()
+    breaker1.record_success()
+    assert "test" not in table.items
+
+
+def test_shared_state_errors():
+    """
+    Test that DynamoDB errors do not break the circuit breaker
+    """
+
+    breaker = circuitbreaker.CircuitBreaker("test", failure_threshold=1, table=FakeTable(fail=True))
+
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == circuitbreaker.OPEN
+    assert not breaker.allow_request()
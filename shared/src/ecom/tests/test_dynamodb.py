@@ -0,0 +1,113 @@
+import decimal
+import timeit
+import uuid
+import pytest
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from ecom import dynamodb # pylint: disable=import-error
+
+
+def get_item(n_products: int = 10) -> dict:
+    """
+    Return an order-like item with nested maps, lists and sets
+    """
+
+    return {
+        "orderId": str(uuid.uuid4()),
+        "status": "NEW",
+        "isNew": True,
+        "deleted": None,
+        "total": decimal.Decimal("12345"),
+        "ratio": decimal.Decimal("-0.25"),
+        "tags": {"red", "blue"},
+        "sizes": {decimal.Decimal("1"), decimal.Decimal("2.5")},
+        "blobs": {Binary(b"\x00\x01"), Binary(b"\x02")},
+        "raw": Binary(b"\x03\x04"),
+        "products": [{
+            "productId": str(uuid.uuid4()),
+            "name": "Product {}".format(i),
+            "package": {
+                "width": decimal.Decimal(i*10),
+                "length": decimal.Decimal(i*20),
+                "height": decimal.Decimal(i*30),
+                "weight": decimal.Decimal(i*40)
+            },
+            "price": decimal.Decimal(i*100),
+            "quantity": decimal.Decimal("-3")
+        } for i in range(n_products)],
+        "address": {
+            "name": "John Doe",
+            "streetAddress": "123 Street St",
+            "country": "SE"
+        }
+    }
+
+
+def serialize(item: dict) -> dict:
+    serializer = TypeSerializer()
+    return {k: serializer.serialize(v) for k, v in item.items()}
+
+
+def test_deserialize_image():
+    """
+    Test deserialize_image() against boto3's TypeDeserializer
+    """
+
+    image = serialize(get_item())
+    boto3_deserialize = TypeDeserializer().deserialize
+
+    expected = {k: boto3_deserialize(v) for k, v in image.items()}
+    retval = dynamodb.deserialize_image(image)
+
+    assert retval == expected
+    for key, value in expected.items():
+        assert type(retval[key]) == type(value)
+    assert isinstance(retval["products"][0]["price"], decimal.Decimal)
+
+
+def test_deserialize_use_int():
+    """
+    Test deserialize() with use_int
+    """
+
+    assert dynamodb.deserialize({"N": "123"}, use_int=True) == 123
+    assert isinstance(dynamodb.deserialize({"N": "123"}, use_int=True), int)
+    assert isinstance(dynamodb.deserialize({"N": "-123"}, use_int=True), int)
+    assert dynamodb.deserialize({"N": "1.5"}, use_int=True) == decimal.Decimal("1.5")
+    assert dynamodb.deserialize({"N": "1E+2"}, use_int=True) == decimal.Decimal("100")
+    assert dynamodb.deserialize({"NS": ["1", "2.5"]}, use_int=True) == {1, decimal.Decimal("2.5")}
+
+    retval = dynamodb.deserialize_image(serialize(get_item()), use_int=True)
+    assert isinstance(retval["products"][1]["package"]["width"], int)
+    assert isinstance(retval["ratio"], decimal.Decimal)
+
+
+@pytest.mark.parametrize("value", [{}, {"X": "value"}, "value", None])
+def test_deserialize_invalid(value):
+    """
+    Test deserialize() with invalid values
+    """
+
+    with pytest.raises(TypeError):
+        dynamodb.deserialize(value)
+
+
+def test_deserialize_benchmark():
+    """
+    Test that deserialize_image() matches and outperforms boto3's TypeDeserializer
+    """
+
+    image = serialize(get_item(50))
+    boto3_deserialize = TypeDeserializer().deserialize
+    number = 200
+
+    def reference():
+        return {k: boto3_deserialize(v) for k, v in image.items()}
+
+    assert dynamodb.deserialize_image(image) == reference()
+
+    results = {
+        "boto3": timeit.timeit(reference, number=number),
+        "ecom": timeit.timeit(lambda: dynamodb.deserialize_image(image), number=number)
+    }
+
+    assert results["ecom"] < results["boto3"]
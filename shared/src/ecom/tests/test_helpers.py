@@ -1,9 +1,11 @@
 import datetime
 import decimal
 import json
+import time
+import timeit
 import uuid
 import pytest
-from ecom import apigateway, eventbridge, helpers # pylint: disable=import-error
+from ecom import apigateway, dynamodb, eventbridge, helpers # pylint: disable=import-error
 
 
 def test_encoder(lambda_module):
@@ -204,4 +206,630 @@ def test_response_status():
 
     status_code = 400
     retval = apigateway.response("Message", status_code)
-    assert retval["statusCode"] == status_code
\ No newline at end of file
+    assert retval["statusCode"] == status_code
+
+
+def get_modify_record(new_image: dict, old_image: dict) -> dict:
+    """
+    Return a MODIFY record
+    """
+
+    return {
+        "awsRegion": "eu-west-1",
+        "dynamodb": {
+            "Keys": {
+                "pk": {"S": "123"}
+            },
+            "NewImage": new_image,
+            "OldImage": old_image,
+            "SequenceNumber": "1234567890123456789012345",
+            "SizeBytes": 123,
+            "StreamViewType": "NEW_AND_OLD_IMAGES"
+        },
+        "eventID": str(uuid.uuid4()),
+        "eventName": "MODIFY",
+        "eventSource": "aws:dynamodb",
+        "eventVersion": "1.0"
+    }
+
+
+def test_ddb_to_event_modify_changed():
+    """
+    Test ddb_to_event() changed fields with a MODIFY record
+    """
+
+    record = get_modify_record({
+        "pk": {"S": "123"},
+        "status": {"S": "COMPLETED"},
+        "tags": {"L": [{"S": "a"}, {"S": "b"}]},
+        "price": {"N": "100"},
+        "new": {"BOOL": True}
+    }, {
+        "pk": {"S": "123"},
+        "status": {"S": "NEW"},
+        "tags": {"L": [{"S": "a"}, {"S": "b"}]},
+        "price": {"N": "100"},
+        "old": {"BOOL": True}
+    })
+
+    retval = eventbridge.ddb_to_event(record, "EVENT_BUS_NAME", "SOURCE", "Object", "pk")
+
+    assert retval["DetailType"] == "ObjectModified"
+    detail = json.loads(retval["Detail"])
+    assert detail["changed"] == ["old", "status", "new"]
+    assert detail["new"]["price"] == 100
+    assert detail["old"]["price"] == 100
+
+
+def test_ddb_to_event_modify_changed_only():
+    """
+    Test ddb_to_event() with changed_only
+    """
+
+    record = get_modify_record({
+        "pk": {"S": "123"},
+        "status": {"S": "COMPLETED"},
+        "tags": {"SS": ["b", "a"]},
+        "price": {"N": "100"}
+    }, {
+        "pk": {"S": "123"},
+        "status": {"S": "NEW"},
+        "tags": {"SS": ["a", "b"]},
+        "price": {"N": "100"}
+    })
+
+    retval = eventbridge.ddb_to_event(record, "EVENT_BUS_NAME", "SOURCE", "Object", "pk", changed_only=True)
+
+    assert json.loads(retval["Detail"]) == {
+        "new": {"pk": "123", "status": "COMPLETED"},
+        "old": {"pk": "123", "status": "NEW"},
+        "changed": ["status"]
+    }
+
+
+def test_ddb_to_event_modify_skip_unchanged():
+    """
+    Test ddb_to_event() with skip_unchanged
+    """
+
+    record = get_modify_record({
+        "pk": {"S": "123"},
+        "tags": {"NS": ["1", "2"]}
+    }, {
+        "pk": {"S": "123"},
+        "tags": {"NS": ["2", "1"]}
+    })
+
+    retval = eventbridge.ddb_to_event(record, "EVENT_BUS_NAME", "SOURCE", "Object", "pk", skip_unchanged=True)
+    assert retval is None
+
+
+def get_insert_record(pk: str) -> dict:
+    """
+    Return an INSERT record
+    """
+
+    return {
+        "awsRegion": "eu-west-1",
+        "dynamodb": {
+            "Keys": {
+                "pk": {"S": pk}
+            },
+            "NewImage": {
+                "pk": {"S": pk},
+                "status": {"S": "NEW"},
+                "products": {"L": [{"M": {
+                    "productId": {"S": str(uuid.uuid4())},
+                    "price": {"N": "100"},
+                    "quantity": {"N": "2"},
+                    "package": {"M": {
+                        "width": {"N": "100"},
+                        "length": {"N": "200"},
+                        "height": {"N": "300"},
+                        "weight": {"N": "400"}
+                    }}
+                }} for _ in range(5)]},
+                "total": {"N": "1000.5"}
+            },
+            "SequenceNumber": "1234567890123456789012345",
+            "SizeBytes": 123,
+            "StreamViewType": "NEW_AND_OLD_IMAGES"
+        },
+        "eventID": str(uuid.uuid4()),
+        "eventName": "INSERT",
+        "eventSource": "aws:dynamodb",
+        "eventVersion": "1.0"
+    }
+
+
+@pytest.mark.parametrize("batch_size", [25, 100, 1000])
+def test_records_to_events(batch_size):
+    """
+    Test records_to_events()
+    """
+
+    records = [get_insert_record(str(i)) for i in range(batch_size)]
+
+    retval = eventbridge.records_to_events(records, "EVENT_BUS_NAME", "SOURCE", "Object", "pk")
+
+    assert len(retval) == len(records)
+    assert len(set(event["Time"] for event in retval)) == 1
+    for record, event in zip(records, retval):
+        expected = eventbridge.ddb_to_event(record, "EVENT_BUS_NAME", "SOURCE", "Object", "pk")
+        expected["Time"] = event["Time"]
+        assert event == expected
+        # Same detail as encoding the Decimal values
+        assert event["Detail"] == helpers.dumps(dynamodb.deserialize_image(record["dynamodb"]["NewImage"]))
+
+
+def test_records_to_events_skip_record():
+    """
+    Test records_to_events() with skip_record
+    """
+
+    records = [get_insert_record(str(i)) for i in range(10)]
+
+    retval = eventbridge.records_to_events(
+        records, "EVENT_BUS_NAME", "SOURCE", "Object", "pk",
+        skip_record=lambda r: int(r["dynamodb"]["Keys"]["pk"]["S"]) % 2 == 0
+    )
+
+    assert [event["Resources"] for event in retval] == [[str(i)] for i in range(1, 10, 2)]
+
+
+def test_changed_keys():
+    """
+    Test changed_keys()
+    """
+
+    old_image = {
+        "pk": {"S": "1"},
+        "status": {"S": "NEW"},
+        "tags": {"SS": ["a", "b"]},
+        "removed": {"N": "1"}
+    }
+    new_image = {
+        "pk": {"S": "1"},
+        "status": {"S": "PACKAGED"},
+        # Same set in a different order
+        "tags": {"SS": ["b", "a"]},
+        "added": {"N": "1"}
+    }
+
+    assert sorted(eventbridge.changed_keys(new_image, old_image)) == ["added", "removed", "status"]
+    assert eventbridge.changed_keys(old_image, old_image) == []
+
+
+def get_keyed_modify_record(pk: str, old_status: str, new_status: str) -> dict:
+    """
+    Return a MODIFY record for a key and a status change
+    """
+
+    record = get_modify_record(
+        {"pk": {"S": pk}, "status": {"S": new_status}},
+        {"pk": {"S": pk}, "status": {"S": old_status}}
+    )
+    record["dynamodb"]["Keys"]["pk"]["S"] = pk
+    return record
+
+
+def test_coalesce_records():
+    """
+    Test coalesce_records()
+    """
+
+    insert_b = get_insert_record("b")
+    records = [
+        get_keyed_modify_record("a", "1", "2"),
+        insert_b,
+        get_keyed_modify_record("a", "2", "3"),
+        get_keyed_modify_record("b", "NEW", "4"),
+        get_keyed_modify_record("a", "3", "4"),
+        get_keyed_modify_record("c", "1", "2")
+    ]
+
+    retval = eventbridge.coalesce_records(records)
+
+    assert [(r["eventName"], r["dynamodb"]["Keys"]["pk"]["S"]) for r in retval] == [
+        ("INSERT", "b"), ("MODIFY", "b"), ("MODIFY", "a"), ("MODIFY", "c")
+    ]
+    # The INSERT record is not merged with the following MODIFY record
+    assert retval[0] is insert_b
+    assert retval[2]["dynamodb"]["OldImage"]["status"]["S"] == "1"
+    assert retval[2]["dynamodb"]["NewImage"]["status"]["S"] == "4"
+    assert retval[2]["eventID"] == records[4]["eventID"]
+    # Input records are not modified
+    assert records[4]["dynamodb"]["OldImage"]["status"]["S"] == "3"
+
+
+def test_coalesce_records_remove():
+    """
+    Test coalesce_records() with a REMOVE record between MODIFY records
+    """
+
+    remove = get_keyed_modify_record("a", "2", "3")
+    remove["eventName"] = "REMOVE"
+    records = [
+        get_keyed_modify_record("a", "1", "2"),
+        remove,
+        get_keyed_modify_record("a", "1", "2")
+    ]
+
+    assert eventbridge.coalesce_records(records) == records
+
+
+def test_coalesce_records_boundary_keys():
+    """
+    Test coalesce_records() with boundary keys
+    """
+
+    records = [
+        get_keyed_modify_record("a", "1", "2"),
+        get_keyed_modify_record("a", "2", "2"),
+        get_keyed_modify_record("a", "2", "3"),
+        get_keyed_modify_record("a", "3", "3")
+    ]
+
+    retval = eventbridge.coalesce_records(records, ["status"])
+
+    # Each status change stays in its own record
+    assert [
+        (r["dynamodb"]["OldImage"]["status"]["S"], r["dynamodb"]["NewImage"]["status"]["S"])
+        for r in retval
+    ] == [("1", "2"), ("2", "3")]
+    assert retval[0]["eventID"] == records[1]["eventID"]
+    assert retval[1]["eventID"] == records[3]["eventID"]
+
+
+def test_records_to_events_coalesce():
+    """
+    Test records_to_events() with coalesce
+    """
+
+    records = [get_keyed_modify_record("a", str(i), str(i+1)) for i in range(10)]
+
+    retval = eventbridge.records_to_events(
+        records, "EVENT_BUS_NAME", "SOURCE", "Object", "pk", coalesce=True
+    )
+
+    assert len(retval) == 1
+    detail = json.loads(retval[0]["Detail"])
+    assert detail["old"]["status"] == "0"
+    assert detail["new"]["status"] == "10"
+    assert detail["changed"] == ["status"]
+
+
+@pytest.mark.parametrize("batch_size", [100, 1000])
+def test_records_to_events_benchmark(batch_size):
+    """
+    Test that records_to_events() is faster than calling ddb_to_event() per record
+    """
+
+    records = [get_insert_record(str(i)) for i in range(batch_size)]
+    number = 2000 // batch_size
+
+    results = {
+        "ddb_to_event": min(timeit.repeat(lambda: [
+            eventbridge.ddb_to_event(record, "EVENT_BUS_NAME", "SOURCE", "Object", "pk")
+            for record in records
+        ], number=number, repeat=5)),
+        "records_to_events": min(timeit.repeat(lambda: eventbridge.records_to_events(
+            records, "EVENT_BUS_NAME", "SOURCE", "Object", "pk"
+        ), number=number, repeat=5))
+    }
+
+    assert results["records_to_events"] < results["ddb_to_event"]
+
+
+class FakeEventBridge:
+    """
+    Fake EventBridge client
+
+    This fails the first `failures` entries it receives with `error_code` and
+    sleeps `latency` seconds per request.
+    """
+
+    def __init__(self, failures: int = 0, latency: float = 0, error_code: str = "ThrottlingException"):
+        self.failures = failures
+        self.latency = latency
+        self.error_code = error_code
+        self.requests = []
+
+    def put_events(self, Entries): # pylint: disable=invalid-name
+        self.requests.append(Entries)
+        time.sleep(self.latency)
+
+        results = []
+        for _ in Entries:
+            if self.failures > 0:
+                self.failures -= 1
+                results.append({"ErrorCode": self.error_code, "ErrorMessage": "Something went wrong"})
+            else:
+                results.append({"EventId": str(uuid.uuid4())})
+
+        return {
+            "FailedEntryCount": len([r for r in results if "ErrorCode" in r]),
+            "Entries": results
+        }
+
+
+def get_entry(detail_size: int = 100) -> dict:
+    return {
+        "Time": datetime.datetime.now(),
+        "Source": "SOURCE",
+        "Resources": [str(uuid.uuid4())],
+        "DetailType": "ObjectCreated",
+        "Detail": json.dumps({"data": "x"*detail_size}),
+        "EventBusName": "EVENT_BUS_NAME"
+    }
+
+
+def test_publish_events_count():
+    """
+    Test publish_events() splitting by count
+    """
+
+    client = FakeEventBridge()
+    entries = [get_entry() for _ in range(25)]
+
+    retval = eventbridge.publish_events(client, entries)
+
+    assert retval["failed"] == []
+    assert retval["attempts"] == 1
+    assert sorted(len(r) for r in client.requests) == [5, 10, 10]
+
+
+def test_publish_events_size():
+    """
+    Test publish_events() splitting by size
+    """
+
+    client = FakeEventBridge()
+    entries = [get_entry(100*1024) for _ in range(5)]
+    entries.append(get_entry(300*1024))
+
+    retval = eventbridge.publish_events(client, entries)
+
+    assert len(client.requests) == 3
+    for request in client.requests:
+        assert sum(eventbridge.entry_size(e) for e in request) <= eventbridge.MAX_REQUEST_SIZE
+    assert len(retval["failed"]) == 1
+    assert retval["failed"][0]["ErrorCode"] == "EntryTooLarge"
+    assert retval["failed"][0]["Entry"] == entries[-1]
+
+
+def test_publish_events_retry():
+    """
+    Test publish_events() retrying failed entries
+    """
+
+    client = FakeEventBridge(failures=3)
+    entries = [get_entry() for _ in range(10)]
+
+    retval = eventbridge.publish_events(client, entries, backoff=0)
+
+    assert retval["failed"] == []
+    assert retval["attempts"] == 2
+    assert len(client.requests) == 2
+    assert client.requests[1] == entries[:3]
+
+
+def test_publish_events_retry_exhausted():
+    """
+    Test publish_events() when retries are exhausted
+    """
+
+    client = FakeEventBridge(failures=100)
+    entries = [get_entry() for _ in range(10)]
+
+    retval = eventbridge.publish_events(client, entries, max_attempts=3, backoff=0)
+
+    assert retval["attempts"] == 3
+    assert len(retval["failed"]) == 10
+    assert retval["failed"][0]["ErrorCode"] == "ThrottlingException"
+
+
+def test_publish_events_permanent_failure():
+    """
+    Test publish_events() with entries that are not worth retrying
+    """
+
+    client = FakeEventBridge(failures=3, error_code="AccessDeniedException")
+    entries = [get_entry() for _ in range(10)]
+
+    retval = eventbridge.publish_events(client, entries, backoff=0)
+
+    assert retval["attempts"] == 1
+    assert len(client.requests) == 1
+    assert [f["Entry"] for f in retval["failed"]] == entries[:3]
+    assert retval["failed"][0]["ErrorCode"] == "AccessDeniedException"
+
+
+def test_publish_events_raise_on_failure():
+    """
+    Test publish_events() with raise_on_failure and a logger
+    """
+
+    class FakeLogger:
+        def __init__(self):
+            self.messages = {"info": [], "error": []}
+
+        def info(self, message):
+            self.messages["info"].append(message)
+
+        def error(self, message):
+            self.messages["error"].append(message)
+
+    logger = FakeLogger()
+    client = FakeEventBridge(failures=2, error_code="AccessDeniedException")
+    entries = [get_entry() for _ in range(10)]
+
+    with pytest.raises(eventbridge.PublishError) as exc_info:
+        eventbridge.publish_events(client, entries, logger=logger, raise_on_failure=True)
+
+    assert [f["Entry"] for f in exc_info.value.failed] == entries[:2]
+    assert logger.messages["info"][0]["message"] == "Sent 8 events to EventBridge"
+    assert len(logger.messages["error"][0]["failed"]) == 2
+
+    # No failures
+    logger = FakeLogger()
+    retval = eventbridge.publish_events(FakeEventBridge(), entries, logger=logger, raise_on_failure=True)
+    assert retval["failed"] == []
+    assert logger.messages["error"] == []
+
+
+def test_publish_events_benchmark():
+    """
+    Test that publish_events() is faster than sequential requests for 1000 events
+    """
+
+    entries = [get_entry() for _ in range(1000)]
+
+    client = FakeEventBridge(latency=0.005)
+    start = time.perf_counter()
+    for i in range(0, len(entries), 10):
+        client.put_events(Entries=entries[i:i+10])
+    sequential = time.perf_counter() - start
+
+    client = FakeEventBridge(latency=0.005)
+    retval = eventbridge.publish_events(client, entries, max_workers=16)
+
+    assert retval["failed"] == []
+    assert sorted(e["Resources"][0] for r in client.requests for e in r) == sorted(e["Resources"][0] for e in entries)
+    # With 16 workers, this should be several times faster
+    assert retval["latency"] < sequential*1000/2
+
+
+def get_product_item() -> dict:
+    """
+    Return a product as retrieved from DynamoDB
+    """
+
+    now = datetime.datetime.now()
+
+    return {
+        "productId": str(uuid.uuid4()),
+        "name": "Blue Socks",
+        "createdDate": now.isoformat(),
+        "modifiedDate": now,
+        "category": "Socks",
+        "tags": ["Blue", "Socks"],
+        "pictures": ["https://example.local/{}.jpg".format(i) for i in range(5)],
+        "package": {
+            "width": decimal.Decimal("500"),
+            "length": decimal.Decimal("350.5"),
+            "height": decimal.Decimal("200"),
+            "weight": decimal.Decimal("1.0")
+        },
+        "price": decimal.Decimal("1999"),
+        "ratings": (decimal.Decimal("4.5"), decimal.Decimal("-3")),
+        "available": True,
+        "discount": None
+    }
+
+
+def get_order_item(n_products: int = 20) -> dict:
+    """
+    Return an order as retrieved from DynamoDB
+    """
+
+    products = [get_product_item() for _ in range(n_products)]
+    for product in products:
+        product["quantity"] = decimal.Decimal("3")
+
+    return {
+        "orderId": str(uuid.uuid4()),
+        "userId": str(uuid.uuid4()),
+        "createdDate": datetime.date.today(),
+        "status": "NEW",
+        "products": products,
+        "address": {
+            "name": "Jöhn Doe",
+            "streetAddress": "123 Street St",
+            "country": "SE"
+        },
+        "deliveryPrice": decimal.Decimal("1500"),
+        "total": decimal.Decimal("121439.25")
+    }
+
+
+def encoder_default(o):
+    """
+    Reference implementation of Encoder.default()
+    """
+
+    if isinstance(o, datetime.datetime) or isinstance(o, datetime.date):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        if abs(o) % 1 > 0:
+            return float(o)
+        return int(o)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(o).__name__))
+
+
+@pytest.mark.parametrize("item", [
+    get_product_item(), get_order_item(), [get_order_item(2)], decimal.Decimal("1.5"), "string"
+], ids=["product", "order", "list", "decimal", "string"])
+def test_dumps(item):
+    """
+    Test dumps() against the reference JSON encoder
+    """
+
+    assert helpers.dumps(item) == json.dumps(item, default=encoder_default)
+    assert helpers.dumps(item) == json.dumps(item, cls=helpers.Encoder)
+
+
+def test_encoder_subclasses():
+    """
+    Test the JSON encoder with subclasses of the supported types
+    """
+
+    class SubDecimal(decimal.Decimal):
+        pass
+
+    class SubDate(datetime.date):
+        pass
+
+    encoder = helpers.Encoder()
+
+    assert encoder.default(SubDecimal("10.5")) == 10.5
+    assert isinstance(encoder.default(SubDecimal("10.0")), int)
+    assert encoder.default(SubDate(2020, 1, 2)) == "2020-01-02"
+    with pytest.raises(TypeError):
+        encoder.default(object())
+
+
+@pytest.mark.parametrize("item", [get_product_item(), get_order_item()], ids=["product", "order"])
+def test_dumps_benchmark(item):
+    """
+    Test that dumps() is faster than the reference JSON encoder
+    """
+
+    number = 100
+
+    results = {
+        "reference": min(timeit.repeat(lambda: json.dumps(item, default=encoder_default), number=number, repeat=5)),
+        "dumps": min(timeit.repeat(lambda: helpers.dumps(item), number=number, repeat=5))
+    }
+
+    assert results["dumps"] < results["reference"]
+
+
+class FakeContext:
+    def __init__(self, remaining: int):
+        self.remaining = remaining
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining
+
+
+def test_timeout_from_context():
+    """
+    Test timeout_from_context()
+    """
+
+    assert helpers.timeout_from_context(None) is None
+    assert helpers.timeout_from_context(None, 5) == 5
+    assert helpers.timeout_from_context(FakeContext(10000)) == 10 - helpers.TIMEOUT_MARGIN
+    assert helpers.timeout_from_context(FakeContext(10000), 2) == 2
+    assert helpers.timeout_from_context(FakeContext(0), 2) == helpers.MIN_TIMEOUT
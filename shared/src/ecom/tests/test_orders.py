@@ -0,0 +1,14 @@
+from ecom import orders # pylint: disable=import-error
+
+
+def test_status_transitions():
+    """
+    Test that STATUS_TRANSITIONS matches ALLOWED_TRANSITIONS
+    """
+
+    assert orders.STATUS_TRANSITIONS == {
+        ("NEW", "PACKAGED"),
+        ("NEW", "PACKAGING_FAILED"),
+        ("PACKAGED", "FULFILLED"),
+        ("PACKAGED", "DELIVERY_FAILED")
+    }
@@ -0,0 +1,40 @@
+from ecom import pricing # pylint: disable=import-error
+
+
+def get_products(*packages):
+    return [{"package": dict(zip(["width", "length", "height", "weight"], p))} for p in packages]
+
+
+def test_count_boxes():
+    """
+    Test count_boxes()
+    """
+
+    # Bound by volume
+    assert pricing.count_boxes([p["package"] for p in get_products((500, 500, 500, 100))]) == 1
+    assert pricing.count_boxes([p["package"] for p in get_products((500, 500, 500, 100), (10, 10, 10, 100))]) == 2
+    # Bound by weight
+    assert pricing.count_boxes([p["package"] for p in get_products((10, 10, 10, 25000))]) == 3
+    # Custom box size
+    assert pricing.count_boxes([p["package"] for p in get_products((10, 10, 10, 100))], box_volume=500, box_weight=100) == 2
+
+
+def test_get_shipping_cost():
+    """
+    Test get_shipping_cost()
+    """
+
+    assert pricing.get_shipping_cost({"country": "SE"}) == 0
+    assert pricing.get_shipping_cost({"country": "FR"}) == 1000
+    assert pricing.get_shipping_cost({"country": "JP"}) == pricing.COUNTRY_SHIPPING_FEES["*"]
+    assert pricing.get_shipping_cost({"country": "JP"}, {"JP": 10, "*": 20}) == 10
+
+
+def test_get_pricing():
+    """
+    Test get_pricing()
+    """
+
+    products = get_products((500, 500, 500, 100), (10, 10, 10, 100))
+
+    assert pricing.get_pricing(products, {"country": "US"}) == 2 * 1500
@@ -9,6 +9,7 @@ import os
 from aws_lambda_powertools.tracing import Tracer
 from aws_lambda_powertools.logging.logger import Logger
 import boto3
+from ecom.eventbridge import publish_events # pylint: disable=import-error
 
 
 ENVIRONMENT = os.environ["ENVIRONMENT"]
@@ -47,7 +48,7 @@ def send_event(event: dict):
     Send event to EventBridge
     """
 
-    eventbridge.put_events(Entries=[event])
+    publish_events(eventbridge, [event], logger=logger, raise_on_failure=True)
 
 
 @logger.inject_lambda_context
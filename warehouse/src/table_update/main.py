@@ -4,7 +4,6 @@ TableUpdateFunction
 
 
 import datetime
-import json
 import os
 import warnings
 from typing import List, Optional
@@ -15,7 +14,8 @@ from aws_lambda_powertools.metrics import MetricUnit
 import boto3
 from boto3.dynamodb.conditions import Key
 from boto3.dynamodb.types import TypeDeserializer
-from ecom.helpers import Encoder #pylint: disable=import-error
+from ecom.eventbridge import publish_events #pylint: disable=import-error
+from ecom.helpers import dumps #pylint: disable=import-error
 
 
 ENVIRONMENT = os.environ["ENVIRONMENT"]
@@ -45,17 +45,16 @@ def send_events(events: List[dict]):
     Send events to EventBridge
     """
 
-    if len(events) > 0:
-        logger.info("Sending %d events to EventBridge", len(events))
-        # EventBridge only supports batches of up to 10 events
-        for i in range(0, len(events), 10):
-            eventbridge.put_events(Entries=events[i:i+10])
-    else:
+    if len(events) == 0:
         logger.info("Skip sending %d event to EventBridge", len(events))
+        return
+
+    logger.info("Sending %d events to EventBridge", len(events))
+    publish_events(eventbridge, events, logger=logger, raise_on_failure=True)
 
 
 @tracer.capture_method
-def parse_record(ddb_record: dict) -> Optional[dict]:
+def parse_record(ddb_record: dict, now: Optional[datetime.datetime] = None) -> Optional[dict]:
     """
     Parse a DynamoDB record into an EventBridge event
     """
@@ -85,12 +84,12 @@ def parse_record(ddb_record: dict) -> Optional[dict]:
 
     # Return event
     return {
-        "Time": datetime.datetime.now(),
+        "Time": now or datetime.datetime.now(),
         "Source": "ecommerce.warehouse",
         "Resources": [order_id],
         "EventBusName": EVENT_BUS_NAME,
         "DetailType": detail_type,
-        "Detail": json.dumps(detail, cls=Encoder)
+        "Detail": dumps(detail)
     }
 
 @tracer.capture_method
@@ -153,9 +152,10 @@ def handler(event, _):
         "records": event.get("Records", [])
     })
 
-    # Parse events
+    # Parse events, all events in the batch share the same timestamp
+    now = datetime.datetime.now()
     events = [
-        parse_record(record)
+        parse_record(record, now)
         for record in event.get("Records", [])
     ]
 